@@ -45,6 +45,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'core',
     'rest_framework',
     'rest_framework.authtoken',
@@ -54,6 +55,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.queries.QueryInspectionMiddleware',
+    'core.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -102,6 +106,90 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# local memory by default, point CACHE_BACKEND/CACHE_LOCATION at a shared
+# cache (e.g. memcached, as docker-compose-deploy.yml does) in production so
+# all the uWSGI workers see it.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    },
+}
+
+# Token -> user cache of core.authentication.CachedTokenAuthentication in one
+# of the CACHES shared by all the workers, lookups go to the db without one.
+TOKEN_AUTH_CACHE = {
+    'TTL': int(os.environ.get('TOKEN_AUTH_CACHE_TTL', 30)),
+    'SHARED_CACHE': os.environ.get('TOKEN_AUTH_SHARED_CACHE') or None,
+}
+
+# Per user versioned cache of the recipe list/detail responses, see recipe.cache.
+# Unless RECIPE_CACHE_ENABLED is set, it is only used with a shared CACHE_BACKEND.
+RECIPE_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': int(os.environ.get('RECIPE_CACHE_TIMEOUT', 60 * 60)),
+    'ENABLED': (bool(int(os.environ['RECIPE_CACHE_ENABLED']))
+                if os.environ.get('RECIPE_CACHE_ENABLED') else None),
+}
+
+# Resized recipe images generated in the background, see recipe.renditions
+RENDITIONS = {
+    'WORKERS': int(os.environ.get('RENDITION_WORKERS', 2)),
+}
+
+# Tag/ingredient name autocomplete and its per worker cache, see recipe.autocomplete
+AUTOCOMPLETE = {
+    'LIMIT': 10,
+    'MAX_LIMIT': 50,
+    'CACHE_SIZE': int(os.environ.get('AUTOCOMPLETE_CACHE_SIZE', 10000)),
+    'CACHE_TTL': int(os.environ.get('AUTOCOMPLETE_CACHE_TTL', 300)),
+}
+
+# Streaming and resumable image uploads, see recipe.uploads. Keep MAX_SIZE
+# under the client_max_body_size of the proxy.
+IMAGE_UPLOAD = {
+    'MAX_SIZE': int(os.environ.get('IMAGE_UPLOAD_MAX_SIZE', 10 * 1024 * 1024)),
+    'SESSION_TTL': int(os.environ.get('IMAGE_UPLOAD_SESSION_TTL', 24 * 60 * 60)),
+}
+
+
+# Password hashing
+# https://docs.djangoproject.com/en/3.2/topics/auth/passwords/
+# PASSWORD_HASHER picks the preferred hasher, hashes made by the others are
+# still accepted and upgraded to the preferred one on the next login.
+
+_PASSWORD_HASHERS = {
+    'argon2': 'core.hashers.TunedArgon2PasswordHasher',
+    'bcrypt': 'core.hashers.TunedBCryptSHA256PasswordHasher',
+    'pbkdf2': 'core.hashers.TunedPBKDF2PasswordHasher',
+}
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'argon2')
+
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    hasher for name, hasher in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+] + ['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher']
+
+# Cost parameters of the core.hashers hashers, by algorithm
+PASSWORD_HASHER_PARAMS = {
+    'argon2': {
+        'time_cost': int(os.environ.get('ARGON2_TIME_COST', 2)),
+        'memory_cost': int(os.environ.get('ARGON2_MEMORY_COST', 19 * 1024)),
+        'parallelism': int(os.environ.get('ARGON2_PARALLELISM', 1)),
+    },
+}
+
+AUTHENTICATION_BACKENDS = ['core.backends.PooledHashingModelBackend']
+
+# Thread pool of core.hashing the logins hash passwords on
+PASSWORD_HASHING = {
+    'WORKERS': int(os.environ.get('PASSWORD_HASH_WORKERS', 2)),
+    'MAX_PENDING': int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 16)),
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 '''
@@ -141,11 +229,20 @@ USE_TZ = True
 
 #STATIC_URL = '/static/'
 STATIC_URL = '/static/static/'
-MEDIA_URL = '/static/media/'
+# media is only served to the owners of the recipes, see recipe.media
+MEDIA_URL = '/api/recipe/media/'
 
 MEDIA_ROOT = '/vol/web/media/'
 STATIC_ROOT = '/vol/web/static/'
 
+# Media files are named after their content and reference counted, see core.storage
+DEFAULT_FILE_STORAGE = 'core.storage.ContentAddressedStorage'
+
+# Authorized media transfers are handed to the proxy, runserver streams them itself
+MEDIA_ACCESS = {
+    'X_ACCEL_REDIRECT': not DEBUG,
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -154,6 +251,46 @@ AUTH_USER_MODEL = 'core.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS':'drf_spectacular.openapi.AutoSchema',
+    # orjson when it is installed, see core.fastjson
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.fastjson.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'core.fastjson.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# Per request metrics served on /metrics, see core.metrics. /metrics answers
+# 404 until METRICS_TOKEN is set, the scraper then sends it as a bearer token.
+METRICS = {
+    'ENABLED': bool(int(os.environ.get('METRICS_ENABLED', 1))),
+    'DIRECTORY': os.environ.get('METRICS_DIR', '/vol/metrics'),
+    'SERVER_TIMING': bool(int(os.environ.get('SERVER_TIMING', int(DEBUG)))),
+    'TOKEN': os.environ.get('METRICS_TOKEN', ''),
+}
+
+# Slow query logging and sampled N+1 detection, see core.queries
+QUERY_INSPECTION = {
+    'ENABLED': bool(int(os.environ.get('QUERY_INSPECTION_ENABLED', 1))),
+    'SAMPLE_RATE': float(os.environ.get('QUERY_INSPECTION_SAMPLE_RATE', 0.01)),
+    'SLOW_QUERY_MS': float(os.environ.get('SLOW_QUERY_MS', 200)),
+    'STRICT': bool(int(os.environ.get('QUERY_INSPECTION_STRICT', 0))),
+}
+
+# Incremental sync of the recipes, tags and ingredients, see recipe.sync
+SYNC = {
+    'PAGE_SIZE': int(os.environ.get('SYNC_PAGE_SIZE', 1000)),
+}
+
+# Brotli/gzip compression of the responses, see core.compression
+COMPRESSION = {
+    'ENABLED': bool(int(os.environ.get('COMPRESSION_ENABLED', 1))),
+    'MIN_SIZE': int(os.environ.get('COMPRESSION_MIN_SIZE', 1024)),
+    'GZIP_LEVEL': int(os.environ.get('GZIP_LEVEL', 6)),
+    'BROTLI_QUALITY': int(os.environ.get('BROTLI_QUALITY', 5)),
 }
 
 SPECTACULAR_SETTINGS = {
@@ -20,8 +20,8 @@ from drf_spectacular.views import (
 )
 from django.contrib import admin
 from django.urls import path,include
-from django.conf import settings
-from django.conf.urls.static import static
+
+from core import views as core_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -29,7 +29,5 @@ urlpatterns = [
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='api-schema'),name='api-docs'),
     path('api/user/', include('user.urls')),
     path('api/recipe/',include('recipe.urls')),
-]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL,document_root=settings.MEDIA_ROOT,)
\ No newline at end of file
+    path('metrics', core_views.metrics, name='metrics'),
+]
\ No newline at end of file
@@ -36,8 +36,16 @@ class UserAdmin(BaseUserAdmin):
         }),
     )
 
+
+class RecipeAdmin(admin.ModelAdmin):
+    """ Recipe admin, images are only set by the upload apis which
+    replace the renditions and release the stored files, see core.storage """
+
+    readonly_fields = ['image', 'renditions']
+
+
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Recipe)
+admin.site.register(models.Recipe, RecipeAdmin)
 admin.site.register(models.Tag)
 admin.site.register(models.Ingredient)
 
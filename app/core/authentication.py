@@ -0,0 +1,106 @@
+""" Authentication classes for the apis """
+
+import hashlib
+import logging
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+logger = logging.getLogger(__name__)
+
+TOKEN_AUTH_CACHE = {
+    'TTL': 30,
+    'SHARED_CACHE': None,
+    'STATS_LOG_INTERVAL': 10000,
+}
+TOKEN_AUTH_CACHE.update(getattr(settings, 'TOKEN_AUTH_CACHE', {}))
+
+shared_stats = {'hits': 0, 'misses': 0}
+
+
+def _shared_cache():
+    """ Return the cache shared by the workers, if one is configured """
+    alias = TOKEN_AUTH_CACHE['SHARED_CACHE']
+    return caches[alias] if alias else None
+
+
+def _shared_key(key):
+    """ Shared cache key for a token, the raw token is never stored """
+    return 'token-auth:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def cache_stats():
+    """ Return the hit rate of the shared token cache """
+    lookups = shared_stats['hits'] + shared_stats['misses']
+    return {
+        'shared': {
+            **shared_stats,
+            'hit_rate': shared_stats['hits'] / lookups if lookups else 0.0,
+        },
+    }
+
+
+def invalidate_token(key):
+    """ Drop a token from the shared cache """
+    shared = _shared_cache()
+    if shared is not None:
+        shared.delete(_shared_key(key))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """ Token authentication caching the token -> user lookup
+
+    Lookups hit the shared cache configured by SHARED_CACHE and only then
+    the database. Deleting a token or saving its user drops the entry from
+    the shared cache, so every worker sees the change on its next request.
+    There is no per worker cache: it could not be invalidated by the other
+    workers. Without a shared cache every lookup goes to the database.
+
+    The cached user is only used to authorize the request, views saving the
+    user reload it first, see user.views.UserManageAPIView.
+    """
+
+    def authenticate_credentials(self, key):
+        shared = _shared_cache()
+        if shared is None:
+            return super().authenticate_credentials(key)
+
+        cached = shared.get(_shared_key(key))
+        shared_stats['hits' if cached is not None else 'misses'] += 1
+        self._log_stats()
+        if cached is None:
+            cached = super().authenticate_credentials(key)
+            shared.set(_shared_key(key), cached, TOKEN_AUTH_CACHE['TTL'])
+
+        user, token = cached
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return user, token
+
+    def _log_stats(self):
+        """ Log the cache hit rate every STATS_LOG_INTERVAL lookups """
+        interval = TOKEN_AUTH_CACHE['STATS_LOG_INTERVAL']
+        if interval and (shared_stats['hits'] + shared_stats['misses']) % interval == 0:
+            logger.info('Token auth cache stats: %s', cache_stats())
+
+
+@receiver(post_delete, sender=Token)
+def _invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+def _invalidate_user_tokens(sender, instance, created, **kwargs):
+    if created:
+        return
+    for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+        invalidate_token(key)
@@ -0,0 +1,171 @@
+""" Data seeding and timing helpers shared by the benchmark commands """
+
+import io
+import queue
+import statistics
+import threading
+import time
+from decimal import Decimal
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from core.models import Recipe, Tag, Ingredient
+from core.signals import recipes_bulk_created
+
+EMAIL = 'bench-{}@example.com'
+TAGS_PER_USER = 20
+INGREDIENTS_PER_USER = 50
+TAGS_PER_RECIPE = 3
+INGREDIENTS_PER_RECIPE = 5
+BATCH_SIZE = 5000
+# recipe titles are made of two of these, so each one matches ~4% of recipes
+WORDS = [
+    'apple', 'bacon', 'basil', 'bean', 'beef', 'bread', 'broccoli', 'butter',
+    'cabbage', 'carrot', 'cheese', 'chicken', 'chili', 'chocolate', 'coconut',
+    'corn', 'cream', 'curry', 'duck', 'egg', 'fennel', 'fig', 'garlic', 'ginger',
+    'ham', 'honey', 'kale', 'lamb', 'leek', 'lemon', 'lentil', 'lime', 'mango',
+    'mint', 'mushroom', 'noodle', 'oat', 'olive', 'onion', 'orange', 'pasta',
+    'pea', 'pear', 'pepper', 'pork', 'potato', 'rice', 'salmon', 'tofu', 'tomato',
+]
+
+
+def seed_user(number, recipes, rng, stdout=None, tags=TAGS_PER_USER,
+              ingredients=INGREDIENTS_PER_USER, images=0):
+    """ Create a benchmark user with its tags, ingredients, recipes and images if missing
+
+    Returns a dict with the user and the ids of its rows to build requests from.
+    """
+    user, _ = get_user_model().objects.get_or_create(
+        email=EMAIL.format(number), defaults={'username': f'bench {number}'})
+    tags = Tag.objects.get_or_create_by_names(
+        user, [f'Tag {i}' for i in range(tags)])
+    ingredients = Ingredient.objects.get_or_create_by_names(
+        user, [f'Ingredient {i}' for i in range(ingredients)])
+
+    missing = recipes - Recipe.objects.filter(user=user).count()
+    if missing > 0:
+        if stdout is not None:
+            stdout.write(f'Seeding {missing} recipes for {user.email}')
+        seed_recipes(user, missing, tags, ingredients, rng)
+
+    with_images = Recipe.objects.filter(user=user).exclude(image='')
+    missing = images - with_images.count()
+    if missing > 0:
+        if stdout is not None:
+            stdout.write(f'Seeding {missing} images for {user.email}')
+        seed_images(user, missing, rng)
+
+    return {
+        'user': user,
+        'tag_ids': [tag.id for tag in tags],
+        'ingredient_ids': [ingredient.id for ingredient in ingredients],
+        'recipe_ids': list(Recipe.objects.filter(user=user).values_list('id', flat=True)),
+        'image_names': list(with_images.values_list('image', flat=True)),
+    }
+
+
+def seed_recipes(user, count, tags, ingredients, rng):
+    """ Insert the recipes and their links in batches """
+    for start in range(0, count, BATCH_SIZE):
+        with transaction.atomic():
+            recipes = Recipe.objects.bulk_create([
+                Recipe(
+                    user=user,
+                    title=f'{rng.choice(WORDS)} {rng.choice(WORDS)} {start + i}',
+                    time_minutes=rng.randint(5, 120),
+                    price=Decimal(rng.randint(100, 9999)) / 100,
+                    calories_per_serving=rng.randint(50, 1500),
+                )
+                for i in range(min(BATCH_SIZE, count - start))
+            ])
+            Recipe.tags.through.objects.bulk_create([
+                Recipe.tags.through(recipe_id=recipe.id, tag_id=tag.id)
+                for recipe in recipes
+                for tag in rng.sample(tags, TAGS_PER_RECIPE)
+            ])
+            Recipe.ingredients.through.objects.bulk_create([
+                Recipe.ingredients.through(recipe_id=recipe.id, ingredient_id=ingredient.id)
+                for recipe in recipes
+                for ingredient in rng.sample(ingredients, INGREDIENTS_PER_RECIPE)
+            ])
+            recipes_bulk_created.send(sender=Recipe, user=user, recipes=recipes)
+
+
+def seed_images(user, count, rng):
+    """ Save small distinct images and set them on recipes without one """
+    recipes = list(Recipe.objects.filter(user=user, image='').order_by('id')[:count])
+    for start in range(0, len(recipes), BATCH_SIZE):
+        batch = recipes[start:start + BATCH_SIZE]
+        with transaction.atomic():
+            for recipe in batch:
+                buffer = io.BytesIO()
+                color = tuple(rng.randrange(256) for _ in range(3))
+                Image.new('RGB', (64, 64), color).save(buffer, format='JPEG')
+                recipe.image = default_storage.save(
+                    'uploads/recipe/bench.jpg', ContentFile(buffer.getvalue()))
+            Recipe.objects.bulk_update(batch, ['image'])
+
+
+def run_concurrently(func, count, concurrency):
+    """ Call func(i) for i in range(count) from concurrency threads
+
+    Returns the results in call order and the wall time in seconds. One
+    thread runs the calls in the current thread, which shares its
+    database connection and transaction.
+    """
+    results = [None] * count
+    start = time.perf_counter()
+    if concurrency <= 1:
+        for i in range(count):
+            results[i] = func(i)
+        return results, time.perf_counter() - start
+
+    calls = queue.Queue()
+    for i in range(count):
+        calls.put(i)
+
+    def worker():
+        try:
+            while True:
+                try:
+                    i = calls.get_nowait()
+                except queue.Empty:
+                    return
+                results[i] = func(i)
+        finally:
+            # every thread opened its own connection
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results, time.perf_counter() - start
+
+
+def timed(func, *args, **kwargs):
+    """ Return the wall time of one call in milliseconds """
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return 1000 * (time.perf_counter() - start)
+
+
+def percentiles(timings, points=(50, 99)):
+    """ Return the percentiles of a list of timings, the p50 and p99 by default
+
+    They are all nan without any timings.
+    """
+    if not timings:
+        return tuple(float('nan') for _ in points)
+    if len(timings) < 2:
+        return tuple(timings[0] for _ in points)
+
+    cuts = statistics.quantiles(timings, n=100, method='inclusive')
+    return tuple(cuts[point - 1] for point in points)
@@ -0,0 +1,64 @@
+""" In-process caching helpers """
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """ Thread safe in-process LRU cache whose entries expire after a ttl """
+
+    def __init__(self, max_size=1000, ttl=60, timer=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """ Return the live value of key, or default """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] <= self._timer():
+                del self._data[key]
+                item = None
+
+            if item is None:
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value):
+        """ Store value for key, evicting the least recently used entries """
+        with self._lock:
+            self._data[key] = (value, self._timer() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """ Remove key if present """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """ Remove all the entries and reset the counters """
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """ Return the hit/miss counters of the cache """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._data),
+            }
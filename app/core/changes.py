@@ -0,0 +1,252 @@
+""" Per user change log of the recipes, tags, ingredients and recipe links
+
+The log is compacted: Change holds one entry per row or link a user ever
+wrote, with the number of its latest change and whether it was deleted,
+so it grows with the account size and the tombstones, not with the
+writes. Every write records its entries with the next numbers of the
+user's ChangeCounter, in one statement that keeps the counter row locked
+until the writing transaction commits. The entries of a user therefore
+become visible in number order, and a reader never returns a token past
+a number still being written.
+
+The links of a deleted recipe, tag or ingredient are removed without
+signals, so instead of link tombstones their entries are dropped along
+with the row: the row's tombstone stands for its links.
+
+Writes sending several signals, like a recipe saved with its tags and
+ingredients, run in batch() to record all their entries at once.
+"""
+
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from core.models import Change, ChangeCounter, Recipe, Tag, Ingredient
+from core.signals import recipes_bulk_created, recipe_attrs_bulk_created
+
+KINDS = {
+    Recipe: Change.RECIPE,
+    Tag: Change.TAG,
+    Ingredient: Change.INGREDIENT,
+    Recipe.tags.through: Change.RECIPE_TAG,
+    Recipe.ingredients.through: Change.RECIPE_INGREDIENT,
+}
+LINK_KINDS = {Change.TAG: Change.RECIPE_TAG, Change.INGREDIENT: Change.RECIPE_INGREDIENT}
+# the tag or ingredient column of the through tables
+TARGETS = {Recipe.tags.through: 'tag_id', Recipe.ingredients.through: 'ingredient_id'}
+
+_RECORD = f"""
+WITH counter AS (
+    INSERT INTO {ChangeCounter._meta.db_table} AS counter (user_id, seq, pruned)
+    VALUES (%(user_id)s, %(count)s, 0)
+    ON CONFLICT (user_id) DO UPDATE SET seq = counter.seq + EXCLUDED.seq
+    RETURNING seq
+)
+INSERT INTO {Change._meta.db_table} (user_id, seq, kind, object_id, target_id, deleted, changed_at)
+SELECT %(user_id)s, counter.seq - %(count)s + entry.number, entry.kind,
+       entry.object_id, entry.target_id, entry.deleted, now()
+FROM counter, unnest(%(kinds)s::varchar[], %(object_ids)s::bigint[],
+                     %(target_ids)s::bigint[], %(deleted)s::boolean[])
+    WITH ORDINALITY AS entry (kind, object_id, target_id, deleted, number)
+ON CONFLICT (user_id, kind, object_id, target_id) DO UPDATE
+SET seq = EXCLUDED.seq, deleted = EXCLUDED.deleted, changed_at = EXCLUDED.changed_at
+"""
+
+
+_local = threading.local()
+
+
+class InvalidToken(Exception):
+    """ A sync token that was not returned to the user """
+
+
+class ChangesPruned(Exception):
+    """ The tombstones after a sync token were pruned """
+
+
+def rows(kind, ids, deleted=False):
+    """ Return the entries of the rows of a kind """
+    return [(kind, object_id, 0, deleted) for object_id in ids]
+
+
+def links(kind, pairs, deleted=False):
+    """ Return the entries of (recipe id, tag or ingredient id) links """
+    return [(kind, recipe_id, target_id, deleted) for recipe_id, target_id in pairs]
+
+
+@contextmanager
+def batch():
+    """ Run the block in a transaction recording its entries when it ends
+
+    The entries are written with one statement per user instead of one
+    per signal. Nested blocks belong to the outermost one.
+    """
+    if getattr(_local, 'entries', None) is not None:
+        yield
+        return
+
+    _local.entries = defaultdict(list)
+    try:
+        with transaction.atomic():
+            yield
+            entries, _local.entries = _local.entries, None
+            for user_id, user_entries in entries.items():
+                _write(user_id, user_entries)
+    finally:
+        _local.entries = None
+
+
+def record(user_id, entries):
+    """ Record the (kind, object id, target id, deleted) entries of a user """
+    if getattr(_local, 'entries', None) is not None:
+        _local.entries[user_id].extend(entries)
+    else:
+        _write(user_id, entries)
+
+
+def _write(user_id, entries):
+    """ Write the entries of a user
+
+    The last of several entries of the same row wins. The tombstones of
+    rows also drop the entries of their links.
+    """
+    # ON CONFLICT can not update the same row twice
+    entries = {entry[:3]: entry[3] for entry in entries}
+    if not entries:
+        return
+
+    dropped = Q()
+    for (kind, object_id, _), deleted in entries.items():
+        if deleted and kind == Change.RECIPE:
+            dropped |= Q(kind__in=LINK_KINDS.values(), object_id=object_id)
+        elif deleted and kind in LINK_KINDS:
+            dropped |= Q(kind=LINK_KINDS[kind], target_id=object_id)
+
+    keys = list(entries)
+    # the tombstones and the dropped links commit together
+    with transaction.atomic(savepoint=False):
+        with connection.cursor() as cursor:
+            cursor.execute(_RECORD, {
+                'user_id': user_id,
+                'count': len(keys),
+                'kinds': [kind for kind, _, _ in keys],
+                'object_ids': [object_id for _, object_id, _ in keys],
+                'target_ids': [target_id for _, _, target_id in keys],
+                'deleted': list(entries.values()),
+            })
+        if dropped:
+            Change.objects.filter(dropped, user_id=user_id).delete()
+
+
+def parse_token(token):
+    """ Return the number of a sync token """
+    if not token.isdigit():
+        raise InvalidToken(token)
+
+    return int(token)
+
+
+def last_number(user_id):
+    """ Return the number of the latest change of a user, 0 before any """
+    return ChangeCounter.objects.filter(user_id=user_id).values_list('seq', flat=True).first() or 0
+
+
+def changes_since(user_id, since, limit):
+    """ Return the first limit entries of a user after the number since
+
+    Returns (entries, token, more), the (kind, object id, target id,
+    deleted) entries in number order, the token of the last one and
+    whether more entries follow.
+    """
+    seq, pruned = ChangeCounter.objects.filter(user_id=user_id).values_list(
+        'seq', 'pruned').first() or (0, 0)
+    if since > seq:
+        raise InvalidToken(str(since))
+    # a full sync reads every live row, the tombstones are not needed
+    if 0 < since < pruned:
+        raise ChangesPruned(str(since))
+
+    found = list(Change.objects.filter(user_id=user_id, seq__gt=since).order_by('seq').values_list(
+        'seq', 'kind', 'object_id', 'target_id', 'deleted')[:limit + 1])
+    more = len(found) > limit
+    found = found[:limit]
+    token = found[-1][0] if found else since
+
+    return [entry[1:] for entry in found], str(token), more
+
+
+def prune(before):
+    """ Delete the tombstones changed before a datetime, returns their count """
+    stale = Change.objects.filter(deleted=True, changed_at__lt=before)
+    count = 0
+    for user_id, seq in stale.values('user_id').annotate(last=Max('seq')).values_list('user_id', 'last'):
+        with transaction.atomic():
+            # locks the counter like the writers
+            counter = ChangeCounter.objects.select_for_update().get(user_id=user_id)
+            counter.pruned = max(counter.pruned, seq)
+            counter.save(update_fields=['pruned'])
+            count += stale.filter(user_id=user_id, seq__lte=seq).delete()[0]
+
+    return count
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def _record_save(sender, instance, **kwargs):
+    record(instance.user_id, rows(KINDS[sender], [instance.pk]))
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def _record_delete(sender, instance, **kwargs):
+    record(instance.user_id, rows(KINDS[sender], [instance.pk], deleted=True))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def _record_links(sender, instance, action, reverse, pk_set, **kwargs):
+    """ Record the added and removed links, from either side """
+    if action == 'pre_clear':
+        # the links are gone once post_clear is sent
+        column, other = (TARGETS[sender], 'recipe_id') if reverse else ('recipe_id', TARGETS[sender])
+        instance._cleared_link_ids = set(sender.objects.filter(
+            **{column: instance.pk}).values_list(other, flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = instance._cleared_link_ids
+    elif action not in ('post_add', 'post_remove'):
+        return
+
+    pairs = [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set]
+    record(instance.user_id, links(KINDS[sender], pairs, deleted=action != 'post_add'))
+
+
+@receiver(recipes_bulk_created)
+def _record_bulk_created_recipes(sender, user, recipes, **kwargs):
+    """ bulk_create() skips post_save and m2m_changed, read the links back """
+    ids = [recipe.pk for recipe in recipes]
+    entries = rows(Change.RECIPE, ids)
+    for through, target in TARGETS.items():
+        entries += links(KINDS[through], through.objects.filter(
+            recipe_id__in=ids).values_list('recipe_id', target))
+    record(user.id, entries)
+
+
+@receiver(recipe_attrs_bulk_created)
+def _record_bulk_created_attrs(sender, user, objects, **kwargs):
+    record(user.id, rows(KINDS[sender], [obj.pk for obj in objects]))
+
+
+@receiver(post_delete, sender=get_user_model())
+def _delete_user_log(sender, instance, **kwargs):
+    """ The log of a user is not cascaded, deleting its rows records changes """
+    Change.objects.filter(user_id=instance.pk).delete()
+    ChangeCounter.objects.filter(user_id=instance.pk).delete()
@@ -0,0 +1,168 @@
+""" Brotli and gzip compression of the responses
+
+CompressionMiddleware compresses the responses of at least MIN_SIZE bytes
+whose Content-Type starts with one of CONTENT_TYPES, with the encoding of
+ENCODINGS the client accepts with the highest q value, in that order on
+ties. Brotli is only offered when the brotli package is installed.
+Streamed responses, like the exports, are compressed chunk by chunk and
+flushed after every chunk so they keep streaming.
+
+Views caching their responses can skip the compression of repeat hits:
+the negotiated encoding is request.response_encoding, a response whose
+store_compressed attribute is set is passed to it once compressed, and a
+response whose precompressed_encoding is set already holds a body in that
+encoding, the middleware only adds the headers.
+"""
+
+import re
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION = {
+    'ENABLED': True,
+    'MIN_SIZE': 1024,
+    # levels picked with the benchmark_compression command
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+    'ENCODINGS': ['br', 'gzip'],
+    'CONTENT_TYPES': [
+        'application/json',
+        'application/x-ndjson',
+        'application/msgpack',
+        'application/vnd.oai.openapi',
+        'text/',
+    ],
+}
+COMPRESSION.update(getattr(settings, 'COMPRESSION', {}))
+
+_CODING = re.compile(r'^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$')
+
+
+def available_encodings():
+    """ Return the ENCODINGS that can be produced here, in order of preference """
+    return [
+        encoding for encoding in COMPRESSION['ENCODINGS']
+        if encoding == 'gzip' or (encoding == 'br' and brotli is not None)
+    ]
+
+
+def negotiate(accept_encoding):
+    """ Return the encoding to use for an Accept-Encoding header, or None """
+    accepted = {}
+    for coding in accept_encoding.split(','):
+        match = _CODING.match(coding)
+        if match is None:
+            continue
+        try:
+            accepted[match[1].lower()] = float(match[2]) if match[2] is not None else 1.0
+        except ValueError:
+            continue
+
+    best, best_q = None, 0
+    for encoding in available_encodings():
+        q = accepted.get(encoding, accepted.get('*', 0))
+        if q > best_q:
+            best, best_q = encoding, q
+
+    return best
+
+
+def _compressor(encoding, level=None):
+    """ Return the process(data), flush() and finish() functions of a compressor """
+    if encoding == 'br':
+        compressor = brotli.Compressor(
+            quality=COMPRESSION['BROTLI_QUALITY'] if level is None else level)
+        return compressor.process, compressor.flush, compressor.finish
+
+    # wbits 31 writes the gzip header and trailer
+    compressor = zlib.compressobj(
+        COMPRESSION['GZIP_LEVEL'] if level is None else level, zlib.DEFLATED, 31)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def compress(content, encoding, level=None):
+    """ Return content compressed with the encoding """
+    process, _, finish = _compressor(encoding, level)
+    return process(content) + finish()
+
+
+def compress_stream(chunks, encoding, level=None):
+    """ Compress the chunks of a streamed response, flushing after each one """
+    process, flush, finish = _compressor(encoding, level)
+    for chunk in chunks:
+        data = process(chunk) + flush()
+        if data:
+            yield data
+
+    yield finish()
+
+
+def _is_compressible(response):
+    content_type = response.get('Content-Type', '')
+    return any(content_type.startswith(prefix) for prefix in COMPRESSION['CONTENT_TYPES'])
+
+
+def _weaken_etag(response):
+    """ The compressed body is not byte identical to the one the ETag was made of """
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = f'W/{etag}'
+
+
+class CompressionMiddleware:
+    """ Compresses the responses, see the module docstring """
+
+    def __init__(self, get_response):
+        if not COMPRESSION['ENABLED']:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.response_encoding = negotiate(request.headers.get('Accept-Encoding', ''))
+        response = self.get_response(request)
+
+        precompressed = getattr(response, 'precompressed_encoding', None)
+        if precompressed is not None:
+            return self._encoded(response, precompressed)
+        if response.has_header('Content-Encoding') or not _is_compressible(response):
+            return response
+        if not response.streaming and len(response.content) < COMPRESSION['MIN_SIZE']:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = request.response_encoding
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_stream(response.streaming_content, encoding)
+            del response['Content-Length']
+            return self._encoded(response, encoding)
+
+        compressed = compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        self._encoded(response, encoding)
+
+        store = getattr(response, 'store_compressed', None)
+        if store is not None:
+            store(response)
+        return response
+
+    def _encoded(self, response, encoding):
+        """ Add the headers of a response whose body is in the encoding """
+        patch_vary_headers(response, ('Accept-Encoding',))
+        response['Content-Encoding'] = encoding
+        if not response.streaming:
+            response['Content-Length'] = str(len(response.content))
+        _weaken_etag(response)
+        return response
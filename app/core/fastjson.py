@@ -0,0 +1,88 @@
+""" JSON encoding and decoding with orjson, when it is installed
+
+ORJSONRenderer and ORJSONParser replace DRF's JSONRenderer and JSONParser
+and produce the same bytes: compact, non ASCII characters kept as is,
+U+2028/U+2029 escaped, aware UTC datetimes ending with 'Z', and what
+orjson has no native encoding for, like Decimal or lazy translations,
+converted by DRF's JSONEncoder. One difference remains, a NaN float is
+rendered as null instead of failing. Without orjson, for indented output
+like the browsable api's, or for data orjson rejects such as non string
+keys, they fall back to the DRF classes.
+"""
+
+import json
+
+from django.conf import settings
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.metrics import serialization
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_default = JSONEncoder().default
+OPTIONS = orjson.OPT_UTC_Z if orjson is not None else 0
+
+
+def _escape_separators(rendered):
+    """ Escape the line and paragraph separators, which are invalid in javascript """
+    return rendered.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+def dumps(data):
+    """ Encode data to compact UTF-8 JSON bytes """
+    if orjson is None:
+        return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+    return orjson.dumps(data, default=_default, option=OPTIONS)
+
+
+def loads(data):
+    """ Decode JSON from bytes or str """
+    if orjson is None:
+        return json.loads(data)
+
+    return orjson.loads(data)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """ JSONRenderer encoding with orjson, see the module docstring """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with serialization():
+            if data is None:
+                return b''
+            if (orjson is None or self.ensure_ascii or not self.compact
+                    or self.get_indent(accepted_media_type, renderer_context or {})):
+                return super().render(data, accepted_media_type, renderer_context)
+
+            try:
+                rendered = orjson.dumps(data, default=_default, option=OPTIONS)
+            except orjson.JSONEncodeError:
+                return super().render(data, accepted_media_type, renderer_context)
+
+            return _escape_separators(rendered)
+
+
+class ORJSONParser(JSONParser):
+    """ JSONParser decoding with orjson """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            data = stream.read()
+            if encoding.lower().replace('-', '') != 'utf8':
+                data = data.decode(encoding)
+            # NaN and Infinity are rejected, like the strict JSONParser
+            return orjson.loads(data)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,45 @@
+""" Password hashers whose cost is tuned from settings.PASSWORD_HASHER_PARAMS
+
+They keep the algorithm names of the Django hashers they extend, so stored
+hashes stay valid and get rehashed on login whenever the parameters change.
+"""
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+def _param(algorithm, name, default):
+    """ Return a cost parameter of an algorithm from the settings """
+    return getattr(settings, 'PASSWORD_HASHER_PARAMS', {}).get(algorithm, {}).get(name, default)
+
+
+class TunedArgon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """ Argon2 hasher, single lane with 19 MiB of memory by default """
+
+    @property
+    def time_cost(self):
+        return _param(self.algorithm, 'time_cost', 2)
+
+    @property
+    def memory_cost(self):
+        return _param(self.algorithm, 'memory_cost', 19 * 1024)
+
+    @property
+    def parallelism(self):
+        return _param(self.algorithm, 'parallelism', 1)
+
+
+class TunedBCryptSHA256PasswordHasher(hashers.BCryptSHA256PasswordHasher):
+    """ BCrypt hasher with configurable rounds """
+
+    @property
+    def rounds(self):
+        return _param(self.algorithm, 'rounds', hashers.BCryptSHA256PasswordHasher.rounds)
+
+
+class TunedPBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """ PBKDF2 hasher with configurable iterations """
+
+    @property
+    def iterations(self):
+        return _param(self.algorithm, 'iterations', hashers.PBKDF2PasswordHasher.iterations)
@@ -0,0 +1,96 @@
+""" Password hashing on a bounded thread pool
+
+The pool bounds how many passwords a worker hashes at once, so a burst of
+logins can not starve the requests of the worker's other threads of CPU.
+It does not free the request threads: a login still blocks its thread
+until the hash is done, or for at most TIMEOUT seconds while the pool is
+saturated, after which it is shed like the logins finding no free slot.
+uWSGI runs several threads per worker, see scripts/run.sh, so the other
+requests of the worker are served meanwhile.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+from rest_framework import exceptions
+
+PASSWORD_HASHING = {
+    # threads hashing concurrently, hashlib, argon2-cffi and bcrypt release
+    # the GIL while hashing so the worker's other threads keep running.
+    'WORKERS': 2,
+    # hashes allowed to wait for a thread before logins are shed with a 429
+    'MAX_PENDING': 16,
+    # seconds a login waits for its hash before it is shed with a 429
+    'TIMEOUT': 10,
+}
+PASSWORD_HASHING.update(getattr(settings, 'PASSWORD_HASHING', {}))
+
+_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASHING['WORKERS'],
+    thread_name_prefix='password-hash',
+)
+_slots = threading.BoundedSemaphore(PASSWORD_HASHING['WORKERS'] + PASSWORD_HASHING['MAX_PENDING'])
+
+
+class HashingBusy(exceptions.Throttled):
+    """ Raised when the hashing pool has no room for another password """
+    default_detail = 'Too many concurrent logins, try again shortly.'
+
+
+def run(func, *args):
+    """ Run a hashing function on the pool and wait for its result
+
+    Blocks the calling thread, raises HashingBusy when the pool is full or
+    the result takes longer than TIMEOUT.
+    """
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy(wait=1)
+
+    try:
+        future = _executor.submit(func, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda f: _slots.release())
+
+    try:
+        return future.result(timeout=PASSWORD_HASHING['TIMEOUT'])
+    except TimeoutError:
+        # a hash still queued is dropped, one already running completes
+        future.cancel()
+        raise HashingBusy(wait=1)
+
+
+def _verify(raw_password, encoded):
+    """ Return whether the password matches and if its hash is outdated """
+    outdated = []
+    is_correct = hashers.check_password(
+        raw_password, encoded, setter=lambda raw: outdated.append(True))
+
+    return is_correct, bool(outdated)
+
+
+def check_password(user, raw_password):
+    """ Check a user's password on the pool
+
+    Hashes made with a hasher other than the preferred one, or with outdated
+    parameters, are transparently replaced with a fresh hash on success. The
+    rehash is skipped, and left to a later login, while the pool is busy.
+    """
+    is_correct, outdated = run(_verify, raw_password, user.password)
+    if is_correct and outdated:
+        try:
+            user.password = run(hashers.make_password, raw_password)
+        except HashingBusy:
+            return is_correct
+        user.save(update_fields=['password'])
+
+    return is_correct
+
+
+def make_password(raw_password):
+    """ Hash a password on the pool """
+    return run(hashers.make_password, raw_password)
@@ -0,0 +1,91 @@
+"""
+Django command to benchmark the compression levels of the recipe api responses
+"""
+
+import random
+import zlib
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from rest_framework.test import APIRequestFactory
+
+from core import compression, fastjson, messagepack
+from core.benchmark import seed_user, timed, percentiles
+from core.models import Recipe
+from recipe import fastpath
+
+GZIP_LEVELS = [1, 3, 6, 9]
+BROTLI_QUALITIES = [1, 3, 4, 5, 7, 9, 11]
+
+
+class Command(BaseCommand):
+    """
+    Django command reporting the compressed size and the compression time of
+    each gzip level and brotli quality on recipe list and export payloads
+    """
+    help = (
+        'Seed a user with recipes and compare the bytes saved and the CPU time '
+        'of the gzip levels and brotli qualities on the recipe api payloads.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=1000, help='Recipes in the payloads.')
+        parser.add_argument('--repeat', type=int, default=10, help='Timed runs of each level.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the data.')
+
+    def handle(self, *args, **options):
+        """ entry point to commands """
+        data = seed_user(0, options['recipes'], random.Random(options['seed']), self.stderr)
+        payloads = self.payloads(data['user'], options['recipes'])
+
+        levels = [('gzip', level) for level in GZIP_LEVELS]
+        if compression.brotli is not None:
+            levels += [('br', quality) for quality in BROTLI_QUALITIES]
+        else:
+            self.stderr.write('brotli is not installed, only gzip is measured.')
+
+        self.stdout.write(f'{"payload":<16}{"encoding":<10}{"level":>6}{"KB":>10}{"ratio":>8}'
+                          f'{"compress ms/MB":>16}{"decompress ms/MB":>18}')
+        for name, content in payloads:
+            megabytes = len(content) / 2 ** 20
+            self.stdout.write(f'{name:<16}{"identity":<10}{"":>6}{len(content) / 1024:>10.1f}'
+                              f'{1:>8.2f}{0:>16.1f}{0:>18.1f}')
+            for encoding, level in levels:
+                compressed = compression.compress(content, encoding, level)
+                decompress = self.decompressor(encoding)
+
+                runs = range(options['repeat'])
+                compress_ms = percentiles([
+                    timed(lambda: compression.compress(content, encoding, level)) for _ in runs])[0]
+                decompress_ms = percentiles([timed(lambda: decompress(compressed)) for _ in runs])[0]
+                self.stdout.write(
+                    f'{name:<16}{encoding:<10}{level:>6}{len(compressed) / 1024:>10.1f}'
+                    f'{len(content) / len(compressed):>8.2f}{compress_ms / megabytes:>16.1f}'
+                    f'{decompress_ms / megabytes:>18.1f}'
+                )
+
+    def decompressor(self, encoding):
+        """ Return the decompression function of an encoding """
+        if encoding == 'br':
+            return compression.brotli.decompress
+        return lambda content: zlib.decompress(content, 31)
+
+    # the media urls are built from the factory's host
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def payloads(self, user, count):
+        """ Return the JSON and MessagePack list page and the NDJSON export of the recipes """
+        request = APIRequestFactory().get('/api/recipe/recipes/')
+        rows = list(Recipe.objects.filter(user=user).order_by('-id').values(*fastpath.LIST_FIELDS)[:count])
+        page = {'next': None, 'previous': None, 'results': fastpath.list_data(rows, request)}
+
+        payloads = [
+            ('list json', fastjson.ORJSONRenderer().render(page)),
+            ('export ndjson', b''.join(fastjson.dumps(item) + b'\n' for item in page['results'])),
+        ]
+        if messagepack.msgpack is not None:
+            view = SimpleNamespace(fixed_point_fields={'price': 2})
+            payloads.insert(1, ('list msgpack', messagepack.MessagePackRenderer().render(
+                page, renderer_context={'view': view})))
+        return payloads
@@ -0,0 +1,55 @@
+"""
+Django command to benchmark the configured password hashers
+"""
+
+import time
+
+from django.contrib.auth import hashers
+from django.core.management.base import BaseCommand
+
+PASSWORD = 'benchmark-password'
+
+
+class Command(BaseCommand):
+    """
+    Django command reporting logins/sec per core for each password hasher
+    """
+    help = 'Benchmark password verification of each hasher in PASSWORD_HASHERS.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seconds', type=float, default=2.0,
+            help='Time spent verifying passwords with each hasher.',
+        )
+        parser.add_argument(
+            '--hashers', nargs='*', default=None,
+            help='Algorithms to benchmark, all the configured ones by default.',
+        )
+
+    def handle(self, *args, **options):
+        """ entry point to commands """
+        preferred = hashers.get_hasher('default').algorithm
+        self.stdout.write(f'{"hasher":<20}{"logins/sec/core":>16}{"ms/login":>10}')
+
+        for hasher in hashers.get_hashers():
+            if options['hashers'] and hasher.algorithm not in options['hashers']:
+                continue
+
+            try:
+                encoded = hasher.encode(PASSWORD, hasher.salt())
+            except ValueError as exc:
+                # the hasher's library is not installed
+                self.stdout.write(f'{hasher.algorithm:<20}{"skipped":>16}  {exc}')
+                continue
+
+            # one thread measures a single core
+            count, start = 0, time.perf_counter()
+            while True:
+                hasher.verify(PASSWORD, encoded)
+                count += 1
+                elapsed = time.perf_counter() - start
+                if elapsed >= options['seconds']:
+                    break
+
+            name = hasher.algorithm + (' *' if hasher.algorithm == preferred else '')
+            self.stdout.write(f'{name:<20}{count / elapsed:>16.1f}{1000 * elapsed / count:>10.1f}')
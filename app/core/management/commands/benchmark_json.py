@@ -0,0 +1,92 @@
+"""
+Django command to benchmark the JSON encoding and decoding of the recipe apis
+"""
+
+import io
+import json
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+from rest_framework.utils.encoders import JSONEncoder
+
+from core import fastjson
+from core.benchmark import seed_user, timed, percentiles
+from core.models import Recipe
+from recipe import fastpath
+
+
+class Command(BaseCommand):
+    """
+    Django command reporting the ms/MB of DRF's stdlib json classes and of
+    core.fastjson on recipe list pages and bulk import/export payloads
+    """
+    help = (
+        'Seed a user with recipes and compare the encode/decode time per MB of '
+        'the recipe list and bulk endpoint payloads with json and orjson.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=1000, help='Recipes in the payloads.')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs of each codec.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the data.')
+
+    def handle(self, *args, **options):
+        """ entry point to commands """
+        if fastjson.orjson is None:
+            raise CommandError('orjson is not installed, the api uses the stdlib json classes.')
+
+        data = seed_user(0, options['recipes'], random.Random(options['seed']), self.stderr)
+        page, records = self.payloads(data['user'], options['recipes'])
+        body = JSONRenderer().render(records)
+        lines = [json.dumps(record).encode() for record in records]
+
+        codecs = [
+            # payload, stdlib, orjson, MB
+            ('list render', lambda: JSONRenderer().render(page),
+             lambda: fastjson.ORJSONRenderer().render(page),
+             len(JSONRenderer().render(page))),
+            ('bulk parse', lambda: JSONParser().parse(io.BytesIO(body)),
+             lambda: fastjson.ORJSONParser().parse(io.BytesIO(body)), len(body)),
+            ('ndjson export', lambda: [json.dumps(item, cls=JSONEncoder, ensure_ascii=False) for item in page['results']],
+             lambda: [fastjson.dumps(item) for item in page['results']],
+             len(JSONRenderer().render(page['results']))),
+            ('ndjson import', lambda: [json.loads(line) for line in lines],
+             lambda: [fastjson.loads(line) for line in lines], sum(map(len, lines))),
+        ]
+
+        self.stdout.write(f'{"payload":<16}{"MB":>8}{"json ms/MB":>12}{"orjson ms/MB":>14}'
+                          f'{"saved ms/MB":>13}{"speedup":>9}')
+        for name, stdlib, fast, size in codecs:
+            megabytes = size / 2 ** 20
+            before = percentiles([timed(stdlib) for _ in range(options['repeat'])])[0] / megabytes
+            after = percentiles([timed(fast) for _ in range(options['repeat'])])[0] / megabytes
+            self.stdout.write(f'{name:<16}{megabytes:>8.2f}{before:>12.1f}{after:>14.1f}'
+                              f'{before - after:>13.1f}{before / after:>8.1f}x')
+
+    # the media urls are built from the factory's host
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def payloads(self, user, count):
+        """ Return a recipe list page and the bulk import records of the same recipes """
+        request = APIRequestFactory().get('/api/recipe/recipes/')
+        rows = list(Recipe.objects.filter(user=user).order_by('-id').values(*fastpath.LIST_FIELDS)[:count])
+        results = fastpath.list_data(rows, request)
+        page = {'next': None, 'previous': None, 'results': results}
+
+        records = [
+            {
+                'title': item['title'],
+                'time_minutes': item['time_minutes'],
+                'price': item['price'],
+                'calories_per_serving': item['calories_per_serving'],
+                'link': item['link'],
+                'tags': [{'name': tag['name']} for tag in item['tags']],
+                'ingredients': [{'name': ingredient['name']} for ingredient in item['ingredients']],
+            }
+            for item in results
+        ]
+        return page, records
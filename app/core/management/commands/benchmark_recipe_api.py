@@ -0,0 +1,128 @@
+"""
+Django command to seed recipe data and benchmark the recipe api endpoints
+"""
+
+import random
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core.benchmark import WORDS, seed_user, timed, percentiles
+from core.models import Tag, Ingredient
+from recipe.cache import bump_version
+from recipe.views import RecipeAPIViewSet, TagAPIViewSet, IngredientAPIViewSet
+
+# indexes of the through tables added with RunSQL in core migration 0010
+LINK_INDEXES = ['recipe_tags_tag_recipe_idx', 'recipe_ingredients_ingredient_recipe_idx']
+# the per user composite index of core migration 0006 and the unique
+# (user, name) constraints of 0008 backing the tag and ingredient lists
+BASELINE_INDEXES = ['recipe_user_id_desc_idx', *LINK_INDEXES]
+BASELINE_CONSTRAINTS = [(Tag, 'unique_tag_name_per_user'), (Ingredient, 'unique_ingredient_name_per_user')]
+
+
+class Command(BaseCommand):
+    """
+    Django command reporting p50/p99 latencies of the recipe api endpoints,
+    without and with the composite indexes of the recipe lists and filters
+    """
+    help = (
+        'Seed N users x M recipes and report p50/p99 per recipe api endpoint. '
+        'The baseline run drops the composite list and filter indexes inside '
+        'a transaction that is rolled back, which locks the recipe tables '
+        'while it runs, so it only runs with DEBUG or --i-know-this-locks.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Number of users to seed.')
+        parser.add_argument('--recipes', type=int, default=1000, help='Recipes seeded per user.')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the data and requests.')
+        parser.add_argument(
+            '--skip-baseline', action='store_true',
+            help='Only measure with all the indexes in place.',
+        )
+        parser.add_argument(
+            '--i-know-this-locks', action='store_true',
+            help='Run the baseline without DEBUG, blocking every query on the recipe tables meanwhile.',
+        )
+
+    def handle(self, *args, **options):
+        """ entry point to commands """
+        if not (options['skip_baseline'] or settings.DEBUG or options['i_know_this_locks']):
+            raise CommandError(
+                'The baseline run holds ACCESS EXCLUSIVE locks on the recipe tables until it '
+                'ends. Run it against a development database with DEBUG, pass '
+                '--i-know-this-locks, or measure with --skip-baseline only.'
+            )
+
+        rng = random.Random(options['seed'])
+        users = [
+            seed_user(i, options['recipes'], rng, self.stdout)
+            for i in range(options['users'])
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE core_recipe, core_tag, core_ingredient, '
+                           'core_recipe_tags, core_recipe_ingredients')
+
+        if not options['skip_baseline']:
+            with transaction.atomic():
+                self.drop_indexes()
+                self.report('without composite indexes', users, options['requests'], options['seed'])
+                transaction.set_rollback(True)
+
+        self.report('all indexes', users, options['requests'], options['seed'])
+
+    def drop_indexes(self):
+        """ Drop the BASELINE_INDEXES and BASELINE_CONSTRAINTS, leaving the FK and other indexes """
+        with connection.cursor() as cursor:
+            # postgres refuses to alter tables with deferred FK checks pending
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            for model, name in BASELINE_CONSTRAINTS:
+                cursor.execute(f'ALTER TABLE {model._meta.db_table} DROP CONSTRAINT {name}')
+            for name in BASELINE_INDEXES:
+                cursor.execute(f'DROP INDEX {name}')
+
+    def endpoints(self):
+        """ Return (name, view, url kwargs, query params) builders per endpoint """
+        recipe_list = RecipeAPIViewSet.as_view({'get': 'list'})
+        recipe_detail = RecipeAPIViewSet.as_view({'get': 'retrieve'})
+        return [
+            ('recipes', recipe_list, lambda data, rng: ({}, {})),
+            ('recipes ?tags=', recipe_list, lambda data, rng: ({}, {
+                'tags': ','.join(map(str, rng.sample(data['tag_ids'], 2)))})),
+            ('recipes ?ingredients=', recipe_list, lambda data, rng: ({}, {
+                'ingredients': ','.join(map(str, rng.sample(data['ingredient_ids'], 2)))})),
+            ('recipes ?q=', recipe_list, lambda data, rng: ({}, {'q': rng.choice(WORDS)})),
+            ('recipe detail', recipe_detail, lambda data, rng: (
+                {'pk': rng.choice(data['recipe_ids'])}, {})),
+            ('tags', TagAPIViewSet.as_view({'get': 'list'}), lambda data, rng: ({}, {})),
+            ('ingredients', IngredientAPIViewSet.as_view({'get': 'list'}), lambda data, rng: ({}, {})),
+        ]
+
+    # the paginators build absolute urls from the factory's host
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def report(self, title, users, requests, seed):
+        """ Time every endpoint and write one p50/p99 line for each """
+        factory = APIRequestFactory()
+        self.stdout.write(f'== {title} ==')
+        self.stdout.write(f'{"endpoint":<24}{"p50 ms":>10}{"p99 ms":>10}')
+
+        for name, view, build in self.endpoints():
+            rng = random.Random(seed)
+            timings = []
+            for i in range(requests):
+                data = users[i % len(users)]
+                kwargs, params = build(data, rng)
+                request = factory.get('/', params)
+                force_authenticate(request, user=data['user'])
+                # measure the database and serializer, not the payload cache
+                bump_version(data['user'].id)
+
+                timings.append(timed(lambda: view(request, **kwargs).render()))
+
+            p50, p99 = percentiles(timings)
+            self.stdout.write(f'{name:<24}{p50:>10.2f}{p99:>10.2f}')
@@ -0,0 +1,75 @@
+"""
+Django command to compare the query plans of the recipe tag filters
+"""
+
+import random
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.benchmark import seed_user, timed, percentiles
+from core.models import Recipe
+from recipe.filters import filter_by_links, MATCH_ALL
+from recipe.pagination import RecipeCursorPagination
+
+
+def join_any(queryset, ids):
+    """ The previous plan, a join on the links deduplicated with DISTINCT """
+    return queryset.filter(tags__id__in=ids).distinct()
+
+
+def join_all(queryset, ids):
+    """ All-of written with joins, one join of the links per tag """
+    for tag_id in ids:
+        queryset = queryset.filter(tags__id=tag_id)
+    return queryset
+
+
+PLANS = [
+    ('any: join + distinct', join_any),
+    ('any: exists', lambda queryset, ids: filter_by_links(queryset, 'tags', ids)),
+    ('all: join per tag', join_all),
+    ('all: exists per tag', lambda queryset, ids: filter_by_links(queryset, 'tags', ids, MATCH_ALL)),
+]
+
+
+class Command(BaseCommand):
+    """
+    Django command reporting p50/p99 of the first page of tag filtered
+    recipes for each query plan
+    """
+    help = 'Seed N users x M recipes and compare the tag filter query plans.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Number of users to seed.')
+        parser.add_argument('--recipes', type=int, default=100000, help='Recipes seeded per user.')
+        parser.add_argument('--requests', type=int, default=200, help='Queries per plan.')
+        parser.add_argument('--tags', type=int, default=2, help='Tags filtered on per query.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the data and queries.')
+        parser.add_argument('--explain', action='store_true', help='Print the plan of each query shape.')
+
+    def handle(self, *args, **options):
+        """ entry point to commands """
+        rng = random.Random(options['seed'])
+        users = [
+            seed_user(i, options['recipes'], rng, self.stdout)
+            for i in range(options['users'])
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE core_recipe, core_recipe_tags')
+
+        page_size = RecipeCursorPagination.page_size
+        self.stdout.write(f'{"plan":<24}{"p50 ms":>10}{"p99 ms":>10}')
+        for name, plan in PLANS:
+            rng = random.Random(options['seed'])
+            timings = []
+            for i in range(options['requests']):
+                data = users[i % len(users)]
+                ids = rng.sample(data['tag_ids'], options['tags'])
+                queryset = plan(Recipe.objects.filter(user=data['user']), ids).order_by('-id')
+                timings.append(timed(lambda: list(queryset[:page_size])))
+
+            p50, p99 = percentiles(timings)
+            self.stdout.write(f'{name:<24}{p50:>10.2f}{p99:>10.2f}')
+            if options['explain']:
+                self.stdout.write(queryset[:page_size].explain(analyze=True))
@@ -0,0 +1,93 @@
+"""
+Django command to garbage collect unreferenced media files
+"""
+
+import os
+from datetime import timedelta
+
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.models import Recipe, StoredFile, ImageUpload
+from core.storage import TEMP_DIR, ContentAddressedStorage, collect, count_references
+from recipe.uploads import IMAGE_UPLOAD, discard_upload
+
+
+def walk(storage, directory):
+    """ Yields the names of all the files under a storage directory """
+    if not storage.exists(directory):
+        return
+
+    directories, files = storage.listdir(directory)
+    for name in files:
+        yield os.path.join(directory, name)
+    for name in directories:
+        yield from walk(storage, os.path.join(directory, name))
+
+
+class Command(BaseCommand):
+    """
+    Django command removing the media files no recipe references anymore
+
+    Reference counts are corrected from the recipes first, for the writes
+    that could not maintain them. Anything changed within the grace period
+    is left alone since it may belong to a request still in flight.
+    """
+    help = 'Remove unreferenced media files and expired resumable uploads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int, default=60 * 60,
+                            help='Seconds since the last change before a file is collected.')
+
+    def handle(self, *args, **options):
+        """ entry point to commands """
+        if not isinstance(default_storage, ContentAddressedStorage):
+            raise CommandError('The default storage is not a ContentAddressedStorage.')
+
+        now = timezone.now()
+        cutoff = now - timedelta(seconds=options['grace'])
+
+        expired = ImageUpload.objects.filter(
+            created_at__lt=now - timedelta(seconds=IMAGE_UPLOAD['SESSION_TTL']))
+        sessions = 0
+        for upload in expired:
+            discard_upload(upload)
+            sessions += 1
+
+        references = count_references(Recipe.objects.all())
+        corrected = 0
+        settled = StoredFile.objects.filter(updated_at__lt=cutoff)
+        for name, refcount in settled.values_list('name', 'refcount').iterator():
+            if refcount != references.get(name, 0):
+                # the updated_at filter skips rows changed since they were read
+                corrected += settled.filter(name=name).update(refcount=references.get(name, 0))
+
+        counted = set(StoredFile.objects.values_list('name', flat=True))
+        missing = [name for name in references
+                   if name not in counted and default_storage.exists(name)]
+        StoredFile.objects.bulk_create(
+            [StoredFile(name=name, refcount=references[name]) for name in missing],
+            ignore_conflicts=True,
+        )
+
+        unreferenced = settled.filter(refcount=0).values_list('name', flat=True)
+        collected = len(collect(default_storage, list(unreferenced)))
+
+        # files no row counts, left by rolled back saves and killed workers,
+        # and temporary files of uploads that never completed
+        live = {str(upload_id) for upload_id in ImageUpload.objects.values_list('id', flat=True)}
+        counted = set(StoredFile.objects.values_list('name', flat=True))
+        orphans = 0
+        for directory in ('uploads', TEMP_DIR):
+            for name in walk(default_storage, directory):
+                if name in counted or os.path.basename(name) in live:
+                    continue
+                if default_storage.get_modified_time(name) < cutoff:
+                    FileSystemStorage.delete(default_storage, name)
+                    orphans += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Discarded {sessions} expired uploads, corrected {corrected} reference counts, '
+            f'collected {collected} unreferenced and {orphans} orphaned files.'
+        ))
@@ -0,0 +1,186 @@
+"""
+Django command to load test the recipe api through its real url routes
+"""
+
+import json
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+
+from core.benchmark import WORDS, seed_user, run_concurrently, percentiles
+from recipe.cache import bump_version
+
+
+def endpoints():
+    """ Return (name, url builder) pairs, builders take the user data and a rng """
+    return [
+        ('recipes', lambda data, rng: reverse('recipe:recipe-list')),
+        ('recipes ?tags=', lambda data, rng: reverse('recipe:recipe-list') + '?tags=' + ','.join(
+            map(str, rng.sample(data['tag_ids'], min(2, len(data['tag_ids'])))))),
+        ('recipes ?ingredients=', lambda data, rng: reverse('recipe:recipe-list') + '?ingredients=' + ','.join(
+            map(str, rng.sample(data['ingredient_ids'], min(2, len(data['ingredient_ids'])))))),
+        ('recipes ?q=', lambda data, rng: reverse('recipe:recipe-list') + '?q=' + rng.choice(WORDS)),
+        ('recipe detail', lambda data, rng: reverse(
+            'recipe:recipe-detail', args=[rng.choice(data['recipe_ids'])])),
+        ('tags', lambda data, rng: reverse('recipe:tag-list')),
+        ('tags ?search=', lambda data, rng: reverse('recipe:tag-list') + f'?search=tag {rng.randrange(10)}'),
+        ('ingredients', lambda data, rng: reverse('recipe:ingredient-list')),
+        ('media', lambda data, rng: reverse('recipe:media', args=[rng.choice(data['image_names'])])
+            if data['image_names'] else None),
+    ]
+
+
+class QueryCounter:
+    """ Database execute wrapper counting the queries of the current thread """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    """
+    Django command driving the recipe api urls from concurrent threads and
+    reporting requests/sec, p50/p95/p99 and queries per request for each
+    endpoint, optionally failing on regressions against a previous run
+    """
+    help = (
+        'Seed users with recipes, tags, ingredients and images, then load test '
+        'every recipe api endpoint through the full middleware and url routing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Number of users to seed.')
+        parser.add_argument('--recipes', type=int, default=1000, help='Recipes seeded per user.')
+        parser.add_argument('--tags', type=int, default=20, help='Tags seeded per user.')
+        parser.add_argument('--ingredients', type=int, default=50, help='Ingredients seeded per user.')
+        parser.add_argument('--images', type=int, default=10, help='Recipe images seeded per user.')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent client threads.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the data and requests.')
+        parser.add_argument('--cold', action='store_true',
+                            help='Invalidate the response cache before every request.')
+        parser.add_argument('--format', choices=['table', 'json'], default='table',
+                            help='Output format of the report.')
+        parser.add_argument('--output', help='Also write the json report to this file.')
+        parser.add_argument('--baseline', help='json report of a previous run to compare with.')
+        parser.add_argument('--max-regression', type=float, default=0.2,
+                            help='Allowed p95 and queries per request increase over the baseline, as a fraction.')
+
+    def handle(self, *args, **options):
+        """ entry point to commands """
+        rng = random.Random(options['seed'])
+        users = [
+            seed_user(i, options['recipes'], rng, self.stderr, tags=options['tags'],
+                      ingredients=options['ingredients'], images=options['images'])
+            for i in range(options['users'])
+        ]
+        for data in users:
+            data['token'] = Token.objects.get_or_create(user=data['user'])[0].key
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE core_recipe, core_tag, core_ingredient, '
+                           'core_recipe_tags, core_recipe_ingredients')
+
+        report = {
+            'config': {key: options[key] for key in (
+                'users', 'recipes', 'tags', 'ingredients', 'images', 'requests',
+                'concurrency', 'seed', 'cold')},
+            'endpoints': self.load_test(users, options),
+        }
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+        if options['format'] == 'json':
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.write_table(report['endpoints'])
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                regressions = self.regressions(
+                    json.load(baseline)['endpoints'], report['endpoints'], options['max_regression'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+
+    # the test client requests the 'testserver' host
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def load_test(self, users, options):
+        """ Run the requests of every endpoint and return their statistics """
+        local = threading.local()
+        results = {}
+
+        for name, build in endpoints():
+            rng = random.Random(options['seed'])
+            plan = [(data, build(data, rng)) for data in (
+                users[i % len(users)] for i in range(options['requests']))]
+            plan = [(data, url) for data, url in plan if url is not None]
+            if not plan:
+                continue
+
+            def request(i):
+                data, url = plan[i]
+                if not hasattr(local, 'counter'):
+                    local.client, local.counter = Client(), QueryCounter()
+                if options['cold']:
+                    bump_version(data['user'].id)
+
+                local.counter.count = 0
+                with connection.execute_wrapper(local.counter):
+                    start = time.perf_counter()
+                    response = local.client.get(url, HTTP_AUTHORIZATION=f"Token {data['token']}")
+                    elapsed = time.perf_counter() - start
+                return 1000 * elapsed, local.counter.count, response.status_code
+
+            samples, wall = run_concurrently(request, len(plan), options['concurrency'])
+            timings = [sample[0] for sample in samples]
+            p50, p95, p99 = percentiles(timings, (50, 95, 99))
+            results[name] = {
+                'requests': len(samples),
+                'errors': sum(1 for sample in samples if sample[2] >= 400),
+                'rps': round(len(samples) / wall, 1),
+                'p50_ms': round(p50, 2),
+                'p95_ms': round(p95, 2),
+                'p99_ms': round(p99, 2),
+                'queries_per_request': round(sum(sample[1] for sample in samples) / len(samples), 2),
+            }
+
+        return results
+
+    def write_table(self, results):
+        """ Write one line per endpoint """
+        self.stdout.write(f'{"endpoint":<24}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}'
+                          f'{"p99 ms":>10}{"queries":>10}{"errors":>8}')
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<24}{result["rps"]:>10.1f}{result["p50_ms"]:>10.2f}{result["p95_ms"]:>10.2f}'
+                f'{result["p99_ms"]:>10.2f}{result["queries_per_request"]:>10.2f}{result["errors"]:>8}')
+
+    def regressions(self, baseline, results, max_regression):
+        """ Return a description of each endpoint slower or chattier than the baseline """
+        regressions = []
+        for name, before in baseline.items():
+            after = results.get(name)
+            if after is None:
+                continue
+            if after['p95_ms'] > before['p95_ms'] * (1 + max_regression):
+                regressions.append(f'{name}: p95 {before["p95_ms"]}ms -> {after["p95_ms"]}ms')
+            # cache hits make the query count of concurrent runs vary slightly
+            if after['queries_per_request'] > before['queries_per_request'] * (1 + max_regression):
+                regressions.append(f'{name}: queries per request '
+                                   f'{before["queries_per_request"]} -> {after["queries_per_request"]}')
+            if after['errors'] > before['errors']:
+                regressions.append(f'{name}: errors {before["errors"]} -> {after["errors"]}')
+
+        return regressions
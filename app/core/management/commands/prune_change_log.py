@@ -0,0 +1,31 @@
+"""
+Django command to prune the old tombstones of the change log
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core import changes
+
+
+class Command(BaseCommand):
+    """
+    Django command deleting the change log tombstones older than a number of
+    days, see core.changes
+
+    The clients that last synced before the pruned tombstones get a 410
+    from the sync endpoint and sync all the rows again.
+    """
+    help = 'Delete the change log entries of rows deleted more than --days ago.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90,
+                            help='Days since the deletion before a tombstone is pruned.')
+
+    def handle(self, *args, **options):
+        """ entry point to commands """
+        pruned = changes.prune(timezone.now() - timedelta(days=options['days']))
+
+        self.stdout.write(self.style.SUCCESS(f'Pruned {pruned} tombstones.'))
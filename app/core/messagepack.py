@@ -0,0 +1,114 @@
+""" MessagePack encoding of the api payloads, when msgpack is installed
+
+MessagePackRenderer and MessagePackParser carry the same payload as the
+JSON classes. Values msgpack has no native type for, like datetimes or
+lazy translations, are converted by DRF's JSONEncoder as in JSON. The
+fields a view lists in fixed_point_fields, {name: decimal places}, are
+sent as integers instead of decimal strings, a price of "5.50" is 550,
+and integers received in them are turned back into decimals. Only the
+top level objects are converted, see _convert.
+"""
+
+from decimal import Decimal
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.metrics import serialization
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MEDIA_TYPE = 'application/msgpack'
+
+_default = JSONEncoder().default
+
+
+def _to_fixed_point(value, places):
+    """ Return the integer of a decimal string with the given decimal places """
+    if isinstance(value, (str, Decimal)):
+        try:
+            return int(Decimal(value).scaleb(places).to_integral_value())
+        except (ArithmeticError, ValueError):
+            pass
+
+    # None, or the validation errors of the field
+    return value
+
+
+def _from_fixed_point(value, places):
+    """ Return the decimal of a fixed point integer """
+    if not isinstance(value, int) or isinstance(value, bool):
+        # left to the serializer's validation
+        return value
+    return Decimal(value).scaleb(-places)
+
+
+def _convert(data, fields, convert):
+    """ Return data with convert applied to the fields of the payload's objects
+
+    The objects are the payload, the items of a list payload, or those of
+    the results of a page. Nested objects, like the tags of a recipe, are
+    left as they are.
+    """
+    if isinstance(data, list):
+        return [_convert(item, fields, convert) for item in data]
+    if not isinstance(data, dict):
+        return data
+    if 'results' in data and isinstance(data['results'], list):
+        return dict(data, results=_convert(data['results'], fields, convert))
+
+    converted = dict(data)
+    for key in fields.keys() & converted.keys():
+        converted[key] = convert(converted[key], fields[key])
+    return converted
+
+
+def _fixed_point_fields(context):
+    view = (context or {}).get('view')
+    return getattr(view, 'fixed_point_fields', {})
+
+
+class MessagePackRenderer(BaseRenderer):
+    """ Renderer encoding the response data with MessagePack """
+
+    media_type = MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with serialization():
+            if data is None:
+                return b''
+
+            fields = _fixed_point_fields(renderer_context)
+            if fields:
+                data = _convert(data, fields, _to_fixed_point)
+            return msgpack.packb(data, default=_default, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    """ Parser decoding MessagePack request bodies """
+
+    media_type = MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            data = msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, TypeError, msgpack.UnpackException) as exc:
+            raise ParseError('MessagePack parse error - %s' % str(exc))
+
+        fields = _fixed_point_fields(parser_context)
+        if fields:
+            data = _convert(data, fields, _from_fixed_point)
+        return data
+
+
+# added to the renderer and parser classes of the views offering the format
+RENDERER_CLASSES = [MessagePackRenderer] if msgpack is not None else []
+PARSER_CLASSES = [MessagePackParser] if msgpack is not None else []
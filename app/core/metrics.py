@@ -0,0 +1,289 @@
+""" Per request performance metrics
+
+MetricsMiddleware times every request, its database queries, and with
+serialization() blocks the serializers and renderer it ran, into Prometheus
+style histograms labelled with the url name and the DRF action. Every worker
+process keeps its histograms in memory and writes them to its own file of
+METRICS['DIRECTORY'] at most once per FLUSH_INTERVAL. The /metrics view
+sums the files of all the workers, restarted ones included since the
+histograms only ever grow, so the directory is emptied when the server
+starts. With SERVER_TIMING the timings of each request are also sent back
+in a Server-Timing header.
+"""
+
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+METRICS = {
+    'ENABLED': True,
+    'DIRECTORY': '/vol/metrics',
+    'FLUSH_INTERVAL': 1,
+    'SERVER_TIMING': False,
+    # bearer token of the scraper, /metrics answers 404 without one
+    'TOKEN': '',
+    'DURATION_BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'QUERY_BUCKETS': (0, 1, 2, 5, 10, 20, 50, 100),
+    'SIZE_BUCKETS': (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+}
+METRICS.update(getattr(settings, 'METRICS', {}))
+
+# name -> (help, buckets)
+HISTOGRAMS = {
+    'http_request_duration_seconds': (
+        'Wall time of the request.', 'DURATION_BUCKETS'),
+    'http_request_db_duration_seconds': (
+        'Time spent executing database queries.', 'DURATION_BUCKETS'),
+    'http_request_db_queries': (
+        'Number of database queries.', 'QUERY_BUCKETS'),
+    'http_request_serialization_duration_seconds': (
+        'Time spent in the serializers and the renderer.', 'DURATION_BUCKETS'),
+    'http_response_size_bytes': (
+        'Size of the response body, when known before streaming.', 'SIZE_BUCKETS'),
+}
+
+_local = threading.local()
+
+
+class Registry:
+    """ Histograms of this process, written to a file of its own """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._name = f'{self._pid}-{uuid.uuid4().hex[:8]}.json'
+        self._histograms = {}
+        self._dirty = False
+        self._timer = None
+
+    def record(self, labels, samples):
+        """ Add one sample of each named histogram for the labels """
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            if self._pid != os.getpid():
+                # a forked worker, the histograms so far are its parent's
+                self._reset()
+
+            for name, value in samples.items():
+                buckets = METRICS[HISTOGRAMS[name][1]]
+                histogram = self._histograms.get((name, labels))
+                if histogram is None:
+                    histogram = self._histograms[name, labels] = {
+                        'counts': [0] * (len(buckets) + 1), 'sum': 0}
+                histogram['counts'][bisect.bisect_left(buckets, value)] += 1
+                histogram['sum'] += value
+
+            self._dirty = True
+            flush_now = METRICS['FLUSH_INTERVAL'] <= 0
+            if not flush_now and self._timer is None:
+                self._timer = threading.Timer(METRICS['FLUSH_INTERVAL'], self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if flush_now:
+            self.flush()
+
+    def flush(self):
+        """ Write the histograms to the file of this process if they changed """
+        with self._lock:
+            self._timer = None
+            if not self._dirty or self._pid != os.getpid():
+                return
+
+            histograms = [
+                {'name': name, 'labels': dict(labels), **histogram}
+                for (name, labels), histogram in self._histograms.items()
+            ]
+            path = os.path.join(METRICS['DIRECTORY'], self._name)
+            os.makedirs(METRICS['DIRECTORY'], exist_ok=True)
+            # the scraper never reads a partly written file
+            with open(path + '.tmp', 'w') as written:
+                json.dump(histograms, written)
+            os.replace(path + '.tmp', path)
+            self._dirty = False
+
+    def clear(self):
+        """ Drop the histograms of this process and its file """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            path = os.path.join(METRICS['DIRECTORY'], self._name)
+            if os.path.exists(path):
+                os.remove(path)
+            self._reset()
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+
+def collect():
+    """ Return the histograms of all the workers, summed by name and labels """
+    registry.flush()
+    merged = {}
+    try:
+        files = [entry.path for entry in os.scandir(METRICS['DIRECTORY']) if entry.name.endswith('.json')]
+    except FileNotFoundError:
+        files = []
+
+    for path in files:
+        try:
+            with open(path) as stored:
+                histograms = json.load(stored)
+        except (OSError, ValueError):
+            continue
+
+        for histogram in histograms:
+            key = (histogram['name'], tuple(sorted(histogram['labels'].items())))
+            total = merged.get(key)
+            if total is None:
+                merged[key] = histogram
+            elif len(total['counts']) == len(histogram['counts']):
+                total['counts'] = [a + b for a, b in zip(total['counts'], histogram['counts'])]
+                total['sum'] += histogram['sum']
+
+    return merged
+
+
+def _format_labels(labels):
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def render():
+    """ Return the histograms of all the workers in the Prometheus text format """
+    merged = collect()
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for (histogram_name, labels), histogram in sorted(merged.items()):
+            if histogram_name != name:
+                continue
+
+            cumulative = 0
+            bounds = [repr(float(bound)) for bound in METRICS[buckets]] + ['+Inf']
+            for bound, count in zip(bounds, histogram['counts']):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {histogram["sum"]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+
+    return '\n'.join(lines) + '\n'
+
+
+class RequestMetrics:
+    """ Timings of the request being handled by the current thread """
+
+    def __init__(self):
+        self.db_time = 0
+        self.queries = 0
+        self.serialization_time = 0
+        self.serializing = False
+
+    def execute(self, execute, sql, params, many, context):
+        """ Database execute wrapper timing the queries """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+def current():
+    """ Return the metrics of the request of the current thread, or None """
+    return getattr(_local, 'metrics', None)
+
+
+@contextmanager
+def serialization():
+    """ Add the time of the block to the serialization time of the request
+
+    Blocks nested in another one, like nested serializers, are part of it.
+    """
+    metrics = current()
+    if metrics is None or metrics.serializing:
+        yield
+        return
+
+    metrics.serializing = True
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serialization_time += time.perf_counter() - start
+        metrics.serializing = False
+
+
+class TimedSerializerMixin:
+    """ Serializer mixin adding its to_representation time to the request metrics """
+
+    def to_representation(self, instance):
+        with serialization():
+            return super().to_representation(instance)
+
+
+def _labels(request):
+    """ The url name and the DRF action, or the method of other views """
+    match = request.resolver_match
+    if match is None:
+        return {'view': 'unmatched', 'action': request.method.lower()}
+
+    method = request.method.lower()
+    actions = getattr(match.func, 'actions', None) or {}
+    return {'view': match.view_name, 'action': actions.get(method, method)}
+
+
+class MetricsMiddleware:
+    """ Records the metrics of every request, it goes first in MIDDLEWARE """
+
+    def __init__(self, get_response):
+        if not METRICS['ENABLED']:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = _local.metrics = RequestMetrics()
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(metrics.execute):
+                response = self.get_response(request)
+        finally:
+            _local.metrics = None
+        duration = time.perf_counter() - start
+
+        samples = {
+            'http_request_duration_seconds': duration,
+            'http_request_db_duration_seconds': metrics.db_time,
+            'http_request_db_queries': metrics.queries,
+            'http_request_serialization_duration_seconds': metrics.serialization_time,
+        }
+        if not response.streaming:
+            samples['http_response_size_bytes'] = len(response.content)
+        elif response.has_header('Content-Length'):
+            samples['http_response_size_bytes'] = int(response['Content-Length'])
+        registry.record(_labels(request), samples)
+
+        if METRICS['SERVER_TIMING']:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={1000 * metrics.db_time:.1f};desc="{metrics.queries} queries"',
+                f'serialization;dur={1000 * metrics.serialization_time:.1f}',
+                f'total;dur={1000 * duration:.1f}',
+            ])
+
+        return response
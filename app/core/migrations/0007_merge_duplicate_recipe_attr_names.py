@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-18 01:48
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_names(apps, schema_editor):
+    """ Merge tags/ingredients sharing a (user, name) into the oldest row """
+    Recipe = apps.get_model('core', 'Recipe')
+
+    for model_name, field_name in (('Tag', 'tags'), ('Ingredient', 'ingredients')):
+        model = apps.get_model('core', model_name)
+        through = Recipe._meta.get_field(field_name).remote_field.through
+        fk = f'{model_name.lower()}_id'
+
+        duplicates = (model.objects.values('user', 'name')
+                      .annotate(keep=Min('id'), total=Count('id'))
+                      .filter(total__gt=1))
+        for dup in duplicates:
+            others = model.objects.filter(user=dup['user'], name=dup['name']).exclude(id=dup['keep'])
+            linked = set(through.objects.filter(**{f'{fk}__in': others})
+                         .values_list('recipe_id', flat=True))
+            linked -= set(through.objects.filter(**{fk: dup['keep']})
+                          .values_list('recipe_id', flat=True))
+            through.objects.bulk_create(
+                [through(recipe_id=recipe_id, **{fk: dup['keep']}) for recipe_id in linked]
+            )
+            others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_recipe_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_names, migrations.RunPython.noop),
+    ]
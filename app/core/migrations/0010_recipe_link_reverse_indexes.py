@@ -0,0 +1,25 @@
+from django.db import migrations
+
+# The auto created through tables only get a unique (recipe_id, tag_id)
+# index and one single column index per FK. The ?tags= / ?ingredients=
+# filters go from the tag/ingredient to the recipes, so a reverse composite
+# index lets postgres answer them with an index only scan.
+REVERSE_INDEXES = [
+    ('core_recipe_tags', 'tag_id', 'recipe_tags_tag_recipe_idx'),
+    ('core_recipe_ingredients', 'ingredient_id', 'recipe_ingredients_ingredient_recipe_idx'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({column}, recipe_id);',
+            f'DROP INDEX IF EXISTS {name};',
+        )
+        for table, column, name in REVERSE_INDEXES
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:14
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 10000
+
+
+def _link_names(through, target):
+    return Subquery(
+        through.objects.filter(recipe_id=OuterRef('pk'))
+        .values('recipe_id')
+        .annotate(names=StringAgg(f'{target}__name', ' '))
+        .values('names')
+    )
+
+
+def search_vector(Recipe):
+    """ The search vector as core.search computed it when this migration was
+    written, copied so later changes there do not alter this migration """
+    config = getattr(settings, 'RECIPE_SEARCH_CONFIG', 'english')
+    return (
+        SearchVector('title', weight='A', config=config)
+        + SearchVector(_link_names(Recipe.tags.through, 'tag'), weight='B', config=config)
+        + SearchVector(_link_names(Recipe.ingredients.through, 'ingredient'), weight='B', config=config)
+        + SearchVector('description', weight='C', config=config)
+    )
+
+
+def fill_search_vectors(apps, schema_editor):
+    """ Compute the search vector of the existing recipes in id batches """
+    Recipe = apps.get_model('core', 'Recipe')
+    ids = list(Recipe.objects.order_by('id').values_list('id', flat=True))
+
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch = ids[start:start + BATCH_SIZE]
+        Recipe.objects.filter(id__gte=batch[0], id__lte=batch[-1]).update(
+            search_vector=search_vector(Recipe))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_recipe_link_reverse_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='recipe_search_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:35
+
+from collections import Counter
+
+from django.db import migrations, models
+
+BATCH_SIZE = 10000
+
+
+def count_references(Recipe):
+    """ The media names referenced by the recipes, as core.storage counted
+    them when this migration was written, copied so later changes there do
+    not alter this migration """
+    counts = Counter()
+    for image, renditions in Recipe.objects.values_list('image', 'renditions').iterator():
+        if image:
+            counts[image] += 1
+        for rendition in renditions.values():
+            counts[rendition['webp']] += 1
+            counts[rendition['jpeg']] += 1
+
+    return counts
+
+
+def count_existing_references(apps, schema_editor):
+    """ Count the references of the recipes to their existing image files """
+    Recipe = apps.get_model('core', 'Recipe')
+    StoredFile = apps.get_model('core', 'StoredFile')
+    StoredFile.objects.bulk_create(
+        [StoredFile(name=name, refcount=refcount)
+         for name, refcount in count_references(Recipe).items()],
+        batch_size=BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_image_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(count_existing_references, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 3.2.25 on 2026-10-18 03:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# the existing rows and links of every user, numbered from 1 in this order
+FILL_CHANGES = """
+INSERT INTO core_change (user_id, seq, kind, object_id, target_id, deleted, changed_at)
+SELECT user_id, row_number() OVER (PARTITION BY user_id ORDER BY rank, object_id, target_id),
+       kind, object_id, target_id, false, now()
+FROM (
+    SELECT user_id, 1 AS rank, 'tag' AS kind, id AS object_id, 0 AS target_id FROM core_tag
+    UNION ALL
+    SELECT user_id, 2, 'ingredient', id, 0 FROM core_ingredient
+    UNION ALL
+    SELECT user_id, 3, 'recipe', id, 0 FROM core_recipe
+    UNION ALL
+    SELECT recipe.user_id, 4, 'recipe_tag', link.recipe_id, link.tag_id
+    FROM core_recipe_tags link JOIN core_recipe recipe ON recipe.id = link.recipe_id
+    UNION ALL
+    SELECT recipe.user_id, 5, 'recipe_ingredient', link.recipe_id, link.ingredient_id
+    FROM core_recipe_ingredients link JOIN core_recipe recipe ON recipe.id = link.recipe_id
+) entries;
+
+INSERT INTO core_changecounter (user_id, seq, pruned)
+SELECT user_id, max(seq), 0 FROM core_change GROUP BY user_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_recipe_media_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeCounter',
+            fields=[
+                ('user', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, serialize=False, to='core.user')),
+                ('seq', models.BigIntegerField(default=0)),
+                ('pruned', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('recipe', 'Recipe'), ('tag', 'Tag'), ('ingredient', 'Ingredient'), ('recipe_tag', 'Recipe tag'), ('recipe_ingredient', 'Recipe ingredient')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('target_id', models.BigIntegerField(default=0)),
+                ('deleted', models.BooleanField(default=False)),
+                ('changed_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['user', 'seq'], name='change_user_seq_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='change',
+            constraint=models.UniqueConstraint(fields=('user', 'kind', 'object_id', 'target_id'), name='unique_change_per_row'),
+        ),
+        migrations.RunSQL(FILL_CHANGES, 'DELETE FROM core_change; DELETE FROM core_changecounter;'),
+    ]
@@ -4,6 +4,8 @@ import os
 import uuid
 from django.conf import settings
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth.models import (AbstractBaseUser,
                                  PermissionsMixin,
                                  BaseUserManager, )
@@ -41,6 +43,35 @@ class UserManager(BaseUserManager):
 
 
 
+class RecipeAttrManager(models.Manager):
+    """ Manager for the per user named recipe attributes (tags, ingredients) """
+
+    def get_or_create_by_names(self, user, names):
+        """ Return objects for the names of user, creating the missing ones in bulk """
+        names = list(dict.fromkeys(names))
+        if not names:
+            return []
+
+        found = {obj.name: obj for obj in self.filter(user=user, name__in=names)}
+        missing = [name for name in names if name not in found]
+        if missing:
+            # a concurrent request may insert the same names first, the unique
+            # (user, name) constraint turns those rows into no-ops and the
+            # objects are read back instead.
+            self.bulk_create(
+                [self.model(user=user, name=name) for name in missing],
+                ignore_conflicts=True,
+            )
+            created = list(self.filter(user=user, name__in=missing))
+            found.update({obj.name: obj for obj in created})
+
+            # bulk_create() sends no post_save, core.signals imports this module
+            from core.signals import recipe_attrs_bulk_created
+            recipe_attrs_bulk_created.send(sender=self.model, user=user, objects=created)
+
+        return [found[name] for name in names]
+
+
 class User(AbstractBaseUser, PermissionsMixin):
     """ Custom user class """
 
@@ -64,6 +95,24 @@ class Recipe(models.Model):
     tags = models.ManyToManyField('Tag')
     ingredients = models.ManyToManyField('Ingredient')
     image = models.ImageField(null = True, upload_to = recipe_image_file_path)
+    # resized copies of image written in the background, see recipe.renditions
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+    # also bumped when the recipe's tags/ingredients change, see core.signals
+    updated_at = models.DateTimeField(auto_now=True)
+    # maintained in SQL by core.signals, see core.search
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        # matches the user filter + '-id' keyset pagination of the recipe list
+        # and the max(updated_at) of the conditional GET validators
+        indexes = [
+            models.Index(fields=['user', '-id'], name='recipe_user_id_desc_idx'),
+            models.Index(fields=['user', 'updated_at'], name='recipe_user_updated_idx'),
+            GinIndex(fields=['search_vector'], name='recipe_search_idx'),
+            # ownership checks of the media downloads, see recipe.media
+            models.Index(fields=['image'], name='recipe_image_idx'),
+            GinIndex(fields=['renditions'], name='recipe_renditions_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -72,6 +121,20 @@ class Tag(models.Model):
     """ Model for Tags for filtering recipes """
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete = models.CASCADE)
     name = models.CharField(max_length=255)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = RecipeAttrManager()
+
+    class Meta:
+        # also serves the user filter + '-name' keyset pagination
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'name'], name='unique_tag_name_per_user'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'updated_at'], name='tag_user_updated_idx'),
+            # ILIKE and similarity matches of the autocomplete, see recipe.autocomplete
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='tag_name_trgm_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -81,6 +144,93 @@ class Ingredient(models.Model):
 
     user= models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = RecipeAttrManager()
+
+    class Meta:
+        # also serves the user filter + '-name' keyset pagination
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'name'], name='unique_ingredient_name_per_user'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'updated_at'], name='ingredient_user_updated_idx'),
+            # ILIKE and similarity matches of the autocomplete, see recipe.autocomplete
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='ingredient_name_trgm_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+class ImageUpload(models.Model):
+    """ Session of a resumable recipe image upload, see recipe.uploads """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='image_uploads')
+    length = models.PositiveIntegerField()
+    offset = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.recipe_id}: {self.offset}/{self.length}'
+
+
+class StoredFile(models.Model):
+    """ Reference count of a content addressed media file, see core.storage """
+    name = models.CharField(max_length=255, primary_key=True)
+    refcount = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.refcount}'
+
+
+class ChangeCounter(models.Model):
+    """ Last change log number of a user, see core.changes """
+    # rows of deleted users are removed by core.changes, after the cascade
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING,
+                                primary_key=True, db_constraint=False)
+    seq = models.BigIntegerField(default=0)
+    # the tombstones up to this number were pruned
+    pruned = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.user_id}: {self.seq}'
+
+
+class Change(models.Model):
+    """ Latest change of a recipe, tag, ingredient or recipe link, see core.changes """
+    RECIPE = 'recipe'
+    TAG = 'tag'
+    INGREDIENT = 'ingredient'
+    RECIPE_TAG = 'recipe_tag'
+    RECIPE_INGREDIENT = 'recipe_ingredient'
+    KIND_CHOICES = [
+        (RECIPE, 'Recipe'),
+        (TAG, 'Tag'),
+        (INGREDIENT, 'Ingredient'),
+        (RECIPE_TAG, 'Recipe tag'),
+        (RECIPE_INGREDIENT, 'Recipe ingredient'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING,
+                             db_constraint=False)
+    seq = models.BigIntegerField()
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # the recipe of the links
+    object_id = models.BigIntegerField()
+    # the tag or ingredient of the links, 0 for the rows
+    target_id = models.BigIntegerField(default=0)
+    deleted = models.BooleanField(default=False)
+    changed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'kind', 'object_id', 'target_id'],
+                                    name='unique_change_per_row'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'seq'], name='change_user_seq_idx'),
+        ]
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return f'{self.user_id} #{self.seq}: {self.kind} {self.object_id}'
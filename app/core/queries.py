@@ -0,0 +1,149 @@
+""" Repeated (N+1) and slow query detection
+
+QueryInspectionMiddleware wraps the database connection of every request.
+Queries slower than SLOW_QUERY_MS are logged with their EXPLAIN plan. A
+SAMPLE_RATE fraction of the requests also count their queries by shape,
+the SQL without its literals and IN list lengths, and log the shapes run
+REPEAT_THRESHOLD times or more: one query per row of a list, the N+1
+signature. In STRICT mode, which the recipe api tests turn on, every
+request is counted and a repeated shape that ALLOWED does not match
+raises RepeatedQueriesError.
+"""
+
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+QUERY_INSPECTION = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 0.01,
+    'REPEAT_THRESHOLD': 5,
+    # test data has a few rows, while writes legitimately run some shapes
+    # twice, like the lookup before and after a bulk get or create
+    'STRICT_REPEAT_THRESHOLD': 3,
+    'SLOW_QUERY_MS': 200,
+    'EXPLAIN': True,
+    'STRICT': False,
+    # regular expressions of the shapes allowed to repeat
+    'ALLOWED': [],
+}
+QUERY_INSPECTION.update(getattr(settings, 'QUERY_INSPECTION', {}))
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN \(\?(?:, \?)*\)', re.IGNORECASE)
+_VALUES = re.compile(r'\bVALUES (\([^()]*\))(?:, \1)+', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+# savepoints and transaction control repeat by design
+_STATEMENT = re.compile(r'\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+_EXPLAINABLE = re.compile(r'\s*(SELECT|WITH)\b', re.IGNORECASE)
+
+
+class RepeatedQueriesError(Exception):
+    """ A request ran the same query shape repeatedly in strict mode """
+
+
+def fingerprint(sql):
+    """ Return the shape of a query, its SQL with the literals and list lengths removed """
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql).replace('%s', '?')
+    sql = _SPACE.sub(' ', sql).strip()
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _VALUES.sub(r'VALUES \1, ...', sql)
+
+
+class QueryInspector:
+    """ Database execute wrapper timing queries and counting them by SQL """
+
+    def __init__(self, where, count=True):
+        self.where = where
+        self.count = count
+        self.queries = Counter()
+        self._explaining = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if self._explaining:
+            return execute(sql, params, many, context)
+
+        if self.count:
+            # the orm writes the same SQL for the same shape, so the
+            # fingerprints are only computed for the distinct ones at the end
+            self.queries[sql] += 1
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = 1000 * (time.perf_counter() - start)
+        if duration >= QUERY_INSPECTION['SLOW_QUERY_MS']:
+            self._log_slow(sql, params, many, context['connection'], duration)
+
+        return result
+
+    def _log_slow(self, sql, params, many, db, duration):
+        plan = ''
+        if QUERY_INSPECTION['EXPLAIN'] and not many and _EXPLAINABLE.match(sql):
+            self._explaining = True
+            try:
+                # a savepoint, a failed EXPLAIN must not abort the transaction
+                with transaction.atomic(using=db.alias), db.cursor() as cursor:
+                    cursor.execute('EXPLAIN ' + sql, params)
+                    plan = '\n'.join(row[0] for row in cursor.fetchall())
+            except DatabaseError as error:
+                plan = f'EXPLAIN failed: {error}'
+            finally:
+                self._explaining = False
+
+        logger.warning('Slow query (%.1f ms) in %s: %s\n%s', duration, self.where, sql, plan)
+
+    def repeated(self, threshold):
+        """ Return (shape, count) of the shapes run threshold times or more """
+        shapes = Counter()
+        for sql, count in self.queries.items():
+            if _STATEMENT.match(sql):
+                shapes[fingerprint(sql)] += count
+
+        return [
+            (shape, count) for shape, count in shapes.most_common()
+            if count >= threshold and not any(
+                re.search(allowed, shape) for allowed in QUERY_INSPECTION['ALLOWED'])
+        ]
+
+
+@contextmanager
+def inspect_queries(where, count=True, strict=False):
+    """ Inspect the queries run inside the block, see the module docstring """
+    inspector = QueryInspector(where, count)
+    with connection.execute_wrapper(inspector):
+        yield inspector
+
+    if not count:
+        return
+    threshold = QUERY_INSPECTION['STRICT_REPEAT_THRESHOLD' if strict else 'REPEAT_THRESHOLD']
+    repeated = inspector.repeated(threshold)
+    for shape, times in repeated:
+        logger.warning('Repeated query (%d times) in %s: %s', times, where, shape)
+    if strict and repeated:
+        raise RepeatedQueriesError(f'{where} repeated queries: ' + '; '.join(
+            f'{times} x {shape}' for shape, times in repeated))
+
+
+class QueryInspectionMiddleware:
+    """ Inspects the queries of every request, see the module docstring """
+
+    def __init__(self, get_response):
+        if not QUERY_INSPECTION['ENABLED']:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        strict = QUERY_INSPECTION['STRICT']
+        count = strict or random.random() < QUERY_INSPECTION['SAMPLE_RATE']
+        with inspect_queries(f'{request.method} {request.path}', count, strict):
+            return self.get_response(request)
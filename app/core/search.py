@@ -0,0 +1,52 @@
+""" Full text search of recipes
+
+Recipe.search_vector holds the weighted tsvector of a recipe: the title
+(A), the names of its tags and ingredients (B) and the description (C).
+It is recomputed in SQL by the receivers in core.signals whenever one of
+those changes, so searching never has to join the tags/ingredients.
+"""
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import F, FloatField, OuterRef, Subquery
+from django.db.models.functions import Cast
+
+SEARCH_CONFIG = getattr(settings, 'RECIPE_SEARCH_CONFIG', 'english')
+
+
+def _link_names(through, target):
+    """ Subquery of the space separated names linked to the outer recipe """
+    return Subquery(
+        through.objects.filter(recipe_id=OuterRef('pk'))
+        .values('recipe_id')
+        .annotate(names=StringAgg(f'{target}__name', ' '))
+        .values('names')
+    )
+
+
+def search_vector(recipe_model):
+    """ Return the expression computing the search vector of a recipe
+
+    Takes the model so it also works with historical versions of it. The
+    migrations filling the vector keep their own copy of the expression.
+    """
+    return (
+        SearchVector('title', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(_link_names(recipe_model.tags.through, 'tag'),
+                       weight='B', config=SEARCH_CONFIG)
+        + SearchVector(_link_names(recipe_model.ingredients.through, 'ingredient'),
+                       weight='B', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def search(queryset, text):
+    """ Filter a recipe queryset on text and annotate it with a rank
+
+    The rank is cast to double precision so the cursor paginator can
+    round trip it exactly.
+    """
+    query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+    return queryset.filter(search_vector=query).annotate(
+        rank=Cast(SearchRank(F('search_vector'), query), FloatField()))
@@ -0,0 +1,96 @@
+""" Custom signals and signal receivers for core models """
+
+from django.core.files.storage import default_storage
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from core.models import Recipe, Tag, Ingredient
+from core.search import search_vector
+
+# Sent after recipes and their tag/ingredient links are inserted with
+# bulk_create(), which bypasses the post_save and m2m_changed signals.
+# Provides the arguments: user, recipes
+recipes_bulk_created = Signal()
+
+# Sent after tags or ingredients are inserted with bulk_create() by
+# RecipeAttrManager.get_or_create_by_names(), the sender is the model.
+# Provides the arguments: user, objects
+recipe_attrs_bulk_created = Signal()
+
+
+def touch_recipes(recipes):
+    """ Bump updated_at and recompute the search vector of a recipe queryset
+
+    Runs as one UPDATE and sends no signals.
+    """
+    recipes.update(updated_at=timezone.now(), search_vector=search_vector(Recipe))
+
+
+def _link_field(sender):
+    return 'tags' if sender in (Tag, Recipe.tags.through) else 'ingredients'
+
+
+@receiver(post_save, sender=Recipe)
+def _index_recipe(sender, instance, update_fields=None, **kwargs):
+    """ Title and description are part of the search vector """
+    if update_fields is None or {'title', 'description'} & set(update_fields):
+        Recipe.objects.filter(pk=instance.pk).update(search_vector=search_vector(Recipe))
+
+
+@receiver(recipes_bulk_created)
+def _index_bulk_created_recipes(sender, user, recipes, **kwargs):
+    """ bulk_create() skips post_save, index the whole batch at once """
+    Recipe.objects.filter(pk__in=[recipe.pk for recipe in recipes]).update(
+        search_vector=search_vector(Recipe))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def _touch_recipes_on_links(sender, instance, action, reverse, pk_set, **kwargs):
+    """ A recipe changes whenever its tags/ingredients links change """
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            touch_recipes(Recipe.objects.filter(pk=instance.pk))
+    elif action in ('post_add', 'post_remove'):
+        touch_recipes(Recipe.objects.filter(pk__in=pk_set))
+    elif action == 'pre_clear':
+        # the links are gone once post_clear is sent
+        instance._cleared_recipe_ids = list(Recipe.objects.filter(
+            **{_link_field(sender): instance}).values_list('pk', flat=True))
+    elif action == 'post_clear':
+        touch_recipes(Recipe.objects.filter(pk__in=instance._cleared_recipe_ids))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def _touch_recipes_on_rename(sender, instance, created, **kwargs):
+    """ Recipes embed the names of their tags/ingredients """
+    if not created:
+        touch_recipes(Recipe.objects.filter(**{_link_field(sender): instance}))
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def _remember_recipes_on_delete(sender, instance, **kwargs):
+    """ Deleting a tag/ingredient silently removes its recipe links """
+    instance._deleted_recipe_ids = list(Recipe.objects.filter(
+        **{_link_field(sender): instance}).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def _touch_recipes_on_delete(sender, instance, **kwargs):
+    """ Reindex the recipes without the deleted name """
+    touch_recipes(Recipe.objects.filter(pk__in=instance._deleted_recipe_ids))
+
+
+@receiver(post_delete, sender=Recipe)
+def _release_recipe_files(sender, instance, **kwargs):
+    """ Drop the references of a deleted recipe to its image files, see core.storage """
+    names = [instance.image.name] if instance.image else []
+    names += [rendition[image_format]
+              for rendition in instance.renditions.values()
+              for image_format in ('webp', 'jpeg')]
+    for name in names:
+        default_storage.delete(name)
@@ -0,0 +1,216 @@
+""" Content addressed media storage with reference counting
+
+Files are named after the sha256 of their content, so identical uploads
+share one file and a name never changes content, which lets the proxy
+cache media forever. Every save() takes a reference to the file in a
+core.models.StoredFile row and every delete() drops one, the file itself
+is removed once the last reference is gone.
+
+New content is written under a temporary name and only moved in place
+after its reference is taken, while files are removed under the lock of
+their deleted row. A collection racing with a save of the same content
+therefore never removes the file that save() returns. Files left behind
+by rolled back transactions or killed workers are swept by the
+collect_media command.
+
+The reference a save() takes is only dropped by a delete(), so callers
+saving files before the row pointing at them is updated must delete them
+again when that update fails or is rejected. claim() does it for them.
+"""
+
+import hashlib
+import os
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from django.core.files.storage import FileSystemStorage
+from django.db import connection, transaction
+
+from core.models import StoredFile
+
+# written to before being moved under their content name, never served
+TEMP_DIR = 'tmp'
+CHUNK_SIZE = 64 * 1024
+
+
+def temp_name(*parts):
+    """ Returns a fresh storage name under the temporary directory """
+    return os.path.join(TEMP_DIR, *parts, uuid.uuid4().hex)
+
+
+def _counted(names):
+    counts = Counter(name for name in names if name)
+    return list(counts), list(counts.values())
+
+
+def count_references(recipes):
+    """ Returns a Counter of the media names referenced by a recipe queryset """
+    counts = Counter()
+    for image, renditions in recipes.values_list('image', 'renditions').iterator():
+        if image:
+            counts[image] += 1
+        for rendition in renditions.values():
+            counts[rendition['webp']] += 1
+            counts[rendition['jpeg']] += 1
+
+    return counts
+
+
+def acquire(names):
+    """ Take a reference to each of names, repeated names take several """
+    names, counts = _counted(names)
+    if not names:
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            INSERT INTO {StoredFile._meta.db_table} AS f (name, refcount, updated_at)
+            SELECT d.name, d.n, now() FROM unnest(%s::varchar[], %s::int[]) AS d(name, n)
+            ON CONFLICT (name) DO UPDATE
+            SET refcount = f.refcount + EXCLUDED.refcount, updated_at = EXCLUDED.updated_at
+        """, [names, counts])
+
+
+def release(names):
+    """ Drop a reference to each of names
+
+    Returns the counted names and those of them left without references.
+    """
+    names, counts = _counted(names)
+    if not names:
+        return set(), set()
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            UPDATE {StoredFile._meta.db_table} AS f
+            SET refcount = GREATEST(f.refcount - d.n, 0), updated_at = now()
+            FROM unnest(%s::varchar[], %s::int[]) AS d(name, n)
+            WHERE f.name = d.name
+            RETURNING f.name, f.refcount
+        """, [names, counts])
+        rows = cursor.fetchall()
+
+    return {name for name, _ in rows}, {name for name, refcount in rows if refcount == 0}
+
+
+def collect(storage, names):
+    """ Remove the files of names that are still without references """
+    if not names:
+        return []
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                DELETE FROM {StoredFile._meta.db_table}
+                WHERE name = ANY(%s::varchar[]) AND refcount = 0
+                RETURNING name
+            """, [list(names)])
+            collected = [name for name, in cursor.fetchall()]
+
+        # removed before commit, a concurrent acquire() of the same name
+        # waits for the deleted row and moves its own copy in afterwards
+        for name in collected:
+            FileSystemStorage.delete(storage, name)
+
+    return collected
+
+
+class Claim:
+    """ References saved by a block of claim(), dropped unless kept """
+
+    def __init__(self):
+        self.names = []
+
+    def add(self, name):
+        """ Take over the reference to name that a save() returned """
+        self.names.append(name)
+        return name
+
+    def keep(self, name):
+        """ Keep one reference to name added to the claim, a row now holds it """
+        self.names.remove(name)
+
+
+@contextmanager
+def claim(storage):
+    """ Delete the files added to the yielded Claim and not kept once the block ends
+
+    Whether the block raises or rejects what it saved, the references it
+    did not hand over to a row are dropped again.
+    """
+    claimed = Claim()
+    try:
+        yield claimed
+    finally:
+        for name in claimed.names:
+            storage.delete(name)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """ Filesystem storage saving files under the sha256 of their content
+
+    The name passed to save() only provides the directory and extension.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # names only clash for identical content
+        return name
+
+    def hashed_name(self, name, digest):
+        """ Returns the content name of a file saved as name """
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(os.path.dirname(name), digest[:2], f'{digest}{extension}')
+
+    def file_digest(self, name):
+        """ Returns the sha256 hex digest of a stored file """
+        digest = hashlib.sha256()
+        with self.open(name) as stored:
+            for chunk in iter(lambda: stored.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+
+        written = super()._save(temp_name(), content)
+        return self.adopt(written, name, digest.hexdigest())
+
+    def adopt(self, written, name, digest=None):
+        """ Move a file written to the storage under its content name
+
+        written is the temporary name the file was written to outside of
+        save(), digest its sha256 when already known. Takes a reference to
+        the file like save() and returns its name.
+        """
+        if digest is None:
+            digest = self.file_digest(written)
+        name = self.hashed_name(name, digest)
+
+        acquire([name])
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # replacing an identical file is harmless and restores one that a
+        # collection removed right before the reference was taken
+        os.replace(self.path(written), path)
+        if self.file_permissions_mode is not None:
+            os.chmod(path, self.file_permissions_mode)
+
+        return name
+
+    def delete(self, name):
+        """ Drop a reference to name, files without a count are removed right away """
+        self.delete_many([name])
+
+    def delete_many(self, names):
+        """ Drop a reference to each of names """
+        counted, unreferenced = release(names)
+        for name in set(names) - counted:
+            if name:
+                super().delete(name)
+
+        if unreferenced:
+            transaction.on_commit(lambda: collect(self, unreferenced))
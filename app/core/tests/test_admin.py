@@ -5,6 +5,8 @@ from django.test import Client
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
+from core import models
+
 
 class AdminSiteTests(TestCase):
     """ Tests for Django Admin """
@@ -45,4 +47,14 @@ class AdminSiteTests(TestCase):
         url = reverse("admin:core_user_add")
         res = self.client.get(url)
 
-        self.assertEqual(res.status_code, 200)
\ No newline at end of file
+        self.assertEqual(res.status_code, 200)
+    def test_edit_recipe_page_image_read_only(self):
+        """ Test the recipe image can not be replaced from the admin """
+
+        recipe = models.Recipe.objects.create(
+            user=self.user, title='Sample recipe', time_minutes=5, price=5, calories_per_serving=100)
+        url = reverse("admin:core_recipe_change", args=[recipe.id])
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotContains(res, 'name="image"')
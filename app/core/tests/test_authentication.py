@@ -0,0 +1,138 @@
+"""
+Tests for the cached token authentication.
+"""
+
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, SimpleTestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import authentication
+from core.cache import LRUCache
+
+ME_URL = reverse('user:me')
+
+
+class LRUCacheTests(SimpleTestCase):
+    """ Tests for the in-process LRU cache """
+
+    def setUp(self):
+        self.now = 0
+        self.cache = LRUCache(max_size=2, ttl=10, timer=lambda: self.now)
+
+    def test_get_set(self):
+        """ test values are returned until they expire """
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+
+        self.now = 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_evicts_least_recently_used(self):
+        """ test the least recently used entry is evicted past max_size """
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('c'), 3)
+
+    def test_stats(self):
+        """ test hits and misses are counted """
+        self.cache.set('a', 1)
+        self.cache.get('a')
+        self.cache.get('b')
+
+        self.assertEqual(self.cache.stats(),
+                         {'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'size': 1})
+
+
+@patch.dict(authentication.TOKEN_AUTH_CACHE, {'SHARED_CACHE': 'default'})
+class CachedTokenAuthenticationTests(TestCase):
+    """ Tests for authenticating with cached tokens """
+
+    def setUp(self):
+        cache.clear()
+        authentication.shared_stats.update(hits=0, misses=0)
+        self.user = get_user_model().objects.create_user(
+            email='test@abc.com', password='testpass123')
+        self.token = Token.objects.create(user=self.user)
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_token_lookup_is_cached(self):
+        """ test only the first request looks the token up in the db """
+        with self.assertNumQueries(1):
+            res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['email'], self.user.email)
+
+        stats = authentication.cache_stats()['shared']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    @patch.dict(authentication.TOKEN_AUTH_CACHE, {'SHARED_CACHE': None})
+    def test_no_shared_cache(self):
+        """ test every lookup goes to the db without a shared cache """
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                res = self.client.get(ME_URL)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_invalid_token(self):
+        """ test unknown tokens are rejected """
+        self.client.credentials(HTTP_AUTHORIZATION='Token invalid')
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_token_is_invalidated(self):
+        """ test a deleted token stops authenticating right away """
+        self.client.get(ME_URL)
+        self.token.delete()
+
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_is_invalidated(self):
+        """ test deactivating a user invalidates their cached token """
+        self.client.get(ME_URL)
+        self.user.is_active = False
+        self.user.save()
+
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_updated_user_is_invalidated(self):
+        """ test updating the user is visible on the next request """
+        self.client.get(ME_URL)
+        self.client.patch(ME_URL, {'username': 'new name'})
+
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.data['username'], 'new name')
+
+    def test_update_does_not_save_cached_user(self):
+        """ test an update does not overwrite changes made since the user was cached """
+        self.client.get(ME_URL)
+        # changed by another worker after the user was cached
+        get_user_model().objects.filter(pk=self.user.pk).update(is_staff=True)
+
+        res = self.client.patch(ME_URL, {'username': 'new name'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_staff)
+        self.assertEqual(self.user.username, 'new name')
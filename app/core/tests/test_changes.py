@@ -0,0 +1,147 @@
+"""
+Tests for the change log of the recipe sync
+"""
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from core import changes
+from core.models import Change, ChangeCounter, Recipe, Tag
+
+
+def create_recipe(user, **params):
+    """ create a recipe for a user """
+    defaults = {'title': 'Sample recipe', 'time_minutes': 5, 'price': 5, 'calories_per_serving': 100}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class ChangeLogTests(TestCase):
+    """ Tests for core.changes """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@abc.com', password='testpass123')
+
+    def since(self, since=0, limit=100):
+        """ helper returning the entries after since """
+        return changes.changes_since(self.user.id, since, limit)
+
+    def test_records_saves_and_links(self):
+        """ test saved rows and added links are logged in order """
+        recipe = create_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe.tags.add(tag)
+
+        entries, token, more = self.since()
+
+        self.assertEqual(entries, [
+            (Change.RECIPE, recipe.id, 0, False),
+            (Change.TAG, tag.id, 0, False),
+            (Change.RECIPE_TAG, recipe.id, tag.id, False),
+        ])
+        self.assertEqual(token, '3')
+        self.assertFalse(more)
+
+    def test_log_is_compacted(self):
+        """ test a row changed twice has one entry with its latest number """
+        recipe = create_recipe(self.user)
+        other = create_recipe(self.user)
+        recipe.title = 'Changed'
+        recipe.save()
+
+        entries, token, _ = self.since()
+
+        self.assertEqual(entries, [(Change.RECIPE, other.id, 0, False), (Change.RECIPE, recipe.id, 0, False)])
+        self.assertEqual(token, '3')
+        self.assertEqual(Change.objects.filter(user=self.user).count(), 2)
+
+    def test_deleted_row_drops_its_links(self):
+        """ test a deleted tag leaves a tombstone and drops its link entries """
+        recipe = create_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe.tags.add(tag)
+        _, token, _ = self.since()
+
+        tag_id = tag.id
+        tag.delete()
+        entries, _, _ = self.since(int(token))
+
+        self.assertEqual(entries, [(Change.TAG, tag_id, 0, True)])
+        self.assertFalse(Change.objects.filter(kind=Change.RECIPE_TAG).exists())
+
+    def test_cleared_links(self):
+        """ test clearing the links, from either side, logs their removal """
+        recipe = create_recipe(self.user)
+        tags = [Tag.objects.create(user=self.user, name=name) for name in ('Vegan', 'Quick')]
+        recipe.tags.add(*tags)
+        _, token, _ = self.since()
+
+        recipe.tags.clear()
+        entries, token, _ = self.since(int(token))
+        self.assertCountEqual(entries, [(Change.RECIPE_TAG, recipe.id, tag.id, True) for tag in tags])
+
+        tags[0].recipe_set.add(recipe)
+        entries, _, _ = self.since(int(token))
+        self.assertEqual(entries, [(Change.RECIPE_TAG, recipe.id, tags[0].id, False)])
+
+    def test_batch(self):
+        """ test the entries of a batch are written once when it ends """
+        # savepoint, two inserts and one update each indexing the recipe, the
+        # log write and release savepoint
+        with self.assertNumQueries(9):
+            with changes.batch():
+                recipe = create_recipe(self.user)
+                with changes.batch():
+                    create_recipe(self.user)
+                recipe.title = 'Changed'
+                recipe.save()
+
+        self.assertEqual(ChangeCounter.objects.get(user=self.user).seq, 2)
+
+    def test_paging(self):
+        """ test a limit returns the first entries and tells more follow """
+        recipes = [create_recipe(self.user) for _ in range(3)]
+
+        entries, token, more = self.since(limit=2)
+        self.assertEqual([entry[1] for entry in entries], [recipe.id for recipe in recipes[:2]])
+        self.assertTrue(more)
+
+        entries, token, more = self.since(int(token), limit=2)
+        self.assertEqual([entry[1] for entry in entries], [recipes[2].id])
+        self.assertFalse(more)
+        self.assertEqual(self.since(int(token)), ([], token, False))
+
+    def test_invalid_token(self):
+        """ test tokens not returned to the user are rejected """
+        create_recipe(self.user)
+
+        with self.assertRaises(changes.InvalidToken):
+            self.since(2)
+        with self.assertRaises(changes.InvalidToken):
+            changes.parse_token('-1')
+
+    def test_prune(self):
+        """ test old tombstones are pruned and syncs from before them are refused """
+        recipe = create_recipe(self.user)
+        other = create_recipe(self.user)
+        recipe.delete()
+        Change.objects.filter(deleted=True).update(changed_at=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(changes.prune(timezone.now() - timedelta(days=1)), 1)
+
+        with self.assertRaises(changes.ChangesPruned):
+            self.since(1)
+        # a full sync does not need the tombstones
+        entries, _, _ = self.since()
+        self.assertEqual(entries, [(Change.RECIPE, other.id, 0, False)])
+
+    def test_user_delete(self):
+        """ test the log of a deleted user is removed """
+        create_recipe(self.user)
+
+        self.user.delete()
+
+        self.assertFalse(Change.objects.exists())
+        self.assertFalse(ChangeCounter.objects.exists())
@@ -1,11 +1,25 @@
 """
 Test the django management commands
 """
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
 from unittest.mock import patch
 from psycopg2 import OperationalError as PsycopgError
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
 from django.db.utils import OperationalError
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from core.models import Change, Recipe, StoredFile
+from core.storage import collect, temp_name
 
 
 @patch('core.management.commands.wait_for_db.Command.check')
@@ -30,3 +44,216 @@ class TestCommand(SimpleTestCase):
         call_command('wait_for_db')
         self.assertEqual(patched_check.call_count, 6)
         patched_check.assert_called_with(databases=['default'])
+
+
+class BenchmarkRecipeAPICommandTests(TestCase):
+    """ Tests for the benchmark_recipe_api command """
+
+    def _index_names(self):
+        with connection.cursor() as cursor:
+            return set(connection.introspection.get_constraints(cursor, 'core_recipe_tags')) \
+                | set(connection.introspection.get_constraints(cursor, 'core_recipe'))
+
+    def test_benchmark_recipe_api(self):
+        """ test data is seeded once and both runs report every endpoint """
+        out = StringIO()
+        for _ in range(2):
+            call_command('benchmark_recipe_api', users=2, recipes=3, requests=2,
+                         i_know_this_locks=True, stdout=out)
+
+        self.assertEqual(Recipe.objects.count(), 6)
+        self.assertEqual(Recipe.tags.through.objects.count(), 18)
+        output = out.getvalue()
+        self.assertEqual(output.count('Seeding'), 2)
+        self.assertEqual(output.count('== without composite indexes =='), 2)
+        self.assertEqual(output.count('recipes ?tags='), 4)
+
+    def test_baseline_keeps_indexes(self):
+        """ test the indexes dropped for the baseline run are restored """
+        before = self._index_names()
+        call_command('benchmark_recipe_api', users=1, recipes=1, requests=1,
+                     i_know_this_locks=True, stdout=StringIO())
+
+        self.assertEqual(self._index_names(), before)
+        self.assertIn('recipe_tags_tag_recipe_idx', before)
+
+    def test_baseline_drops_only_its_indexes(self):
+        """ test the baseline run keeps the indexes of the other endpoints """
+        from core.management.commands.benchmark_recipe_api import Command
+        during = {}
+
+        def report(command, title, *args):
+            during[title] = self._index_names()
+
+        with patch.object(Command, 'report', autospec=True, side_effect=report):
+            call_command('benchmark_recipe_api', users=1, recipes=1, requests=1,
+                         i_know_this_locks=True, stdout=StringIO())
+
+        baseline = during['without composite indexes']
+        self.assertNotIn('recipe_user_id_desc_idx', baseline)
+        self.assertNotIn('recipe_tags_tag_recipe_idx', baseline)
+        self.assertIn('recipe_search_idx', baseline)
+        self.assertIn('recipe_image_idx', baseline)
+        self.assertEqual(during['all indexes'], self._index_names())
+
+    def test_no_requests(self):
+        """ test a run without requests reports no timings instead of failing """
+        out = StringIO()
+        call_command('benchmark_recipe_api', users=1, recipes=1, requests=0, skip_baseline=True,
+                     stdout=out)
+
+        self.assertIn('nan', out.getvalue())
+
+    def test_baseline_refused_without_debug(self):
+        """ test the locking baseline run needs DEBUG or an explicit flag """
+        with self.assertRaises(CommandError):
+            call_command('benchmark_recipe_api', users=1, recipes=1, requests=1, stdout=StringIO())
+        self.assertFalse(Recipe.objects.exists())
+
+        call_command('benchmark_recipe_api', users=1, recipes=1, requests=1, skip_baseline=True,
+                     stdout=StringIO())
+        self.assertEqual(Recipe.objects.count(), 1)
+
+
+class BenchmarkRecipeFiltersCommandTests(TestCase):
+    """ Tests for the benchmark_recipe_filters command """
+
+    def test_benchmark_recipe_filters(self):
+        """ test a row is reported for each filter plan """
+        out = StringIO()
+        call_command('benchmark_recipe_filters', users=1, recipes=5, requests=2, stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('Seeding 5 recipes'))
+        self.assertEqual([line[:24].strip() for line in lines[2:]], [
+            'any: join + distinct', 'any: exists', 'all: join per tag', 'all: exists per tag'])
+
+
+class BenchmarkJSONCommandTests(TestCase):
+    """ Tests for the benchmark_json command """
+
+    def test_benchmark_json(self):
+        """ test a row is reported for each payload """
+        out = StringIO()
+        call_command('benchmark_json', recipes=3, repeat=2, stdout=out, stderr=StringIO())
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line[:16].strip() for line in lines[1:]], [
+            'list render', 'bulk parse', 'ndjson export', 'ndjson import'])
+
+
+class BenchmarkCompressionCommandTests(TestCase):
+    """ Tests for the benchmark_compression command """
+
+    def test_benchmark_compression(self):
+        """ test a row is reported for each payload and level """
+        out = StringIO()
+        call_command('benchmark_compression', recipes=3, repeat=1, stdout=out, stderr=StringIO())
+
+        rows = [line.split() for line in out.getvalue().splitlines()[1:]]
+        self.assertEqual(len(rows), 3 * 12)
+        self.assertEqual({row[2] for row in rows}, {'identity', 'gzip', 'br'})
+
+
+class CollectMediaCommandTests(TestCase):
+    """ Tests for the collect_media command """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@abc.com', password='testpass123')
+
+    def _save(self, content):
+        return default_storage.save('uploads/test/image.jpg', ContentFile(content))
+
+    def tearDown(self):
+        names = list(StoredFile.objects.values_list('name', flat=True))
+        StoredFile.objects.update(refcount=0)
+        collect(default_storage, names)
+
+    def test_collects_unreferenced_files(self):
+        """ test files no recipe references are removed and referenced ones kept """
+        kept = self._save(b'kept')
+        Recipe.objects.create(user=self.user, title='r', time_minutes=1, price=1,
+                              calories_per_serving=1, image=kept)
+        # saved but never referenced, like a save whose recipe update failed
+        leaked = self._save(b'leaked')
+        # left in the temporary directory by a killed upload
+        orphan = temp_name('uploads')
+        os.makedirs(os.path.dirname(default_storage.path(orphan)), exist_ok=True)
+        with open(default_storage.path(orphan), 'wb') as orphan_file:
+            orphan_file.write(b'orphan')
+
+        out = StringIO()
+        call_command('collect_media', grace=-1, stdout=out)
+
+        self.assertTrue(default_storage.exists(kept))
+        self.assertFalse(default_storage.exists(leaked))
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertEqual(StoredFile.objects.get(name=kept).refcount, 1)
+        self.assertIn('collected 1 unreferenced', out.getvalue())
+
+    def test_keeps_recent_files(self):
+        """ test files changed within the grace period are left alone """
+        leaked = self._save(b'leaked')
+
+        call_command('collect_media', stdout=StringIO())
+
+        self.assertTrue(default_storage.exists(leaked))
+
+
+class PruneChangeLogCommandTests(TestCase):
+    """ Tests for the prune_change_log command """
+
+    def test_prunes_old_tombstones(self):
+        """ test tombstones older than --days are deleted and recent ones kept """
+        user = get_user_model().objects.create_user(email='test@abc.com', password='testpass123')
+        for title in ('old', 'recent'):
+            Recipe.objects.create(user=user, title=title, time_minutes=1, price=1,
+                                  calories_per_serving=1).delete()
+        Change.objects.filter(seq=2).update(changed_at=timezone.now() - timedelta(days=91))
+
+        out = StringIO()
+        call_command('prune_change_log', stdout=out)
+
+        self.assertEqual(list(Change.objects.values_list('seq', flat=True)), [4])
+        self.assertIn('Pruned 1 tombstones', out.getvalue())
+
+
+class LoadTestRecipeAPICommandTests(TestCase):
+    """ Tests for the load_test_recipe_api command """
+
+    def tearDown(self):
+        names = list(StoredFile.objects.values_list('name', flat=True))
+        StoredFile.objects.update(refcount=0)
+        collect(default_storage, names)
+
+    def _load_test(self, **options):
+        out = StringIO()
+        call_command('load_test_recipe_api', users=2, recipes=3, images=1, requests=4,
+                     concurrency=1, format='json', stdout=out, stderr=StringIO(), **options)
+        return json.loads(out.getvalue())
+
+    def test_reports_every_endpoint(self):
+        """ test the json report has the statistics of every endpoint without errors """
+        report = self._load_test()
+
+        self.assertEqual(report['config']['users'], 2)
+        self.assertIn('recipes ?tags=', report['endpoints'])
+        self.assertIn('media', report['endpoints'])
+        for result in report['endpoints'].values():
+            self.assertEqual(result['requests'], 4)
+            self.assertEqual(result['errors'], 0)
+            self.assertGreater(result['queries_per_request'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+    def test_regression_fails(self):
+        """ test a slower or chattier run than the baseline raises an error """
+        report = self._load_test()
+        for result in report['endpoints'].values():
+            result['p95_ms'] = 0
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = os.path.join(directory, 'baseline.json')
+            with open(baseline, 'w') as baseline_file:
+                json.dump(report, baseline_file)
+
+            with self.assertRaisesRegex(CommandError, 'recipes: p95'):
+                self._load_test(baseline=baseline)
@@ -0,0 +1,118 @@
+"""
+Tests for the response compression middleware
+"""
+import gzip
+import zlib
+from unittest.mock import patch
+
+import brotli
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase
+
+from core import compression
+
+BODY = b'{"title": "Sample recipe"}' * 100
+
+
+class NegotiateTests(SimpleTestCase):
+    """ Tests for core.compression.negotiate """
+
+    def test_negotiate(self):
+        """ test the accepted encoding with the highest q value wins, brotli on ties """
+        cases = [
+            ('', None),
+            ('identity', None),
+            ('gzip', 'gzip'),
+            ('gzip, deflate, br', 'br'),
+            ('br;q=0.5, gzip', 'gzip'),
+            ('br;q=0, gzip;q=0', None),
+            ('*', 'br'),
+            ('*;q=0.1, gzip;q=0.5', 'gzip'),
+            ('GZIP ; q=0.8, invalid;;, br;q=x', 'gzip'),
+        ]
+        for header, encoding in cases:
+            self.assertEqual(compression.negotiate(header), encoding, header)
+
+    def test_without_brotli(self):
+        """ test brotli is not offered when it is not installed """
+        with patch('core.compression.brotli', None):
+            self.assertEqual(compression.negotiate('br, gzip;q=0.5'), 'gzip')
+            self.assertIsNone(compression.negotiate('br'))
+
+
+class CompressionMiddlewareTests(SimpleTestCase):
+    """ Tests for core.compression.CompressionMiddleware """
+
+    def get(self, response, accept_encoding='gzip, br'):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return compression.CompressionMiddleware(lambda request: response)(request)
+
+    def test_compresses_large_responses(self):
+        """ test responses above the threshold are compressed """
+        res = self.get(HttpResponse(BODY, content_type='application/json'))
+
+        self.assertEqual(res['Content-Encoding'], 'br')
+        self.assertEqual(res['Vary'], 'Accept-Encoding')
+        self.assertEqual(res['Content-Length'], str(len(res.content)))
+        self.assertEqual(brotli.decompress(res.content), BODY)
+
+        res = self.get(HttpResponse(BODY, content_type='application/json'), 'gzip')
+        self.assertEqual(gzip.decompress(res.content), BODY)
+
+    def test_weakens_etag(self):
+        """ test the ETag of a compressed response is weak """
+        response = HttpResponse(BODY, content_type='application/json')
+        response['ETag'] = '"abc"'
+
+        self.assertEqual(self.get(response)['ETag'], 'W/"abc"')
+
+    def test_skipped_responses(self):
+        """ test small, already encoded and incompressible responses are left alone """
+        small = HttpResponse(b'{}', content_type='application/json')
+        encoded = HttpResponse(BODY, content_type='application/json')
+        encoded['Content-Encoding'] = 'gzip'
+        image = HttpResponse(BODY, content_type='image/jpeg')
+
+        for response in (small, encoded, image):
+            res = self.get(response)
+            self.assertEqual(res.content, BODY if response is not small else b'{}')
+            self.assertFalse(res.has_header('Vary'))
+
+    def test_not_accepted(self):
+        """ test responses are not compressed for clients not accepting it """
+        res = self.get(HttpResponse(BODY, content_type='application/json'), 'identity')
+
+        self.assertEqual(res.content, BODY)
+        self.assertFalse(res.has_header('Content-Encoding'))
+        self.assertEqual(res['Vary'], 'Accept-Encoding')
+
+    def test_streaming(self):
+        """ test streamed responses are compressed chunk by chunk """
+        chunks = [b'{"id": %d}\n' % i for i in range(100)]
+        res = self.get(StreamingHttpResponse(iter(chunks), content_type='application/x-ndjson'), 'gzip')
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertFalse(res.has_header('Content-Length'))
+        stream = iter(res.streaming_content)
+        decompressor = zlib.decompressobj(31)
+        # each chunk is readable before the next one is produced
+        self.assertEqual(decompressor.decompress(next(stream)), chunks[0])
+        self.assertEqual(decompressor.decompress(b''.join(stream)), b''.join(chunks[1:]))
+        self.assertTrue(decompressor.eof)
+
+    def test_precompressed_and_store_compressed(self):
+        """ test precompressed bodies get the headers and compressed ones are stored """
+        response = HttpResponse(compression.compress(BODY, 'gzip'), content_type='application/json')
+        response.precompressed_encoding = 'gzip'
+        res = self.get(response)
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(res.content), BODY)
+
+        stored = []
+        response = HttpResponse(BODY, content_type='application/json')
+        response.store_compressed = stored.append
+        res = self.get(response)
+
+        self.assertEqual(stored, [res])
@@ -0,0 +1,84 @@
+"""
+Tests for the orjson renderer and parser
+"""
+import datetime
+import io
+import uuid
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.serializer_helpers import ReturnDict
+
+from core import fastjson
+
+DATA = ReturnDict({
+    'decimal': Decimal('300.20'),
+    'utc': datetime.datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+    'offset': datetime.datetime(2024, 5, 1, 12, 30, tzinfo=timezone.get_fixed_timezone(120)),
+    'naive': datetime.datetime(2024, 5, 1, 12, 30),
+    'date': datetime.date(2024, 5, 1),
+    'time': datetime.time(8, 15, 30),
+    'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+    'lazy': gettext_lazy('This field is required.'),
+    'text': 'Crème brûlée     "quoted" \\ \n',
+    'list': [1, 2.5, None, True, {'nested': []}],
+}, serializer=None)
+
+
+class ORJSONRendererTests(SimpleTestCase):
+    """ Tests for core.fastjson.ORJSONRenderer """
+
+    def assertSameAsDRF(self, data, accepted_media_type=None):
+        self.assertEqual(
+            fastjson.ORJSONRenderer().render(data, accepted_media_type),
+            JSONRenderer().render(data, accepted_media_type),
+        )
+
+    def test_same_bytes_as_drf(self):
+        """ test the rendering matches DRF's JSONRenderer byte for byte """
+        self.assertSameAsDRF(DATA)
+        self.assertSameAsDRF([DATA, DATA])
+        self.assertSameAsDRF(None)
+
+    def test_falls_back_for_rejected_data(self):
+        """ test data orjson rejects, like non string keys, is rendered by DRF """
+        self.assertSameAsDRF({1: 'one', 'big': 2 ** 70})
+
+    def test_falls_back_for_indent(self):
+        """ test indented output is rendered by DRF """
+        self.assertSameAsDRF(DATA, 'application/json; indent=4')
+
+    def test_falls_back_without_orjson(self):
+        """ test the renderer works when orjson is not installed """
+        with patch('core.fastjson.orjson', None):
+            self.assertSameAsDRF(DATA)
+
+
+class ORJSONParserTests(SimpleTestCase):
+    """ Tests for core.fastjson.ORJSONParser """
+
+    def parse(self, content, encoding='utf-8'):
+        return fastjson.ORJSONParser().parse(io.BytesIO(content), parser_context={'encoding': encoding})
+
+    def test_same_data_as_drf(self):
+        """ test parsing matches DRF's JSONParser """
+        content = '{"title": "Crème", "price": 5.5, "tags": [{"name": "a"}]}'.encode()
+
+        self.assertEqual(self.parse(content), JSONParser().parse(io.BytesIO(content)))
+
+    def test_other_encoding(self):
+        """ test bodies in another charset are decoded first """
+        self.assertEqual(self.parse('{"title": "Crème"}'.encode('latin-1'), 'latin-1'), {'title': 'Crème'})
+
+    def test_invalid_json(self):
+        """ test invalid bodies and NaN raise a parse error """
+        for content in (b'{"title": ', b'{"price": NaN}', b'\xff'):
+            with self.assertRaises(ParseError):
+                self.parse(content)
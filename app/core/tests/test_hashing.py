@@ -0,0 +1,134 @@
+"""
+Tests for password hashing on the thread pool.
+"""
+
+import threading
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+TOKEN_URL = reverse('user:token')
+
+
+class PooledHashingLoginTests(TestCase):
+    """ Tests for logins hashing passwords on the pool """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.password = 'testpass123'
+        self.user = get_user_model().objects.create_user(
+            email='test@abc.com', password=self.password)
+
+    def _login(self, password=None):
+        """ helper to request a token """
+        return self.client.post(TOKEN_URL, {
+            'email': self.user.email,
+            'password': password or self.password,
+        })
+
+    def test_login_uses_preferred_hasher(self):
+        """ test new users are hashed with argon2 and can log in """
+        self.assertTrue(self.user.password.startswith('argon2$'))
+
+        res = self._login()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('token', res.data)
+
+    def test_wrong_password(self):
+        """ test a wrong password is rejected """
+        res = self._login('wrongpass')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rehash_on_login(self):
+        """ test hashes of another hasher are upgraded on login """
+        self.user.password = make_password(self.password, hasher='pbkdf2_sha256')
+        self.user.save()
+
+        res = self._login()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('argon2$'))
+        self.assertTrue(self.user.check_password(self.password))
+
+    def test_rehash_when_cost_changes(self):
+        """ test hashes are upgraded when the hasher parameters change """
+        params = {'argon2': {'time_cost': 3, 'memory_cost': 1024, 'parallelism': 1}}
+        with override_settings(PASSWORD_HASHER_PARAMS=params):
+            res = self._login()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertIn('m=1024,t=3,p=1', self.user.password)
+
+    def test_busy_pool_skips_rehash(self):
+        """ test a correct password logs in when the pool has no room for the rehash """
+        from core import hashing
+        encoded = make_password(self.password, hasher='pbkdf2_sha256')
+        self.user.password = encoded
+        self.user.save()
+        run = hashing.run
+
+        def busy_rehash(func, *args):
+            if func is hashing.hashers.make_password:
+                raise hashing.HashingBusy(wait=1)
+            return run(func, *args)
+
+        with patch('core.hashing.run', side_effect=busy_rehash):
+            res = self._login()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.password, encoded)
+
+    @patch('core.hashing._slots', threading.BoundedSemaphore(1))
+    def test_busy_pool_sheds_logins(self):
+        """ test logins are rejected with a 429 when the pool is full """
+        from core import hashing
+        hashing._slots.acquire()
+
+        res = self._login()
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', res)
+
+    @patch.dict('core.hashing.PASSWORD_HASHING', {'TIMEOUT': 0.01})
+    def test_slow_pool_sheds_logins(self):
+        """ test logins waiting longer than the timeout are rejected with a 429 """
+        from core import hashing
+        release = threading.Event()
+        # keep every thread of the pool busy
+        blockers = [hashing._executor.submit(release.wait) for _ in range(hashing.PASSWORD_HASHING['WORKERS'])]
+
+        try:
+            res = self._login()
+        finally:
+            release.set()
+            for blocker in blockers:
+                blocker.result()
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', res)
+
+
+class BenchmarkHashersCommandTests(TestCase):
+    """ Tests for the benchmark_hashers command """
+
+    def test_benchmark_hashers(self):
+        """ test a row is reported for each requested hasher """
+        out = StringIO()
+        call_command('benchmark_hashers', seconds=0, hashers=['argon2', 'pbkdf2_sha256'], stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith('argon2 *'))
+        self.assertTrue(lines[2].startswith('pbkdf2_sha256'))
@@ -0,0 +1,90 @@
+"""
+Tests for the MessagePack renderer and parser
+"""
+import datetime
+import io
+from decimal import Decimal
+from types import SimpleNamespace
+
+import msgpack
+
+from django.test import SimpleTestCase
+from django.utils.translation import gettext_lazy
+
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.serializer_helpers import ReturnDict, ReturnList
+
+from core import messagepack
+
+VIEW = SimpleNamespace(fixed_point_fields={'price': 2})
+
+
+class MessagePackRendererTests(SimpleTestCase):
+    """ Tests for core.messagepack.MessagePackRenderer """
+
+    def render(self, data, view=VIEW):
+        return messagepack.MessagePackRenderer().render(data, renderer_context={'view': view})
+
+    def test_fixed_point_fields(self):
+        """ test the fixed point fields of the page results are integers """
+        data = {'next': None, 'results': ReturnList([
+            ReturnDict({'price': '5.50', 'tags': [{'name': 'a', 'price': '1.00'}]}, serializer=None),
+            {'price': '999.99'},
+            {'price': None},
+            {'price': ['A valid number is required.']},
+        ], serializer=None)}
+
+        self.assertEqual(msgpack.unpackb(self.render(data)), {'next': None, 'results': [
+            {'price': 550, 'tags': [{'name': 'a', 'price': '1.00'}]}, {'price': 99999}, {'price': None},
+            {'price': ['A valid number is required.']},
+        ]})
+
+    def test_fixed_point_fields_of_objects_and_lists(self):
+        """ test the fixed point fields of a single object or a list are integers """
+        self.assertEqual(msgpack.unpackb(self.render({'price': '0.00'})), {'price': 0})
+        self.assertEqual(msgpack.unpackb(self.render([{'price': '1.10'}])), [{'price': 110}])
+
+    def test_without_fixed_point_fields(self):
+        """ test the data is left alone for views without fixed point fields """
+        self.assertEqual(msgpack.unpackb(self.render({'price': '5.50'}, view=None)), {'price': '5.50'})
+
+    def test_json_types(self):
+        """ test values msgpack can not encode are converted as in JSON """
+        data = {
+            'utc': datetime.datetime(2024, 5, 1, 12, 30, tzinfo=datetime.timezone.utc),
+            'lazy': gettext_lazy('This field is required.'),
+            'decimal': Decimal('1.5'),
+        }
+
+        self.assertEqual(msgpack.unpackb(self.render(data, view=None)), {
+            'utc': '2024-05-01T12:30:00Z', 'lazy': 'This field is required.', 'decimal': 1.5,
+        })
+
+    def test_none(self):
+        """ test empty responses have no body """
+        self.assertEqual(self.render(None), b'')
+
+
+class MessagePackParserTests(SimpleTestCase):
+    """ Tests for core.messagepack.MessagePackParser """
+
+    def parse(self, content, view=VIEW):
+        return messagepack.MessagePackParser().parse(io.BytesIO(content), parser_context={'view': view})
+
+    def test_fixed_point_fields(self):
+        """ test integers of fixed point fields are turned into decimals """
+        data = self.parse(msgpack.packb({'price': 1999, 'title': 'Soup', 'tags': [{'name': 'a'}]}))
+
+        self.assertEqual(data, {'price': Decimal('19.99'), 'title': 'Soup', 'tags': [{'name': 'a'}]})
+        self.assertEqual(str(data['price']), '19.99')
+
+    def test_other_values_left_to_validation(self):
+        """ test non integer values of fixed point fields are passed through """
+        for price in ('5.50', 5.5, True, None):
+            self.assertEqual(self.parse(msgpack.packb({'price': price}))['price'], price)
+
+    def test_invalid_body(self):
+        """ test undecodable bodies raise a parse error """
+        for content in (b'\xc1', b'\x81', msgpack.packb({'a': 1}) + b'\x01', b''):
+            with self.assertRaises(ParseError):
+                self.parse(content)
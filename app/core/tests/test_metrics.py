@@ -0,0 +1,106 @@
+"""
+Tests for the request metrics
+"""
+import json
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core import metrics
+from core.models import Recipe
+
+METRICS_URL = reverse('metrics')
+RECIPES_URL = reverse('recipe:recipe-list')
+LIST_LABELS = '{action="list",view="recipe:recipe-list"}'
+
+
+class MetricsTests(TestCase):
+    """ Tests for core.metrics and the /metrics endpoint """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = patch.dict(metrics.METRICS, {
+            'DIRECTORY': directory.name, 'FLUSH_INTERVAL': 0, 'TOKEN': 'secret'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        metrics.registry.clear()
+        self.addCleanup(metrics.registry.clear)
+
+        self.user = get_user_model().objects.create_user(email='test@abc.com', password='testpass123')
+        Recipe.objects.create(user=self.user, title='Recipe', time_minutes=5, price=5,
+                              calories_per_serving=100)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _samples(self):
+        """ Return the metrics page as a dict of series -> value """
+        res = self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(res.status_code, 200)
+        return dict(
+            line.rsplit(' ', 1) for line in res.content.decode().splitlines()
+            if not line.startswith('#')
+        )
+
+    def test_request_recorded_per_view_and_action(self):
+        """ test a request adds one sample to every histogram of its view and action """
+        self.client.get(RECIPES_URL)
+
+        samples = self._samples()
+
+        self.assertEqual(samples[f'http_request_duration_seconds_count{LIST_LABELS}'], '1')
+        self.assertEqual(samples[f'http_request_db_queries_count{LIST_LABELS}'], '1')
+        self.assertGreater(float(samples[f'http_request_db_queries_sum{LIST_LABELS}']), 0)
+        self.assertGreater(float(samples[f'http_request_serialization_duration_seconds_sum{LIST_LABELS}']), 0)
+        self.assertGreater(float(samples[f'http_response_size_bytes_sum{LIST_LABELS}']), 0)
+        self.assertEqual(
+            samples['http_request_duration_seconds_bucket'
+                    '{action="list",view="recipe:recipe-list",le="+Inf"}'], '1')
+
+    def test_workers_summed(self):
+        """ test the histograms written by the other workers are added up """
+        self.client.get(RECIPES_URL)
+        metrics.registry.flush()
+        name = os.listdir(metrics.METRICS['DIRECTORY'])[0]
+        with open(os.path.join(metrics.METRICS['DIRECTORY'], name)) as stored:
+            histograms = json.load(stored)
+        with open(os.path.join(metrics.METRICS['DIRECTORY'], 'other-worker.json'), 'w') as other:
+            json.dump(histograms, other)
+
+        samples = self._samples()
+
+        self.assertEqual(samples[f'http_request_duration_seconds_count{LIST_LABELS}'], '2')
+
+    def test_no_server_timing_by_default(self):
+        """ test the timings are not sent to clients without the debug flag """
+        res = self.client.get(RECIPES_URL)
+
+        self.assertNotIn('Server-Timing', res)
+
+    @patch.dict(metrics.METRICS, {'SERVER_TIMING': True})
+    def test_server_timing(self):
+        """ test the timings of the request are sent back with the debug flag """
+        res = self.client.get(RECIPES_URL)
+
+        self.assertRegex(res['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", serialization;dur=')
+
+    def test_token_required(self):
+        """ test the scraper must send the configured token """
+        res = self.client.get(METRICS_URL)
+        self.assertEqual(res.status_code, 401)
+
+        res = self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(res.status_code, 200)
+
+    @patch.dict(metrics.METRICS, {'TOKEN': ''})
+    def test_not_served_without_token(self):
+        """ test /metrics is not served at all when no token is configured """
+        res = self.client.get(METRICS_URL)
+
+        self.assertEqual(res.status_code, 404)
@@ -3,6 +3,7 @@ Tests for models.
 """
 
 from decimal import Decimal
+from django.db import IntegrityError
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from unittest.mock import patch
@@ -79,6 +80,41 @@ class ModelTests(TestCase):
 
         self.assertEqual(str(ingredient), ingredient.name)
 
+    def test_tag_name_unique_per_user(self):
+        """ test a user cannot have two tags with the same name """
+        user = get_user_model().objects.create(email='testuser@example.com',password='testpass123')
+        models.Tag.objects.create(user=user, name='Dinner')
+
+        with self.assertRaises(IntegrityError):
+            models.Tag.objects.create(user=user, name='Dinner')
+
+    def test_get_or_create_by_names(self):
+        """ test bulk get or create of ingredients by name """
+        user = get_user_model().objects.create(email='testuser@example.com',password='testpass123')
+        other_user = get_user_model().objects.create(email='other@example.com',password='testpass123')
+        existing = models.Ingredient.objects.create(user=user, name='Salt')
+        models.Ingredient.objects.create(user=other_user, name='Pepper')
+
+        # select existing, insert missing, select inserted, record them
+        with self.assertNumQueries(4):
+            ings = models.Ingredient.objects.get_or_create_by_names(
+                user, ['Salt', 'Pepper', 'Oil', 'Salt'])
+
+        self.assertEqual([ing.name for ing in ings], ['Salt', 'Pepper', 'Oil'])
+        self.assertEqual(ings[0], existing)
+        self.assertTrue(all(ing.user == user for ing in ings))
+        self.assertEqual(models.Ingredient.objects.filter(user=user).count(), 3)
+
+    def test_get_or_create_by_names_all_existing(self):
+        """ test no insert is issued when all the names exist """
+        user = get_user_model().objects.create(email='testuser@example.com',password='testpass123')
+        models.Tag.objects.create(user=user, name='Lunch')
+
+        with self.assertNumQueries(1):
+            tags = models.Tag.objects.get_or_create_by_names(user, ['Lunch'])
+
+        self.assertEqual(tags[0].name, 'Lunch')
+
     @patch('core.models.uuid.uuid4')
     def test_recipe_file_name_uuid(self, mock_uuid):
         """ test to create unique recipe image filename """
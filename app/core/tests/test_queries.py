@@ -0,0 +1,85 @@
+"""
+Tests for the repeated and slow query detection
+"""
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from core import queries
+from core.models import Recipe, Tag
+
+
+class FingerprintTests(TestCase):
+    """ Tests for core.queries.fingerprint """
+
+    def test_literals_and_list_lengths_removed(self):
+        """ test queries differing only by values share a shape """
+        self.assertEqual(
+            queries.fingerprint('SELECT "id" FROM "t" WHERE "a" IN (%s, %s, %s) AND "b" = \'x\'  LIMIT 21'),
+            'SELECT "id" FROM "t" WHERE "a" IN (...) AND "b" = ? LIMIT ?',
+        )
+        self.assertEqual(
+            queries.fingerprint('INSERT INTO "t" ("a", "b") VALUES (%s, %s), (%s, %s)'),
+            queries.fingerprint('INSERT INTO "t" ("a", "b") VALUES (%s, %s)') + ', ...',
+        )
+
+
+class InspectQueriesTests(TestCase):
+    """ Tests for core.queries.inspect_queries """
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(email='test@abc.com', password='testpass123')
+        for i in range(3):
+            recipe = Recipe.objects.create(user=user, title=f'r{i}', time_minutes=1, price=1,
+                                           calories_per_serving=1)
+            recipe.tags.add(Tag.objects.create(user=user, name=f't{i}'))
+
+    def test_strict_mode_raises_on_query_per_row(self):
+        """ test a query per row of a list is reported in strict mode """
+        with self.assertRaisesRegex(queries.RepeatedQueriesError, r'3 x SELECT .*"core_tag"'):
+            with queries.inspect_queries('test', strict=True):
+                for recipe in Recipe.objects.all():
+                    list(recipe.tags.all())
+
+    def test_prefetched_list_passes(self):
+        """ test a prefetched list is not reported """
+        with queries.inspect_queries('test', strict=True) as inspector:
+            for recipe in Recipe.objects.prefetch_related('tags'):
+                list(recipe.tags.all())
+
+        self.assertEqual(sum(inspector.queries.values()), 2)
+
+    def test_repeated_queries_logged(self):
+        """ test repeated shapes are logged outside strict mode """
+        with self.assertLogs('core.queries', 'WARNING') as logs:
+            with patch.dict(queries.QUERY_INSPECTION, {'REPEAT_THRESHOLD': 3}), queries.inspect_queries('test'):
+                for recipe in Recipe.objects.all():
+                    list(recipe.tags.all())
+
+        self.assertIn('Repeated query (3 times) in test', logs.output[0])
+
+    @patch.dict(queries.QUERY_INSPECTION, {'ALLOWED': [r'FROM "core_tag"']})
+    def test_allowed_shapes(self):
+        """ test the shapes matched by ALLOWED are not reported """
+        with queries.inspect_queries('test', strict=True):
+            for recipe in Recipe.objects.all():
+                list(recipe.tags.all())
+
+    @patch.dict(queries.QUERY_INSPECTION, {'SLOW_QUERY_MS': 0})
+    def test_slow_query_logged_with_plan(self):
+        """ test slow queries are logged with their EXPLAIN plan """
+        with self.assertLogs('core.queries', 'WARNING') as logs:
+            with queries.inspect_queries('test', count=False):
+                Recipe.objects.filter(title='r1').count()
+
+        self.assertIn('Slow query', logs.output[0])
+        self.assertIn('Scan', logs.output[0])
+
+    @patch.dict(queries.QUERY_INSPECTION, {'SAMPLE_RATE': 0})
+    def test_unsampled_request_not_counted(self):
+        """ test requests outside the sample only time their queries """
+        with patch('core.queries.inspect_queries', wraps=queries.inspect_queries) as inspect:
+            self.client.get('/api/recipe/recipes/')
+
+        self.assertFalse(inspect.call_args.args[1])
@@ -0,0 +1,126 @@
+"""
+Tests for the content addressed media storage
+"""
+import hashlib
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase
+
+from core.models import StoredFile
+from core.storage import claim, collect, temp_name
+
+
+class ContentAddressedStorageTests(TestCase):
+    """ Tests for core.storage.ContentAddressedStorage """
+
+    def setUp(self):
+        self.content = os.urandom(1000)
+        self.digest = hashlib.sha256(self.content).hexdigest()
+
+    def tearDown(self):
+        names = list(StoredFile.objects.values_list('name', flat=True))
+        StoredFile.objects.update(refcount=0)
+        collect(default_storage, names)
+
+    def test_save_names_files_by_content(self):
+        """ test saved files are named after the sha256 of their content """
+        name = default_storage.save('uploads/test/photo.JPG', ContentFile(self.content))
+
+        self.assertEqual(name, f'uploads/test/{self.digest[:2]}/{self.digest}.jpg')
+        with default_storage.open(name) as stored:
+            self.assertEqual(stored.read(), self.content)
+
+    def test_identical_content_is_stored_once(self):
+        """ test saving the same content twice shares the file and counts two references """
+        first = default_storage.save('uploads/test/a.jpg', ContentFile(self.content))
+        second = default_storage.save('uploads/test/b.jpg', ContentFile(self.content))
+
+        self.assertEqual(first, second)
+        self.assertEqual(StoredFile.objects.get(name=first).refcount, 2)
+        self.assertEqual(default_storage.listdir(os.path.dirname(first))[1], [os.path.basename(first)])
+        self.assertEqual(default_storage.listdir('tmp')[1], [])
+
+    def test_file_removed_with_last_reference(self):
+        """ test delete() only removes the file once nothing references it """
+        name = default_storage.save('uploads/test/a.jpg', ContentFile(self.content))
+        default_storage.save('uploads/test/b.jpg', ContentFile(self.content))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            default_storage.delete(name)
+        self.assertTrue(default_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            default_storage.delete(name)
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+
+    def test_removal_waits_for_commit(self):
+        """ test a rolled back delete keeps the file """
+        name = default_storage.save('uploads/test/a.jpg', ContentFile(self.content))
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            default_storage.delete(name)
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertTrue(default_storage.exists(name))
+
+    def _write(self, name, content):
+        """ write a file to the storage directory without save() """
+        path = default_storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as written:
+            written.write(content)
+
+    def test_adopt_moves_written_file(self):
+        """ test a file written outside save() is moved under its content name """
+        written = temp_name('test')
+        self._write(written, self.content)
+
+        name = default_storage.adopt(written, 'uploads/test/photo.png')
+
+        self.assertEqual(name, f'uploads/test/{self.digest[:2]}/{self.digest}.png')
+        self.assertFalse(default_storage.exists(written))
+        self.assertEqual(StoredFile.objects.get(name=name).refcount, 1)
+
+    def test_delete_uncounted_file(self):
+        """ test files without a reference count are removed right away """
+        name = temp_name('test')
+        self._write(name, b'partial')
+
+        default_storage.delete(name)
+
+        self.assertFalse(default_storage.exists(name))
+
+
+class ClaimTests(TestCase):
+    """ Tests for core.storage.claim """
+
+    def tearDown(self):
+        names = list(StoredFile.objects.values_list('name', flat=True))
+        StoredFile.objects.update(refcount=0)
+        collect(default_storage, names)
+
+    def _save(self, content):
+        return default_storage.save('uploads/test/image.jpg', ContentFile(content))
+
+    def test_kept_references_survive(self):
+        """ test only the references not kept are dropped when the block ends """
+        with self.captureOnCommitCallbacks(execute=True):
+            with claim(default_storage) as claimed:
+                kept = claimed.add(self._save(b'kept'))
+                dropped = claimed.add(self._save(b'dropped'))
+                claimed.keep(kept)
+
+        self.assertEqual(StoredFile.objects.get(name=kept).refcount, 1)
+        self.assertFalse(default_storage.exists(dropped))
+
+    def test_references_dropped_on_error(self):
+        """ test a block raising drops the references it added """
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(ValueError):
+            with claim(default_storage) as claimed:
+                name = claimed.add(self._save(b'content'))
+                raise ValueError()
+
+        self.assertFalse(default_storage.exists(name))
@@ -1,3 +1,20 @@
-from django.shortcuts import render  # noqa
+""" Views of the core app """
 
-# Create your views here.
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET
+
+from core import metrics as core_metrics
+
+
+@require_GET
+def metrics(request):
+    """ Prometheus text exposition of the request metrics of all the workers """
+    token = core_metrics.METRICS['TOKEN']
+    # never served unauthenticated, set METRICS_TOKEN to scrape it
+    if not token:
+        raise Http404()
+    if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401, headers={'WWW-Authenticate': 'Bearer'})
+
+    return HttpResponse(core_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,98 @@
+""" Autocomplete of tag and ingredient names
+
+Matches are names containing the typed text, served by the pg_trgm GIN
+index, prefix matches first and then the most similar names. When they
+do not fill the limit, trigram similar names are added so typos still
+match. Texts shorter than a trigram only match name prefixes.
+
+The pickers repeat the same few prefixes while the user types, so the
+top-K results are kept in an in-process LRU keyed by the number of the
+user's latest change in the change log of core.changes. It is read from
+the database on every request, so a tag/ingredient write handled by any
+worker makes the cached results unreachable in all of them.
+"""
+
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db.models import BooleanField, Case, Value, When
+
+from rest_framework import exceptions
+from rest_framework.response import Response
+
+from core import changes
+from core.cache import LRUCache
+
+AUTOCOMPLETE = {
+    'LIMIT': 10,
+    'MAX_LIMIT': 50,
+    'CACHE_SIZE': 10000,
+    'CACHE_TTL': 300,
+}
+AUTOCOMPLETE.update(getattr(settings, 'AUTOCOMPLETE', {}))
+
+MIN_FUZZY_LENGTH = 3
+
+prefix_cache = LRUCache(max_size=AUTOCOMPLETE['CACHE_SIZE'], ttl=AUTOCOMPLETE['CACHE_TTL'])
+
+
+def complete(queryset, text, limit):
+    """ Return the top limit names of queryset matching text """
+    # ~* is used over ILIKE since Django compiles icontains to UPPER() LIKE,
+    # which the trigram index of the bare column cannot serve.
+    pattern = re.escape(text)
+    if len(text) < MIN_FUZZY_LENGTH:
+        # too short for trigrams, only prefixes are worth suggesting
+        return list(queryset.filter(name__iregex=f'^{pattern}').order_by('name')[:limit])
+
+    matches = list(
+        queryset
+        .filter(name__iregex=pattern)
+        .annotate(
+            is_prefix=Case(When(name__iregex=f'^{pattern}', then=Value(True)),
+                           default=Value(False), output_field=BooleanField()),
+            similarity=TrigramSimilarity('name', text),
+        )
+        .order_by('-is_prefix', '-similarity', 'name')[:limit]
+    )
+    if len(matches) < limit:
+        # the similarity operator is costly, only fall back to it for typos
+        matches += list(
+            queryset
+            .filter(name__trigram_similar=text)
+            .exclude(name__iregex=pattern)
+            .annotate(similarity=TrigramSimilarity('name', text))
+            .order_by('-similarity', 'name')[:limit - len(matches)]
+        )
+
+    return matches
+
+
+class AutocompleteMixin:
+    """ Viewset mixin answering list requests with ?search= with the top matches """
+
+    def list(self, request, *args, **kwargs):
+        text = request.query_params.get('search', '').strip().lower()
+        if not text:
+            return super().list(request, *args, **kwargs)
+
+        limit = self._get_limit(request)
+        key = (self.queryset.model.__name__, request.user.id, changes.last_number(request.user.id),
+               text, limit)
+        data = prefix_cache.get(key)
+        if data is None:
+            names = complete(self.get_queryset(), text, limit)
+            data = list(self.get_serializer(names, many=True).data)
+            prefix_cache.set(key, data)
+
+        return Response(data)
+
+    def _get_limit(self, request):
+        """ Returns the requested number of matches, capped at MAX_LIMIT """
+        try:
+            limit = int(request.query_params.get('limit', AUTOCOMPLETE['LIMIT']))
+        except ValueError:
+            raise exceptions.ValidationError({'limit': 'Must be an integer.'})
+
+        return max(1, min(limit, AUTOCOMPLETE['MAX_LIMIT']))
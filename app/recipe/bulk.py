@@ -0,0 +1,257 @@
+""" Streaming bulk import and export of recipes """
+
+import codecs
+import csv
+import json
+import logging
+from itertools import islice
+
+from django.db import DatabaseError
+from django.db.models import prefetch_related_objects
+
+from rest_framework.exceptions import ParseError
+
+from core import changes, fastjson
+from core.models import Recipe, Tag, Ingredient
+from core.signals import recipes_bulk_created
+
+IMPORT_CHUNK_SIZE = 500
+EXPORT_CHUNK_SIZE = 2000
+READ_SIZE = 64 * 1024
+# a record is buffered until it is complete, so this bounds the memory of
+# an import whatever the size of the body
+MAX_RECORD_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+# flat columns only, nested values like the renditions do not fit a cell
+CSV_FIELDS = ['id', 'title', 'time_minutes', 'price', 'calories_per_serving', 'link',
+              'tags', 'ingredients', 'image', 'description']
+
+NDJSON_MEDIA_TYPES = ('application/x-ndjson', 'application/jsonl')
+JSON_MEDIA_TYPES = ('application/json',)
+
+
+def _record_too_large(max_size):
+    return ParseError(f'Invalid JSON: a record is larger than {max_size} bytes')
+
+
+def iter_ndjson(stream, max_size=None):
+    """ Yield (record, error) for every non blank line of a NDJSON stream
+
+    Raises ParseError on a line longer than max_size.
+    """
+    max_size = max_size or MAX_RECORD_SIZE
+    while True:
+        line = stream.readline(max_size + 1)
+        if not line:
+            return
+        if len(line) > max_size and not line.endswith(b'\n'):
+            raise _record_too_large(max_size)
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield fastjson.loads(line), None
+        except ValueError as exc:
+            yield None, f'Invalid JSON: {exc}'
+
+
+def iter_json_array(stream, read_size=READ_SIZE, max_size=None):
+    """ Yield (record, error) for the items of a JSON array without reading it all
+
+    Raises ParseError when an item is still incomplete after max_size
+    characters, an invalid item is only detected once that much is read.
+    """
+    max_size = max_size or MAX_RECORD_SIZE
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer, pos, expect, eof = '', 0, '[', False
+
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+        ch = buffer[pos] if pos < len(buffer) else ''
+
+        if ch and expect == '[':
+            if ch != '[':
+                yield None, 'Expected a JSON array'
+                return
+            pos, expect = pos + 1, 'item'
+            continue
+        if ch == ']' and expect in ('item', 'separator'):
+            return
+        if ch and expect == 'separator':
+            if ch != ',':
+                yield None, "Invalid JSON: expected ',' or ']'"
+                return
+            pos, expect = pos + 1, 'item'
+            continue
+        if ch:
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except ValueError as exc:
+                if eof:
+                    yield None, f'Invalid JSON: {exc}'
+                    return
+            else:
+                # a value ending exactly at the buffer end may be truncated
+                if end < len(buffer) or eof:
+                    yield record, None
+                    pos, expect = end, 'separator'
+                    continue
+
+        if eof:
+            yield None, 'Invalid JSON: unexpected end of array'
+            return
+        if len(buffer) - pos > max_size:
+            raise _record_too_large(max_size)
+        chunk = stream.read(read_size)
+        eof = not chunk
+        buffer = buffer[pos:] + text_decoder.decode(chunk, final=eof)
+        pos = 0
+
+
+def _until_parse_error(records):
+    """ End the records with an error row instead of the ParseError """
+    try:
+        yield from records
+    except ParseError as exc:
+        yield None, str(exc.detail)
+
+
+def iter_records(stream, media_type):
+    """ Return the (record, error) iterator matching the request media type """
+    if stream is None:
+        return iter(())
+    if media_type in NDJSON_MEDIA_TYPES:
+        return _until_parse_error(iter_ndjson(stream))
+
+    return _until_parse_error(iter_json_array(stream))
+
+
+def _create_chunk(valid, user):
+    """ Insert the validated recipes of a chunk with bulk operations """
+    recipes = Recipe.objects.bulk_create([
+        Recipe(user=user, **{k: v for k, v in data.items() if k not in ('tags', 'ingredients')})
+        for index, data in valid
+    ])
+
+    for field, model in (('tags', Tag), ('ingredients', Ingredient)):
+        names = [item['name'] for index, data in valid for item in data.get(field, [])]
+        by_name = {obj.name: obj for obj in model.objects.get_or_create_by_names(user, names)}
+
+        through = getattr(Recipe, field).through
+        fk = f'{model._meta.model_name}_id'
+        links = {
+            (recipe.id, by_name[item['name']].id)
+            for recipe, (index, data) in zip(recipes, valid)
+            for item in data.get(field, [])
+        }
+        through.objects.bulk_create(
+            [through(recipe_id=recipe_id, **{fk: obj_id}) for recipe_id, obj_id in links]
+        )
+
+    recipes_bulk_created.send(sender=Recipe, user=user, recipes=recipes)
+    return recipes
+
+
+def _import_chunk(chunk, serializer_class, context, user):
+    """ Validate and insert one chunk of records, returning the row results """
+    results = {}
+    valid = []
+    for index, (record, error) in chunk:
+        if error is None and not isinstance(record, dict):
+            error = 'Expected a JSON object'
+        if error is not None:
+            results[index] = {'index': index, 'status': 'invalid', 'errors': [error]}
+            continue
+
+        serializer = serializer_class(data=record, context=context)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            results[index] = {'index': index, 'status': 'invalid', 'errors': serializer.errors}
+
+    if valid:
+        try:
+            # one transaction and one change log write per chunk
+            with changes.batch():
+                recipes = _create_chunk(valid, user)
+        except DatabaseError:
+            # the details name tables and constraints, they are only logged
+            logger.exception('Bulk import of %d recipes of user %s failed', len(valid), user.id)
+            for index, data in valid:
+                results[index] = {'index': index, 'status': 'failed',
+                                  'errors': ['The recipe could not be saved.']}
+        else:
+            for recipe, (index, data) in zip(recipes, valid):
+                results[index] = {'index': index, 'status': 'created', 'id': recipe.id}
+
+    return [results[index] for index, item in chunk]
+
+
+def import_recipes(records, serializer_class, context, user, chunk_size=None):
+    """ Import (record, error) pairs chunk by chunk, yielding a result per row """
+    chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+    rows = enumerate(records)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield from _import_chunk(chunk, serializer_class, context, user)
+
+
+def iter_ndjson_results(results):
+    """ Encode the import results as NDJSON followed by a summary line """
+    counts = {'created': 0, 'invalid': 0, 'failed': 0}
+    for result in results:
+        counts[result['status']] += 1
+        yield fastjson.dumps(result) + b'\n'
+
+    yield fastjson.dumps({'status': 'done', **counts}) + b'\n'
+
+
+class _Echo:
+    """ File like object handing back what is written, for streaming csv """
+
+    def write(self, value):
+        return value
+
+
+def iter_recipe_chunks(queryset, chunk_size=None):
+    """ Yield lists of recipes with their tags and ingredients prefetched
+
+    The rows are read through a server side cursor, iterator() skips
+    prefetch_related so each chunk is prefetched on its own.
+    """
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    rows = queryset.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        prefetch_related_objects(chunk, 'tags', 'ingredients')
+        yield chunk
+
+
+def iter_ndjson_export(chunks, serializer_class, context):
+    """ Encode chunks of recipes as NDJSON, one recipe per line """
+    for chunk in chunks:
+        data = serializer_class(chunk, many=True, context=context).data
+        yield b''.join(fastjson.dumps(item) + b'\n' for item in data)
+
+
+def iter_csv_export(chunks, serializer_class, context):
+    """ Encode chunks of recipes as CSV with tag and ingredient names joined by '|' """
+    fields = CSV_FIELDS
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+
+    for chunk in chunks:
+        rows = []
+        for item in serializer_class(chunk, many=True, context=context).data:
+            item['tags'] = '|'.join(tag['name'] for tag in item['tags'])
+            item['ingredients'] = '|'.join(ing['name'] for ing in item['ingredients'])
+            rows.append(writer.writerow([item[field] for field in fields]))
+        yield ''.join(rows)
@@ -0,0 +1,163 @@
+""" Per user versioned caching of recipe api responses
+
+Every user has a version counter in the cache which is bumped by the
+signals below whenever one of their recipes, tags, ingredients or recipe
+links changes. Cached payloads are keyed by that version, so a write makes
+all the cached responses of exactly that user unreachable at once.
+
+The counter only invalidates the payloads of the workers sharing it, so
+by default the payloads are only cached when the cache backend is shared,
+not in a per process local memory or dummy cache. The keys also hold the
+ETag of recipe.conditional when the view sets one, which is computed from
+the database on every request, so a cached payload is never served under
+an ETag it was not built for.
+
+Next to the payload, the body core.compression.CompressionMiddleware
+compressed is cached per encoding, and served as is by the repeat hits
+accepting the same encoding, which neither render nor compress it again.
+Its key extends the payload's, so it is shared and validated the same way.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from core.models import Recipe, Tag, Ingredient
+from core.signals import recipes_bulk_created
+
+RECIPE_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 60 * 60,
+    # None caches the payloads only when the cache backend is shared
+    'ENABLED': None,
+}
+RECIPE_CACHE.update(getattr(settings, 'RECIPE_CACHE', {}))
+
+
+def _cache():
+    return caches[RECIPE_CACHE['ALIAS']]
+
+
+def is_enabled():
+    """ Return whether the payloads are cached, see the module docstring """
+    if RECIPE_CACHE['ENABLED'] is not None:
+        return RECIPE_CACHE['ENABLED']
+
+    return not isinstance(_cache(), (LocMemCache, DummyCache))
+
+
+def _version_key(user_id):
+    return f'recipe-cache:version:{user_id}'
+
+
+def get_version(user_id):
+    """ Return the current cache version of a user """
+    version = _cache().get(_version_key(user_id))
+    if version is None:
+        # never restart from a number whose entries may still be cached
+        _cache().add(_version_key(user_id), time.time_ns(), None)
+        version = _cache().get(_version_key(user_id))
+
+    return version
+
+
+def bump_version(user_id):
+    """ Invalidate all the cached responses of a user """
+    try:
+        _cache().incr(_version_key(user_id))
+    except ValueError:
+        _cache().add(_version_key(user_id), time.time_ns(), None)
+
+
+def _bump_now_and_on_commit(user_id):
+    """ Bump right away and again once the write is visible to readers
+
+    The second bump drops anything cached from a read that raced with the
+    still uncommitted write.
+    """
+    bump_version(user_id)
+    transaction.on_commit(lambda: bump_version(user_id))
+
+
+class VersionedCacheMixin:
+    """ Viewset mixin caching the list and retrieve payloads per user version """
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_response(super().retrieve, request, *args, **kwargs)
+
+    def _cached_response(self, view, request, *args, **kwargs):
+        if not is_enabled():
+            return view(request, *args, **kwargs)
+
+        version = get_version(request.user.id)
+        digest = hashlib.sha256('|'.join([
+            str(request.user.id),
+            str(version),
+            getattr(self, 'response_etag', ''),
+            request.get_full_path(),
+            request.accepted_media_type,
+        ]).encode()).hexdigest()
+
+        key = f'recipe-cache:response:{digest}'
+        # compressed bodies are keyed on the same version and ETag
+        # the browsable api pages hold a per request csrf token
+        encoding = getattr(request, 'response_encoding', None)
+        if getattr(request.accepted_renderer, 'format', None) == 'api':
+            encoding = None
+        compressed_key = f'{key}:{encoding}'
+
+        cached = _cache().get_many([key, compressed_key] if encoding else [key])
+        if compressed_key in cached:
+            content_type, content = cached[compressed_key]
+            response = HttpResponse(content, content_type=content_type)
+            response.precompressed_encoding = encoding
+            return response
+        if key in cached:
+            response = Response(cached[key])
+        else:
+            response = view(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            _cache().set(key, response.data, RECIPE_CACHE['TIMEOUT'])
+
+        if encoding:
+            response.store_compressed = lambda compressed: _cache().set(
+                compressed_key, (compressed['Content-Type'], compressed.content),
+                RECIPE_CACHE['TIMEOUT'])
+        return response
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def _invalidate_user_cache(sender, instance, **kwargs):
+    _bump_now_and_on_commit(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def _invalidate_user_cache_on_links(sender, instance, action, **kwargs):
+    if action.startswith('post_'):
+        _bump_now_and_on_commit(instance.user_id)
+
+
+@receiver(recipes_bulk_created)
+def _invalidate_user_cache_on_bulk_create(sender, user, **kwargs):
+    _bump_now_and_on_commit(user.id)
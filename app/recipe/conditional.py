@@ -0,0 +1,81 @@
+""" Conditional GET (ETag / Last-Modified) support for the recipe apis """
+
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.http import http_date, parse_http_date_safe
+
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class ConditionalGetMixin:
+    """ Base mixin answering unchanged GET requests with a 304
+
+    The validators come from one aggregate query, max(updated_at) and count
+    of the rows the response is built from, so a 304 never touches the
+    serializer. Lists only get an ETag since deleting a row can leave the
+    max(updated_at) of the remaining ones unchanged.
+
+    The ETag is kept in self.response_etag while the wrapped view runs, so
+    a payload cache can key its entries on it and never serve a body older
+    than the ETag it goes out with.
+    """
+
+    def conditional_response(self, queryset, detail, view, request, *args, **kwargs):
+        """ Return a 304 if the client's copy is current, else call view """
+        state = queryset.order_by().aggregate(last_modified=Max('updated_at'), count=Count('pk'))
+        if detail and not state['count']:
+            return view(request, *args, **kwargs)
+
+        digest = hashlib.sha256('|'.join([
+            str(request.user.id),
+            str(state['last_modified']),
+            str(state['count']),
+            request.get_full_path(),
+            request.accepted_media_type,
+        ]).encode()).hexdigest()
+        last_modified = state['last_modified'] if detail else None
+
+        headers = {'ETag': f'"{digest[:32]}"', 'Cache-Control': 'private, no-cache'}
+        if last_modified is not None:
+            headers['Last-Modified'] = http_date(last_modified.timestamp())
+
+        if self._is_not_modified(request, headers['ETag'], last_modified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        self.response_etag = headers['ETag']
+        response = view(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            for header, value in headers.items():
+                response[header] = value
+
+        return response
+
+    def _is_not_modified(self, request, etag, last_modified):
+        """ Evaluate If-None-Match, or If-Modified-Since when it is absent """
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+        since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        return bool(last_modified and since and int(last_modified.timestamp()) <= since)
+
+
+class ConditionalListMixin(ConditionalGetMixin):
+    """ Conditional GET for the list action """
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.conditional_response(queryset, False, super().list, request, *args, **kwargs)
+
+
+class ConditionalRetrieveMixin(ConditionalGetMixin):
+    """ Conditional GET for the retrieve action """
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return self.conditional_response(queryset, True, super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,33 @@
+""" Semi-join filtering of recipes by their tags and ingredients
+
+Joining the through tables duplicates a recipe for every matching link,
+which then has to be removed with DISTINCT (a sort of all the matches)
+before the page can be cut. Filtering with subqueries on the through
+table never duplicates recipes, so postgres can walk the recipes in
+pagination order and stop as soon as the page is full.
+"""
+
+from django.db.models import Exists, OuterRef
+
+from core.models import Recipe
+
+MATCH_ANY = 'any'
+MATCH_ALL = 'all'
+MATCH_MODES = (MATCH_ANY, MATCH_ALL)
+
+
+def filter_by_links(queryset, field, ids, mode=MATCH_ANY):
+    """ Keep the recipes linked to any or all of ids through the m2m field """
+    through = Recipe._meta.get_field(field).remote_field.through
+    target = Recipe._meta.get_field(field).m2m_reverse_field_name()
+
+    if mode == MATCH_ALL:
+        # one semi-join per id, each checked with the unique (recipe_id,
+        # target_id) index while walking the recipes in page order.
+        for target_id in set(ids):
+            queryset = queryset.filter(Exists(through.objects.filter(
+                recipe_id=OuterRef('pk'), **{f'{target}_id': target_id})))
+        return queryset
+
+    return queryset.filter(Exists(through.objects.filter(
+        recipe_id=OuterRef('pk'), **{f'{target}_id__in': ids})))
@@ -0,0 +1,27 @@
+""" Pagination classes for recipe apis """
+
+from rest_framework.pagination import CursorPagination
+
+
+class RecipeCursorPagination(CursorPagination):
+    """ Keyset pagination for recipes seeking on the '-id' ordering """
+
+    ordering = '-id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def get_ordering(self, request, queryset, view):
+        """ Search results seek on their rank, ties are ordered by '-id' """
+        if 'rank' in queryset.query.annotations:
+            return ('-rank', '-id')
+        return super().get_ordering(request, queryset, view)
+
+
+class RecipeAttrCursorPagination(CursorPagination):
+    """ Keyset pagination for tags and ingredients seeking on '-name' """
+
+    ordering = '-name'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,133 @@
+""" Background generation of resized recipe image renditions
+
+upload_image only writes the original and schedules generate() on a
+thread pool once the upload is committed. Each rendition is saved as WebP
+and JPEG, with the EXIF orientation applied and all metadata stripped,
+and the storage names are recorded in Recipe.renditions:
+
+    {'thumb': {'width': 320, 'height': 240, 'webp': '...', 'jpeg': '...'}, ...}
+"""
+
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from core import changes, storage
+from core.models import Change, Recipe
+from recipe.cache import bump_version
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS = {
+    # name: longest side in pixels, 'thumb' is what the recipe list returns
+    'SIZES': {'thumb': 320, 'medium': 1024},
+    'WEBP_QUALITY': 80,
+    'JPEG_QUALITY': 85,
+    # Pillow releases the GIL while resizing and encoding
+    'WORKERS': 2,
+    # generate inline instead of on the pool, used by the tests
+    'ALWAYS_EAGER': False,
+}
+RENDITIONS.update(getattr(settings, 'RENDITIONS', {}))
+
+_executor = ThreadPoolExecutor(max_workers=RENDITIONS['WORKERS'], thread_name_prefix='renditions')
+
+
+def schedule(recipe, stale=None):
+    """ Generate the renditions of the recipe's image once it is committed
+
+    stale are the renditions of the replaced image, deleted afterwards.
+    """
+    args = (recipe.pk, recipe.user_id, recipe.image.name, stale or {})
+    if RENDITIONS['ALWAYS_EAGER']:
+        transaction.on_commit(lambda: generate(*args))
+    else:
+        transaction.on_commit(lambda: _executor.submit(_run, *args))
+
+
+def _run(*args):
+    """ Pool entry point, the thread gets its own db connection """
+    close_old_connections()
+    try:
+        generate(*args)
+    finally:
+        close_old_connections()
+
+
+def _encode(image, image_format, quality):
+    buffer = io.BytesIO()
+    # no exif/icc arguments, the encoders then write no metadata
+    image.save(buffer, format=image_format, quality=quality, optimize=True)
+    return ContentFile(buffer.getvalue())
+
+
+def generate(recipe_id, user_id, image_name, stale=None):
+    """ Write the renditions of image_name and record them on the recipe
+
+    A failure is logged and leaves the recipe without renditions, the
+    lists fall back to the original. The files written until then and
+    the stale renditions are released either way.
+    """
+    try:
+        with storage.claim(default_storage) as claimed:
+            renditions = _save_renditions(image_name, claimed)
+
+            # .update() skips the signals, so bump what post_save would have
+            updated = Recipe.objects.filter(pk=recipe_id, image=image_name).update(
+                renditions=renditions, updated_at=timezone.now())
+            # otherwise the image was replaced or the recipe deleted meanwhile
+            # and the claim drops the files
+            if updated:
+                for name in file_names(renditions):
+                    claimed.keep(name)
+                bump_version(user_id)
+                changes.record(user_id, changes.rows(Change.RECIPE, [recipe_id]))
+    except Exception:
+        logger.exception('Generating renditions of recipe %s failed', recipe_id)
+    finally:
+        delete_files(stale)
+
+
+def _save_renditions(image_name, claimed):
+    """ Save the renditions of image_name, adding their files to claimed """
+    with default_storage.open(image_name) as original:
+        image = ImageOps.exif_transpose(Image.open(original))
+        image = image.convert('RGB')
+
+    # content addressed, the name of a saved file only sets its directory
+    base = 'uploads/recipe/renditions'
+    renditions = {}
+    for name, size in RENDITIONS['SIZES'].items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        renditions[name] = {
+            'width': resized.width,
+            'height': resized.height,
+            'webp': claimed.add(default_storage.save(
+                f'{base}/{name}.webp', _encode(resized, 'WEBP', RENDITIONS['WEBP_QUALITY']))),
+            'jpeg': claimed.add(default_storage.save(
+                f'{base}/{name}.jpg', _encode(resized, 'JPEG', RENDITIONS['JPEG_QUALITY']))),
+        }
+
+    return renditions
+
+
+def file_names(renditions):
+    """ Returns the storage names of the files of a renditions mapping """
+    return [rendition[image_format]
+            for rendition in (renditions or {}).values()
+            for image_format in ('webp', 'jpeg')]
+
+
+def delete_files(renditions):
+    """ Drop the references to the files of a renditions mapping """
+    for name in file_names(renditions):
+        default_storage.delete(name)
@@ -1,10 +1,54 @@
 """ Serializers for recipe apis """
 
+from django.core.files.storage import default_storage
+
 from rest_framework import serializers
 
+from core.metrics import TimedSerializerMixin
 from core.models import Recipe,Tag, Ingredient
+from recipe.uploads import StoredUploadedFile
+
+
+def _absolute_url(serializer_field, name):
+    """ Url of a storage name, absolute when serializing for a request """
+    url = default_storage.url(name)
+    request = serializer_field.context.get('request')
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+class RenditionImageField(serializers.ImageField):
+    """ Image field rendering a resized rendition, or the original until it exists """
+
+    def __init__(self, rendition, image_format='webp', **kwargs):
+        self.rendition = rendition
+        self.image_format = image_format
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        rendition = value.instance.renditions.get(self.rendition) if value else None
+        if rendition is None:
+            return super().to_representation(value)
+
+        return _absolute_url(self, rendition[self.image_format])
+
+
+class RecipeAttrSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """ Base serializer for the per user named recipe attributes """
+
+    def validate_name(self, value):
+        """ Reject renaming to a name the user already has """
+        if self.instance is None:
+            return value
+
+        model = type(self.instance)
+        exists = model.objects.filter(user=self.instance.user, name=value).exclude(
+            id=self.instance.id).exists()
+        if exists:
+            raise serializers.ValidationError(f'{model.__name__} with this name already exists.')
 
-class TagSerializer(serializers.ModelSerializer):
+        return value
+
+class TagSerializer(RecipeAttrSerializer):
     """ Serializer for listing Tag model """
 
     class Meta:
@@ -12,7 +56,7 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ['id','name']
         read_only_fields = ['id']
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(RecipeAttrSerializer):
     """ Serializer for listing Ingredient model """
 
     class Meta:
@@ -20,10 +64,13 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ['id','name']
         read_only_fields = ['id']
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """ serializer for listing recipe model """
     tags = TagSerializer(many=True, required=False)
     ingredients = IngredientSerializer(many=True, required= False)
+    # lists only need the small rendition. Images are only set by the
+    # upload actions, which also replace the renditions
+    image = RenditionImageField('thumb', read_only=True)
 
     class Meta:
         model = Recipe
@@ -35,18 +82,15 @@ class RecipeSerializer(serializers.ModelSerializer):
         """ Method to get or create tags for a recipe """
 
         auth_user = self.context['request'].user
-
-        for tag in tags:
-            tag_obj, created = Tag.objects.get_or_create(user=auth_user, **tag)
-            recipe.tags.add(tag_obj)
+        tag_objs = Tag.objects.get_or_create_by_names(auth_user, [tag['name'] for tag in tags])
+        recipe.tags.set(tag_objs)
 
     def _get_or_create_ingredients(self,ingredients,recipe):
         """ Internal method to get/create ingredient for  a recipe """
-        
+
         auth_user = self.context['request'].user
-        for ing in ingredients:
-            ing_obj,created = Ingredient.objects.get_or_create(user=auth_user,**ing)
-            recipe.ingredients.add(ing_obj)
+        ing_objs = Ingredient.objects.get_or_create_by_names(auth_user, [ing['name'] for ing in ingredients])
+        recipe.ingredients.set(ing_objs)
 
     def create(self,validated_data):
         """ create a recipe """
@@ -63,12 +107,11 @@ class RecipeSerializer(serializers.ModelSerializer):
 
         tags = validated_data.pop('tags',None)
         ingredients = validated_data.pop('ingredients',None)
+        # set() only deletes/inserts the links that actually changed
         if tags is not None:
-            instance.tags.clear()
             self._get_or_create_tags(tags,instance)
 
         if ingredients is not None:
-            instance.ingredients.clear()
             self._get_or_create_ingredients(ingredients,instance)
 
         
@@ -82,16 +125,48 @@ class RecipeSerializer(serializers.ModelSerializer):
 # inorder to avoid duplicating the above code for this serializer we just extend from it.
 class RecipeDetailSerializer(RecipeSerializer):
     """ serializer for detail view recipe model """
+    image = serializers.ImageField(read_only=True)
+    renditions = serializers.SerializerMethodField()
+
     class Meta(RecipeSerializer.Meta):
-        fields = RecipeSerializer.Meta.fields + ['description']
+        fields = RecipeSerializer.Meta.fields + ['description', 'renditions']
+
+    def get_renditions(self, recipe):
+        """ urls and sizes of the resized copies of the image """
+        return {
+            name: {
+                'width': rendition['width'],
+                'height': rendition['height'],
+                'webp': _absolute_url(self, rendition['webp']),
+                'jpeg': _absolute_url(self, rendition['jpeg']),
+            }
+            for name, rendition in recipe.renditions.items()
+        }
 
-class RecipeImageSerializer(serializers.ModelSerializer):
+class StreamedImageField(serializers.ImageField):
+    """ Image field accepting files already streamed to the storage
+
+    Their header was validated while streaming, see recipe.uploads, so the
+    storage name is saved as is instead of copying and decoding the file.
+    """
+
+    def to_internal_value(self, data):
+        if not isinstance(data, StoredUploadedFile):
+            return super().to_internal_value(data)
+        if data.error is not None:
+            raise serializers.ValidationError(data.error)
+
+        return data.storage_name
+
+
+class RecipeImageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """ serializer for image field of Recipe model """
 
+    image = StreamedImageField(required=True)
+
     class Meta:
         model = Recipe
         fields =['id','image']
         read_only_fields = ['id']
-        extra_kwargs = {'image':{'required':True}}
 
 
@@ -0,0 +1,59 @@
+""" Incremental sync of the recipes, tags and ingredients of a user
+
+A sync returns the rows and links changed since a token, read from the
+change log of core.changes, with the token to pass next time. Without a
+token every live row and link is returned. The recipes are the items of
+the recipe list, the tags and ingredients their id and name, the links
+(recipe id, tag or ingredient id) pairs. Deleted rows and links are
+listed by id under deleted, and a deleted recipe, tag or ingredient also
+removes its links. A sync returns at most PAGE_SIZE changes, more tells
+to sync again right away with the new token.
+"""
+
+from django.conf import settings
+
+from core import changes
+from core.models import Change, Recipe, Tag, Ingredient
+from recipe import fastpath
+
+SYNC = {
+    'PAGE_SIZE': 1000,
+}
+SYNC.update(getattr(settings, 'SYNC', {}))
+
+# payload keys of the change kinds
+KEYS = {
+    Change.RECIPE: 'recipes',
+    Change.TAG: 'tags',
+    Change.INGREDIENT: 'ingredients',
+    Change.RECIPE_TAG: 'recipe_tags',
+    Change.RECIPE_INGREDIENT: 'recipe_ingredients',
+}
+
+
+def sync_data(user, since, request):
+    """ Return the sync payload of the changes of user after the number since """
+    entries, token, more = changes.changes_since(user.id, since, SYNC['PAGE_SIZE'])
+
+    changed = {kind: [] for kind in KEYS}
+    deleted = {kind: [] for kind in KEYS}
+    for kind, object_id, target_id, is_deleted in entries:
+        item = [object_id, target_id] if kind in (Change.RECIPE_TAG, Change.RECIPE_INGREDIENT) else object_id
+        (deleted if is_deleted else changed)[kind].append(item)
+
+    # rows deleted since the log was read have their tombstone in the next sync
+    recipes = []
+    if changed[Change.RECIPE]:
+        rows = Recipe.objects.filter(user=user, id__in=changed[Change.RECIPE]).order_by(
+            'id').values(*fastpath.LIST_FIELDS)
+        recipes = fastpath.list_data(list(rows), request)
+
+    data = {'token': token, 'more': more, 'recipes': recipes}
+    for kind, model in ((Change.TAG, Tag), (Change.INGREDIENT, Ingredient)):
+        data[KEYS[kind]] = list(model.objects.filter(
+            user=user, id__in=changed[kind]).order_by('id').values('id', 'name')) if changed[kind] else []
+    for kind in (Change.RECIPE_TAG, Change.RECIPE_INGREDIENT):
+        data[KEYS[kind]] = changed[kind]
+    data['deleted'] = {KEYS[kind]: ids for kind, ids in deleted.items()}
+
+    return data
@@ -1,5 +1,7 @@
 """ Test for Ingredients of Recipe """
 
+from unittest.mock import patch
+
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.test import TestCase
@@ -7,7 +9,9 @@ from django.test import TestCase
 from rest_framework import status
 from rest_framework.test import APIClient
 
+from core import queries
 from core.models import Ingredient
+from recipe.autocomplete import prefix_cache
 from recipe.serializers import IngredientSerializer
 
 INGREDIENTS_URL = reverse('recipe:ingredient-list')
@@ -20,6 +24,7 @@ def create_user(email='test@abc.com', password='testpass123'):
     """ create user function """
     return get_user_model().objects.create_user(email=email,password=password)
 
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
 class PublicIngredientAPITest(TestCase):
     """ Test for unauthenticated Ingredients API request"""
 
@@ -32,6 +37,7 @@ class PublicIngredientAPITest(TestCase):
         
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
 class PrivateIngredientAPITest(TestCase):
     """ Test for authenticated Ingredients API request """
 
@@ -53,7 +59,7 @@ class PrivateIngredientAPITest(TestCase):
         ing = Ingredient.objects.all().order_by('-name')
         serializer = IngredientSerializer(ing, many = True)
 
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_ingredient_list_for_authorized_user(self):
         """ test for listing of ingredient for authorized user only """
@@ -65,12 +71,12 @@ class PrivateIngredientAPITest(TestCase):
         res = self.client.get(INGREDIENTS_URL)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
 
-        self.assertEqual(len(res.data),1)
+        self.assertEqual(len(res.data['results']),1)
 
         ing = Ingredient.objects.filter(user=self.user).order_by('-name')
         serializer = IngredientSerializer(ing, many = True)
 
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_update_ingredient_api(self):
         """ test to update ingredient """
@@ -97,3 +103,65 @@ class PrivateIngredientAPITest(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
         self.assertFalse(Ingredient.objects.filter(id=ing.id).exists())
+
+
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
+class AutocompleteIngredientAPITest(TestCase):
+    """ Tests for the ?search= autocomplete of ingredient names """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+        prefix_cache.clear()
+
+        for name in ['Tomato', 'Cherry tomatoes', 'Sun dried tomato', 'Potato', 'Basil']:
+            Ingredient.objects.create(user=self.user, name=name)
+        Ingredient.objects.create(user=create_user(email='other@abc.com'), name='Tomato paste')
+
+    def _names(self, search, **params):
+        res = self.client.get(INGREDIENTS_URL, {'search': search, **params})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [ing['name'] for ing in res.data]
+
+    def test_prefix_matches_first(self):
+        """ test prefix matches rank above other matches of the user """
+        names = self._names('Tom')
+
+        self.assertEqual(names[0], 'Tomato')
+        self.assertEqual(set(names), {'Tomato', 'Cherry tomatoes', 'Sun dried tomato'})
+
+    def test_fuzzy_match(self):
+        """ test a misspelled name still matches """
+        self.assertEqual(self._names('tomatto')[0], 'Tomato')
+
+    def test_short_text_matches_prefixes(self):
+        """ test one or two characters only match name prefixes """
+        self.assertEqual(self._names('to'), ['Tomato'])
+
+    def test_limit(self):
+        """ test only the top matches are returned """
+        names = self._names('tom', limit=2)
+        self.assertEqual(len(names), 2)
+        self.assertEqual(names[0], 'Tomato')
+
+        res = self.client.get(INGREDIENTS_URL, {'search': 'to', 'limit': 'x'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_repeated_prefix_cached(self):
+        """ test a repeated prefix is served from the cache until a write """
+        self._names('bas')
+        # the number of the latest change
+        with self.assertNumQueries(1):
+            self.assertEqual(self._names('Bas '), ['Basil'])
+
+        Ingredient.objects.create(user=self.user, name='Basmati rice')
+        self.assertEqual(self._names('bas'), ['Basil', 'Basmati rice'])
+
+    def test_write_in_other_worker_invalidates(self):
+        """ test a write not seen by this worker's caches still invalidates the prefix """
+        self._names('bas')
+
+        with patch('recipe.cache.bump_version'):
+            Ingredient.objects.create(user=self.user, name='Basmati rice')
+        self.assertEqual(self._names('bas'), ['Basil', 'Basmati rice'])
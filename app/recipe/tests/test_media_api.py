@@ -0,0 +1,100 @@
+""" Tests for the recipe media API """
+
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import queries
+from core.models import Recipe
+from recipe import media
+
+
+def get_media_url(name):
+    """ create media download url """
+    return reverse('recipe:media', args=[name])
+
+
+def create_user(email='test@abc.com', password='testpass123'):
+    """ create user function """
+    return get_user_model().objects.create_user(email=email, password=password)
+
+
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
+class MediaAPITest(TestCase):
+    """ Tests for authorized media downloads """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+
+        self.image = default_storage.save('uploads/recipe/image.jpg', ContentFile(b'image'))
+        self.thumb = default_storage.save('uploads/recipe/renditions/thumb.webp', ContentFile(b'thumb'))
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='Recipe', time_minutes=5, price=5, calories_per_serving=100,
+            image=self.image,
+            renditions={'thumb': {'width': 1, 'height': 1, 'webp': self.thumb, 'jpeg': self.image}},
+        )
+
+    def tearDown(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.delete()
+
+    def test_auth_required(self):
+        """ test media downloads require authentication """
+        res = APIClient().get(get_media_url(self.image))
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_owner_download_is_handed_to_proxy(self):
+        """ test the owner's download is an X-Accel-Redirect without a body """
+        res = self.client.get(get_media_url(self.image))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['X-Accel-Redirect'], f'/protected-media/{self.image}')
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertIn('private', res['Cache-Control'])
+        self.assertEqual(res.content, b'')
+
+    def test_rendition_download(self):
+        """ test renditions of owned recipes are downloadable """
+        res = self.client.get(get_media_url(self.thumb))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'image/webp')
+
+    def test_other_users_media_not_found(self):
+        """ test files of other users' recipes are not served """
+        self.client.force_authenticate(create_user(email='other@abc.com'))
+
+        res = self.client.get(get_media_url(self.image))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn('X-Accel-Redirect', res)
+
+    def test_unreferenced_file_not_found(self):
+        """ test files no recipe references, like partial uploads, are not served """
+        res = self.client.get(get_media_url('tmp/partial/upload'))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    @patch.dict(media.MEDIA_ACCESS, {'X_ACCEL_REDIRECT': False})
+    def test_download_streamed_without_proxy(self):
+        """ test the file is streamed by the app when there is no proxy """
+        res = self.client.get(get_media_url(self.image))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(res.streaming_content), b'image')
+
+    def test_serialized_urls_point_to_download(self):
+        """ test the image urls of the recipe api are authorized downloads """
+        res = self.client.get(reverse('recipe:recipe-detail', args=[self.recipe.id]))
+
+        self.assertEqual(res.data['image'], f'http://testserver{get_media_url(self.image)}')
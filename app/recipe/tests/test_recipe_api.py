@@ -1,21 +1,43 @@
 """ Tests to test the recipe app apis """
 
 import tempfile
+import hashlib
+import gzip
 import os
+import io
+import csv
+import json
+import threading
+from contextlib import contextmanager
+from unittest.mock import patch
 from PIL import Image
 from decimal import Decimal
 
+import brotli
+import msgpack
+
 from django.contrib.auth import get_user_model
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, connection
 from django.test import TestCase
 from django.urls import reverse
 
 from rest_framework import status
+from rest_framework.exceptions import ParseError, ValidationError
 from rest_framework.test import APIClient
 
-from core.models import Recipe, Tag, Ingredient
-from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from core import queries
+from core.models import Recipe, Tag, Ingredient, ImageUpload, ChangeCounter, StoredFile
+from recipe.serializers import RecipeSerializer, RecipeDetailSerializer, RecipeImageSerializer
+from recipe import bulk, cache, renditions, sync, uploads
+from recipe.cache import bump_version
+from recipe.views import RecipeAPIViewSet
 
 RECIPES_URL = reverse('recipe:recipe-list')
+BULK_IMPORT_URL = reverse('recipe:recipe-bulk-import')
+EXPORT_URL = reverse('recipe:recipe-export')
+SYNC_URL = reverse('recipe:sync')
 
 def create_detial_url(recipe_id):
     """ fucntion to create recipe detail url """
@@ -27,6 +49,29 @@ def create_image_detail_url(recipe_id):
     return reverse('recipe:recipe-upload-image',args=[recipe_id])
 
 
+def create_image_uploads_url(recipe_id):
+    """ function to create the resumable image uploads url """
+    return reverse('recipe:recipe-image-uploads', args=[recipe_id])
+
+
+def create_image_bytes(size=(800, 600), image_format='JPEG'):
+    """ function to create the bytes of an image file """
+    buffer = io.BytesIO()
+    Image.new('RGB', size).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+@contextmanager
+def execute_on_commit():
+    """ Run the on_commit callbacks registered inside the block, and those
+    they register in turn, which captureOnCommitCallbacks leaves out """
+    start = len(connection.run_on_commit)
+    yield
+    while start < len(connection.run_on_commit):
+        start += 1
+        connection.run_on_commit[start - 1][1]()
+
+
 def create_recipe(user, **params):
     """ create a recipe for authorized user"""
     defaults = {
@@ -47,6 +92,7 @@ def create_user(**params):
     return get_user_model().objects.create_user(**params)
 
 
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
 class PublicRecipeAPITests(TestCase):
     """ Test for Recipe api for unauthorized user """
 
@@ -59,6 +105,7 @@ class PublicRecipeAPITests(TestCase):
 
         self.assertEqual(res.status_code,status.HTTP_401_UNAUTHORIZED)
 
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
 class PrivateRecipeAPITests(TestCase):
     """ Test for Recipe api for authorized user """
 
@@ -80,7 +127,19 @@ class PrivateRecipeAPITests(TestCase):
         recipes = Recipe.objects.all().order_by('-id')
         recipe_serializer = RecipeSerializer(recipes,many=True)
 
-        self.assertEqual(res.data,recipe_serializer.data)
+        self.assertEqual(res.data['results'],recipe_serializer.data)
+
+    def test_list_without_repeated_queries(self):
+        """ test listing recipes with nested tags and ingredients runs no query per recipe """
+        for i in range(5):
+            recipe = create_recipe(self.user, title=f'Recipe {i}')
+            recipe.tags.add(Tag.objects.create(user=self.user, name=f'Tag {i}'))
+            recipe.ingredients.add(Ingredient.objects.create(user=self.user, name=f'Ingredient {i}'))
+
+        # strict mode raises RepeatedQueriesError on a query per recipe
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(len(res.data['results']), 5)
 
     def test_retrieve_recipes_only_authorized_user(self):
         """ Test to retreive list of receipe for authorized users """
@@ -96,7 +155,7 @@ class PrivateRecipeAPITests(TestCase):
         recipes = Recipe.objects.filter(user=self.user).order_by('-id')
         recipe_serializer = RecipeSerializer(recipes,many=True)
 
-        self.assertEqual(res.data,recipe_serializer.data)
+        self.assertEqual(res.data['results'],recipe_serializer.data)
 
     def test_retrieve_recipe_detail(self):
         """ test for retrieving a specific recipe API """
@@ -259,6 +318,32 @@ class PrivateRecipeAPITests(TestCase):
         self.assertEqual(recipe.tags.count(),2)
         self.assertIn(tag_indian, recipe.tags.all())
         
+    def test_create_recipe_with_many_tags_query_count(self):
+        """ test nested tags and ingredients are resolved in batches """
+
+        payload = {
+            'title': 'Big Salad',
+            'time_minutes': 10,
+            'price': Decimal('50'),
+            'calories_per_serving': 100,
+            'tags': [{'name': f'Tag {i}'} for i in range(20)],
+            'ingredients': [{'name': f'Ing {i}'} for i in range(20)],
+        }
+        Ingredient.objects.create(user=self.user, name='Ing 0')
+
+        # insert recipe, index it, 3 + 3 to resolve names, 4 + 4 to set links
+        # (current, already linked for m2m_changed, insert, touch updated_at),
+        # savepoint, record the changes, release savepoint and 2 to render
+        # the response
+        with self.assertNumQueries(21):
+            res = self.client.post(RECIPES_URL, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(recipe.tags.count(), 20)
+        self.assertEqual(recipe.ingredients.count(), 20)
+        self.assertEqual(Ingredient.objects.filter(user=self.user).count(), 20)
+
     def test_update_tag_on_recipe(self):
         """ test update of tags on created recipe"""
         
@@ -418,9 +503,9 @@ class PrivateRecipeAPITests(TestCase):
         s2 = RecipeSerializer(r2)
         s3 = RecipeSerializer(r3)
 
-        self.assertIn(s1.data,res.data)
-        self.assertIn(s2.data,res.data)
-        self.assertNotIn(s3.data,res.data)
+        self.assertIn(s1.data,res.data['results'])
+        self.assertIn(s2.data,res.data['results'])
+        self.assertNotIn(s3.data,res.data['results'])
 
     def test_filter_ingredients_for_recipe(self):
         """ test for filtering recipe based on ingredient ids passed as params in request"""
@@ -441,11 +526,879 @@ class PrivateRecipeAPITests(TestCase):
         s2 = RecipeSerializer(r2)
         s3 = RecipeSerializer(r3)
 
-        self.assertIn(s1.data,res.data)
-        self.assertIn(s2.data,res.data)
-        self.assertNotIn(s3.data,res.data)
+        self.assertIn(s1.data,res.data['results'])
+        self.assertIn(s2.data,res.data['results'])
+        self.assertNotIn(s3.data,res.data['results'])
+
+    def test_filter_matching_many_tags_not_duplicated(self):
+        """ test a recipe matching several of the tags is listed once """
+        r1 = create_recipe(user=self.user, title='Recipe1')
+        t1 = Tag.objects.create(user=self.user, name='tag1')
+        t2 = Tag.objects.create(user=self.user, name='tag2')
+        r1.tags.add(t1, t2)
+
+        res = self.client.get(RECIPES_URL, {'tags': f'{t1.id},{t2.id}'})
+
+        self.assertEqual([r['id'] for r in res.data['results']], [r1.id])
+
+    def test_filter_tags_mode_all(self):
+        """ test tags_mode=all only keeps recipes having every tag """
+        r1 = create_recipe(user=self.user, title='Recipe1')
+        r2 = create_recipe(user=self.user, title='Recipe2')
+        t1 = Tag.objects.create(user=self.user, name='tag1')
+        t2 = Tag.objects.create(user=self.user, name='tag2')
+        r1.tags.add(t1, t2)
+        r2.tags.add(t1)
+
+        params = {'tags': f'{t1.id},{t2.id},{t2.id}', 'tags_mode': 'all'}
+        res = self.client.get(RECIPES_URL, params)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in res.data['results']], [r1.id])
+
+    def test_filter_ingredients_mode_all(self):
+        """ test ingredients_mode=all combined with a tag filter """
+        r1 = create_recipe(user=self.user, title='Recipe1')
+        r2 = create_recipe(user=self.user, title='Recipe2')
+        tag = Tag.objects.create(user=self.user, name='tag1')
+        i1 = Ingredient.objects.create(user=self.user, name='Ing1')
+        i2 = Ingredient.objects.create(user=self.user, name='Ing2')
+        for recipe in (r1, r2):
+            recipe.tags.add(tag)
+            recipe.ingredients.add(i1, i2)
+        r2.ingredients.remove(i2)
+
+        params = {'tags': f'{tag.id}', 'ingredients': f'{i1.id},{i2.id}', 'ingredients_mode': 'all'}
+        res = self.client.get(RECIPES_URL, params)
+
+        self.assertEqual([r['id'] for r in res.data['results']], [r1.id])
+
+    def test_filter_invalid_mode(self):
+        """ test an unknown match mode is rejected """
+        res = self.client.get(RECIPES_URL, {'tags': '1', 'tags_mode': 'some'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def _create_recipes_with_tags_and_ingredients(self, count):
+        """ helper to create recipes each having a tag and an ingredient """
+        tag, _ = Tag.objects.get_or_create(user=self.user, name='Dinner')
+        ing, _ = Ingredient.objects.get_or_create(user=self.user, name='Salt')
+        for i in range(count):
+            recipe = create_recipe(user=self.user, title=f'Recipe {i}')
+            recipe.tags.add(tag, Tag.objects.create(user=self.user, name=f'Tag {recipe.id}'))
+            recipe.ingredients.add(ing)
+
+        return tag, ing
+
+    def test_list_recipes_query_count_is_constant(self):
+        """ test listing recipes does not fire queries per recipe """
+        self._create_recipes_with_tags_and_ingredients(2)
+        # conditional GET aggregate, recipes, tags, ingredients
+        with self.assertNumQueries(4):
+            res = self.client.get(RECIPES_URL)
+        self.assertEqual(len(res.data['results']), 2)
+
+        self._create_recipes_with_tags_and_ingredients(10)
+        with self.assertNumQueries(4):
+            res = self.client.get(RECIPES_URL)
+        self.assertEqual(len(res.data['results']), 12)
+
+    def test_filter_recipes_query_count_is_constant(self):
+        """ test filtering recipes by tags and ingredients keeps query count fixed """
+        tag, ing = self._create_recipes_with_tags_and_ingredients(10)
+
+        params = {'tags': f'{tag.id}', 'ingredients': f'{ing.id}'}
+        with self.assertNumQueries(4):
+            res = self.client.get(RECIPES_URL, params)
+        self.assertEqual(len(res.data['results']), 10)
+
+    def test_retrieve_recipe_query_count(self):
+        """ test recipe detail loads nested objects with fixed queries """
+        self._create_recipes_with_tags_and_ingredients(1)
+        recipe = Recipe.objects.get(user=self.user)
+
+        with self.assertNumQueries(4):
+            res = self.client.get(create_detial_url(recipe.id))
+        self.assertEqual(len(res.data['tags']), 2)
+
+    def test_list_recipes_cursor_pagination(self):
+        """ test recipe list is paginated with an opaque cursor seeking on -id """
+        recipes = [create_recipe(user=self.user, title=f'Recipe {i}') for i in range(5)]
+
+        res = self.client.get(RECIPES_URL, {'page_size': 2})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIsNone(res.data['previous'])
+        self.assertEqual([r['id'] for r in res.data['results']],
+                         [recipes[4].id, recipes[3].id])
+
+        seen = [r['id'] for r in res.data['results']]
+        next_url = res.data['next']
+        while next_url:
+            self.assertIn('cursor=', next_url)
+            res = self.client.get(next_url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            seen += [r['id'] for r in res.data['results']]
+            next_url = res.data['next']
+
+        self.assertEqual(seen, [r.id for r in reversed(recipes)])
+
+    def test_list_recipes_invalid_cursor(self):
+        """ test a tampered cursor is rejected """
+        res = self.client.get(RECIPES_URL, {'cursor': 'not-a-cursor'})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
+class FastReadParityTests(TestCase):
+    """ Tests the fast path renders the same bytes as the serializers """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='testemail@abc.com',password='testpass123')
+        self.client.force_authenticate(self.user)
+
+        tags = [Tag.objects.create(user=self.user, name=f'Tag {i}') for i in range(3)]
+        ingredients = [Ingredient.objects.create(user=self.user, name=f'Ingredient {i}') for i in range(3)]
+        thumb = {'width': 320, 'height': 240, 'webp': 'uploads/recipe/renditions/t.webp',
+                 'jpeg': 'uploads/recipe/renditions/t.jpg'}
+        self.recipes = [
+            create_recipe(self.user, title='Plain soup', price=Decimal('0'), link=''),
+            create_recipe(self.user, title='Tomato soup', price=Decimal('5.5'),
+                          image='uploads/recipe/ab/abcd.jpg'),
+            create_recipe(self.user, title='Onion "soup" é', price=Decimal('999.99'), description='',
+                          image='uploads/recipe/cd/cdef.png', renditions={'thumb': thumb}),
+        ]
+        # linked out of id order
+        self.recipes[1].tags.set([tags[2], tags[0]])
+        self.recipes[1].ingredients.set([ingredients[1]])
+        self.recipes[2].tags.set(tags)
+        self.recipes[2].ingredients.set([ingredients[2], ingredients[0], ingredients[1]])
+
+    def assertSameBytes(self, url):
+        """ request url from the fast path and from the serializers """
+        fast = self.client.get(url)
+        bump_version(self.user.id)
+        with patch.object(RecipeAPIViewSet, 'fast_reads', False):
+            slow = self.client.get(url)
+        bump_version(self.user.id)
+
+        self.assertEqual(fast.status_code, slow.status_code)
+        self.assertEqual(fast.content, slow.content)
+
+    def test_list_parity(self):
+        """ test lists, filtered, searched and paginated, are identical """
+        self.assertSameBytes(RECIPES_URL)
+        self.assertSameBytes(f'{RECIPES_URL}?page_size=2')
+        self.assertSameBytes(f'{RECIPES_URL}?q=soup&page_size=1')
+        self.assertSameBytes(f'{RECIPES_URL}?tags={self.recipes[2].tags.first().id}')
+
+    def test_detail_parity(self):
+        """ test details, with and without image and renditions, are identical """
+        for recipe in self.recipes:
+            self.assertSameBytes(create_detial_url(recipe.id))
+        self.assertSameBytes(create_detial_url(self.recipes[-1].id + 1))
+
+    def test_queries_do_not_grow_with_page(self):
+        """ test a page of recipes is read with one query per table """
+        bump_version(self.user.id)
+        with self.assertNumQueries(4):
+            # the conditional GET validators, then recipes, tags and ingredients
+            self.client.get(RECIPES_URL)
+
+
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
+class MessagePackRecipeAPITests(TestCase):
+    """ Tests the recipe apis negotiate MessagePack """
+
+    def setUp(self):
+        self.client = APIClient(HTTP_ACCEPT='application/msgpack')
+        self.user = create_user(email='testemail@abc.com',password='testpass123')
+        self.client.force_authenticate(self.user)
+
+    def post_msgpack(self, url, payload, method='post'):
+        return getattr(self.client, method)(url, msgpack.packb(payload), content_type='application/msgpack')
+
+    def test_list_and_detail(self):
+        """ test the payloads are the JSON ones with the price in cents """
+        recipe = create_recipe(self.user, price=Decimal('5.50'))
+        recipe.tags.add(Tag.objects.create(user=self.user, name='Vegan'))
+
+        for url in (RECIPES_URL, create_detial_url(recipe.id)):
+            res = self.client.get(url)
+            expected = self.client.get(url, HTTP_ACCEPT='application/json').json()
+
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(res['Content-Type'], 'application/msgpack')
+            data = msgpack.unpackb(res.content)
+            item = data['results'][0] if 'results' in data else data
+            self.assertEqual(item['price'], 550)
+            self.assertEqual(item, dict(expected.get('results', [expected])[0], price=550))
+
+    def test_create_and_update(self):
+        """ test msgpack bodies are accepted with the price in cents """
+        payload = {
+            'title': 'Crème brûlée',
+            'time_minutes': 30,
+            'price': 1999,
+            'calories_per_serving': 400,
+            'tags': [{'name': 'Dessert'}],
+        }
+        res = self.post_msgpack(RECIPES_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(msgpack.unpackb(res.content)['price'], 1999)
+        recipe = Recipe.objects.get(id=msgpack.unpackb(res.content)['id'])
+        self.assertEqual(recipe.price, Decimal('19.99'))
+        self.assertEqual(recipe.tags.get().name, 'Dessert')
+
+        res = self.post_msgpack(create_detial_url(recipe.id), {'price': 5}, method='patch')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.price, Decimal('0.05'))
+
+    def test_invalid_body(self):
+        """ test undecodable bodies and non integer prices are rejected """
+        res = self.client.post(RECIPES_URL, b'\xc1', content_type='application/msgpack')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.post_msgpack(RECIPES_URL, {'title': 'Soup', 'time_minutes': 5,
+                                              'price': 'cheap', 'calories_per_serving': 1})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('price', msgpack.unpackb(res.content))
+
+
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
+@patch.dict(cache.RECIPE_CACHE, {'ENABLED': True})
+class CachedRecipeAPITests(TestCase):
+    """ Tests for the per user versioned cache of recipe responses """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='testemail@abc.com',password='testpass123')
+        self.client.force_authenticate(self.user)
+        self.recipe = create_recipe(user=self.user)
+
+    def test_list_served_from_cache(self):
+        """ test a repeated list request only runs the validator query """
+        res = self.client.get(RECIPES_URL)
+        self.assertIn('ETag', res)
+
+        with self.assertNumQueries(1):
+            cached = self.client.get(RECIPES_URL)
+        self.assertEqual(cached.status_code, status.HTTP_200_OK)
+        self.assertEqual(cached.data, res.data)
+        self.assertEqual(cached['ETag'], res['ETag'])
+
+    def test_detail_served_from_cache(self):
+        """ test a repeated detail request only runs the validator query """
+        url = create_detial_url(self.recipe.id)
+        self.client.get(url)
+
+        with self.assertNumQueries(1):
+            res = self.client.get(url)
+        self.assertEqual(res.data['title'], self.recipe.title)
+
+    def test_compressed_body_served_from_cache(self):
+        """ test a repeated request reuses the compressed body of the first one """
+        for i in range(20):
+            create_recipe(user=self.user, title=f'Recipe {i}')
+        res = self.client.get(RECIPES_URL, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+
+        with patch('core.compression.compress') as compress, self.assertNumQueries(1):
+            cached = self.client.get(RECIPES_URL, HTTP_ACCEPT_ENCODING='gzip')
+        compress.assert_not_called()
+        self.assertEqual(cached.content, res.content)
+        self.assertEqual(cached['Content-Type'], 'application/json')
+        self.assertEqual(cached['ETag'], res['ETag'])
+        self.assertTrue(cached['ETag'].startswith('W/'))
+
+        other = self.client.get(RECIPES_URL, HTTP_ACCEPT_ENCODING='br')
+        self.assertEqual(other['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(other.content), gzip.decompress(res.content))
+
+        res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=res['ETag'], HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_if_none_match_returns_304(self):
+        """ test an unchanged response is answered with 304 """
+        res = self.client.get(RECIPES_URL)
+
+        with self.assertNumQueries(1):
+            res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertFalse(res.content)
+
+    def test_recipe_change_invalidates(self):
+        """ test writes to a recipe invalidate the cached responses """
+        etag = self.client.get(RECIPES_URL)['ETag']
+        self.recipe.title = 'Changed'
+        self.recipe.save()
+
+        res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'][0]['title'], 'Changed')
+
+    def test_tag_changes_invalidate(self):
+        """ test tag renames and recipe links invalidate the cached responses """
+        url = create_detial_url(self.recipe.id)
+        tag = Tag.objects.create(user=self.user, name='Dinner')
+        self.client.get(url)
+
+        self.recipe.tags.add(tag)
+        self.assertEqual(self.client.get(url).data['tags'][0]['name'], 'Dinner')
+
+        self.client.patch(reverse('recipe:tag-detail', args=[tag.id]), {'name': 'Supper'})
+        self.assertEqual(self.client.get(url).data['tags'][0]['name'], 'Supper')
+
+    def test_other_user_changes_do_not_invalidate(self):
+        """ test writes by another user keep this user's cache """
+        self.client.get(RECIPES_URL)
+        create_recipe(user=create_user(email='other@abc.com', password='testpass123'))
+
+        with self.assertNumQueries(1):
+            self.client.get(RECIPES_URL)
+
+    def test_stale_worker_cache_not_served(self):
+        """ test a cache that missed a write never serves its payload under the new ETag """
+        workers = {name: LocMemCache(f'worker-{name}', {}) for name in 'ab'}
+        with patch('recipe.cache._cache', lambda: workers['b']):
+            old = self.client.get(RECIPES_URL)
+        with patch('recipe.cache._cache', lambda: workers['a']):
+            create_recipe(user=self.user, title='Second')
+
+        with patch('recipe.cache._cache', lambda: workers['b']):
+            res = self.client.get(RECIPES_URL)
+            revalidated = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=old['ETag'])
+
+        self.assertEqual(len(res.data['results']), 2)
+        self.assertNotEqual(res['ETag'], old['ETag'])
+        self.assertEqual(revalidated.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(revalidated.data['results']), 2)
+
+    def test_stale_worker_compressed_body_not_served(self):
+        """ test a cached compressed body that missed a write is not served under the new ETag """
+        for i in range(20):
+            create_recipe(user=self.user, title=f'Recipe {i}')
+        workers = {name: LocMemCache(f'worker-{name}', {}) for name in 'ab'}
+        with patch('recipe.cache._cache', lambda: workers['b']):
+            old = self.client.get(RECIPES_URL, HTTP_ACCEPT_ENCODING='gzip')
+        with patch('recipe.cache._cache', lambda: workers['a']):
+            create_recipe(user=self.user, title='Latest')
+
+        with patch('recipe.cache._cache', lambda: workers['b']):
+            res = self.client.get(RECIPES_URL, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertNotEqual(res['ETag'], old['ETag'])
+        self.assertEqual(json.loads(gzip.decompress(res.content))['results'][0]['title'], 'Latest')
+
+    @patch.dict(cache.RECIPE_CACHE, {'ENABLED': None})
+    def test_not_cached_in_local_memory(self):
+        """ test the payloads are not cached in a cache the workers do not share """
+        self.client.get(RECIPES_URL)
+
+        # the validator, the recipes, their tags and their ingredients
+        with self.assertNumQueries(4):
+            res = self.client.get(RECIPES_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
+class ConditionalRecipeAPITests(TestCase):
+    """ Tests for updated_at tracking and conditional GET of recipes """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='testemail@abc.com',password='testpass123')
+        self.client.force_authenticate(self.user)
+        self.recipe = create_recipe(user=self.user)
+
+    def _refreshed_updated_at(self):
+        self.recipe.refresh_from_db()
+        return self.recipe.updated_at
+
+    def test_tag_links_and_renames_touch_recipe(self):
+        """ test changing tags of a recipe bumps its updated_at """
+        tag = Tag.objects.create(user=self.user, name='Dinner')
+        before = self._refreshed_updated_at()
+
+        self.recipe.tags.add(tag)
+        linked = self._refreshed_updated_at()
+        self.assertGreater(linked, before)
+
+        tag.name = 'Supper'
+        tag.save()
+        renamed = self._refreshed_updated_at()
+        self.assertGreater(renamed, linked)
+
+        tag.delete()
+        self.assertGreater(self._refreshed_updated_at(), renamed)
+
+    def test_detail_if_modified_since_returns_304(self):
+        """ test detail responses carry Last-Modified and honour it """
+        url = create_detial_url(self.recipe.id)
+        res = self.client.get(url)
+        self.assertIn('Last-Modified', res)
+
+        with self.assertNumQueries(1):
+            res = self.client.get(url, HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_list_etag_changes_on_delete(self):
+        """ test deleting a recipe changes the list ETag """
+        create_recipe(user=self.user, title='Second')
+        etag = self.client.get(RECIPES_URL)['ETag']
+        self.recipe.delete()
+
+        res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Last-Modified', res)
+
+    def test_detail_of_missing_recipe_is_404(self):
+        """ test conditional headers do not hide a missing recipe """
+        res = self.client.get(create_detial_url(self.recipe.id + 100), HTTP_IF_NONE_MATCH='*')
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
+class SearchRecipeAPITests(TestCase):
+    """ Tests for the full text search of recipes """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='testemail@abc.com',password='testpass123')
+        self.client.force_authenticate(self.user)
+
+    def _search(self, text, **params):
+        res = self.client.get(RECIPES_URL, {'q': text, **params})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [r['id'] for r in res.data['results']]
+
+    def test_search_ranks_title_over_description(self):
+        """ test title matches rank above description matches """
+        r1 = create_recipe(user=self.user, title='Pasta bake', description='Cheesy')
+        r2 = create_recipe(user=self.user, title='Soup', description='Served with baked bread')
+        create_recipe(user=self.user, title='Salad', description='Fresh')
+        create_recipe(user=create_user(email='other@abc.com', password='testpass123'),
+                      title='Bake sale')
+
+        self.assertEqual(self._search('baking'), [r1.id, r2.id])
+
+    def test_search_tag_and_ingredient_names(self):
+        """ test links, renames and removals of tags and ingredients are searchable """
+        recipe = create_recipe(user=self.user, title='Curry')
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe.tags.add(tag)
+        recipe.ingredients.add(Ingredient.objects.create(user=self.user, name='Coconut'))
+        self.assertEqual(self._search('vegan coconut'), [recipe.id])
+
+        tag.name = 'Spicy'
+        tag.save()
+        self.assertEqual(self._search('vegan'), [])
+        self.assertEqual(self._search('spicy'), [recipe.id])
+
+        tag.delete()
+        self.assertEqual(self._search('spicy'), [])
+
+    def test_search_created_with_nested_tags(self):
+        """ test recipes created through the api are searchable by their tags """
+        payload = {
+            'title': 'Stew',
+            'time_minutes': 60,
+            'price': Decimal('8'),
+            'calories_per_serving': 500,
+            'tags': [{'name': 'Winter'}],
+        }
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(self._search('winter'), [res.data['id']])
+
+    def test_search_bulk_imported(self):
+        """ test bulk imported recipes are searchable """
+        body = json.dumps({'title': 'Fish pie', 'time_minutes': 40, 'price': '9.00',
+                           'calories_per_serving': 700, 'ingredients': [{'name': 'Cod'}]})
+        res = self.client.post(BULK_IMPORT_URL, body, content_type='application/x-ndjson')
+        b''.join(res.streaming_content)
+
+        self.assertEqual(len(self._search('cod')), 1)
+
+    def test_search_pages_by_rank(self):
+        """ test search results are cursor paginated in rank order """
+        title = create_recipe(user=self.user, title='Lemon tart')
+        described = [
+            create_recipe(user=self.user, title=f'Cake {i}', description='lemon')
+            for i in range(3)
+        ]
+
+        res = self.client.get(RECIPES_URL, {'q': 'lemon', 'page_size': 2})
+        seen = [r['id'] for r in res.data['results']]
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            seen += [r['id'] for r in res.data['results']]
+
+        self.assertEqual(seen, [title.id] + [r.id for r in reversed(described)])
+
+
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
+class BulkImportRecipeAPITests(TestCase):
+    """ Tests for the streaming bulk import of recipes """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='testemail@abc.com',password='testpass123')
+        self.client.force_authenticate(self.user)
+
+    def _recipe_payload(self, **params):
+        """ helper to build a recipe payload for import """
+        payload = {
+            'title': 'Imported recipe',
+            'time_minutes': 10,
+            'price': '5.50',
+            'calories_per_serving': 100,
+            'tags': [{'name': 'Imported'}],
+            'ingredients': [{'name': 'Salt'}],
+        }
+        payload.update(params)
+        return payload
+
+    def _post(self, body, content_type):
+        """ helper to post a body to import and decode the streamed results """
+        res = self.client.post(BULK_IMPORT_URL, body, content_type=content_type)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        lines = b''.join(res.streaming_content).decode().splitlines()
+        return [json.loads(line) for line in lines]
+
+    def test_bulk_import_ndjson(self):
+        """ test importing recipes from NDJSON with per row results """
+        Tag.objects.create(user=self.user, name='Imported')
+        body = '\n'.join([
+            json.dumps(self._recipe_payload(title='First')),
+            '',
+            json.dumps(self._recipe_payload(title='', tags=[{'name': 'Bad'}])),
+            '{not json',
+            json.dumps(self._recipe_payload(title='Second', tags=[{'name': 'New'}])),
+        ])
+
+        results = self._post(body, 'application/x-ndjson')
+
+        self.assertEqual([r.get('status') for r in results],
+                         ['created', 'invalid', 'invalid', 'created', 'done'])
+        self.assertIn('title', results[1]['errors'])
+        self.assertEqual(results[-1], {'status': 'done', 'created': 2, 'invalid': 2, 'failed': 0})
+
+        second = Recipe.objects.get(id=results[3]['id'])
+        self.assertEqual(second.user, self.user)
+        self.assertEqual(second.price, Decimal('5.50'))
+        self.assertEqual([t.name for t in second.tags.all()], ['New'])
+        first = Recipe.objects.get(id=results[0]['id'])
+        self.assertEqual([t.name for t in first.tags.all()], ['Imported'])
+        self.assertEqual(second.ingredients.get().name, 'Salt')
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+        self.assertFalse(Tag.objects.filter(name='Bad').exists())
+
+    def test_bulk_import_json_array(self):
+        """ test importing recipes from a JSON array body """
+        body = json.dumps([self._recipe_payload(title=f'Recipe {i}') for i in range(3)])
+
+        results = self._post(body, 'application/json')
+
+        self.assertEqual(results[-1]['created'], 3)
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(Ingredient.objects.filter(user=self.user).count(), 1)
+
+    def test_bulk_import_query_count_per_chunk(self):
+        """ test the queries of an import chunk do not grow with its rows """
+        Ingredient.objects.create(user=self.user, name='Salt')
+        for count in (2, 20):
+            body = '\n'.join(
+                json.dumps(self._recipe_payload(title=f'Recipe {i}', tags=[{'name': f'Tag {i}'}]))
+                for i in range(count)
+            )
+            # savepoint, insert recipes, 3 + 1 for new tags, 1 + 1 for the
+            # existing ingredient, index the recipes, read back the links
+            # and record the changes, release savepoint
+            with self.assertNumQueries(13):
+                self._post(body, 'application/x-ndjson')
+
+    def test_bulk_import_in_chunks(self):
+        """ test records are committed in chunks """
+        body = '\n'.join(json.dumps(self._recipe_payload(title=f'Recipe {i}')) for i in range(5))
+
+        with patch('recipe.bulk._create_chunk', wraps=bulk._create_chunk) as create_chunk, \
+                patch('recipe.bulk.IMPORT_CHUNK_SIZE', 2):
+            results = self._post(body, 'application/x-ndjson')
+
+        self.assertEqual(create_chunk.call_count, 3)
+        self.assertEqual([r['index'] for r in results[:-1]], [0, 1, 2, 3, 4])
+
+    @patch('recipe.bulk._create_chunk', side_effect=DatabaseError('violates constraint "core_recipe_pkey"'))
+    def test_bulk_import_database_error(self, patched_create):
+        """ test a failed chunk reports a generic error per row and logs the details """
+        body = json.dumps([self._recipe_payload(title=f'Recipe {i}') for i in range(2)])
+
+        with self.assertLogs('recipe.bulk', 'ERROR') as logs:
+            results = self._post(body, 'application/json')
+
+        self.assertEqual([r['status'] for r in results], ['failed', 'failed', 'done'])
+        self.assertEqual(results[0]['errors'], ['The recipe could not be saved.'])
+        self.assertNotIn('constraint', json.dumps(results))
+        self.assertIn('core_recipe_pkey', logs.output[0])
+
+    @patch.object(bulk, 'MAX_RECORD_SIZE', 256)
+    def test_bulk_import_malformed_item_mid_array(self):
+        """ test a malformed item mid-array ends the import with an invalid row """
+        body = '[' + ', '.join([json.dumps(self._recipe_payload(title='First')), '{not json}'] + [
+            json.dumps(self._recipe_payload(title=f'Recipe {i}')) for i in range(20)]) + ']'
+
+        results = self._post(body, 'application/json')
+
+        self.assertEqual([r.get('status') for r in results], ['created', 'invalid', 'done'])
+        self.assertIn('larger than 256 bytes', results[1]['errors'][0])
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 1)
+
+    def test_bulk_import_unsupported_media_type(self):
+        """ test import rejects bodies that are not JSON """
+        res = self.client.post(BULK_IMPORT_URL, {'title': 'x'}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
+class ExportRecipeAPITests(TestCase):
+    """ Tests for the streaming export of recipes """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='testemail@abc.com',password='testpass123')
+        self.client.force_authenticate(self.user)
+
+        self.tag = Tag.objects.create(user=self.user, name='Dinner')
+        self.recipes = []
+        for i in range(5):
+            recipe = create_recipe(user=self.user, title=f'Recipe {i}')
+            recipe.tags.add(self.tag)
+            recipe.ingredients.add(Ingredient.objects.create(user=self.user, name=f'Ing {i}'))
+            self.recipes.append(recipe)
+        create_recipe(user=create_user(email='other@abc.com', password='testpass123'))
+
+    def _get(self, params=None):
+        """ helper to request an export and join the streamed content """
+        res = self.client.get(EXPORT_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res, b''.join(res.streaming_content).decode()
+
+    def test_export_ndjson(self):
+        """ test recipes of the user are exported as NDJSON """
+        res, content = self._get()
+
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in content.splitlines()]
+        expected = RecipeDetailSerializer(
+            Recipe.objects.filter(user=self.user).order_by('-id'), many=True).data
+        self.assertEqual(rows, json.loads(json.dumps(expected)))
+
+    def test_export_compressed(self):
+        """ test the streamed export is compressed when accepted """
+        res = self.client.get(EXPORT_URL, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        content = gzip.decompress(b''.join(res.streaming_content)).decode()
+        self.assertEqual(len(content.splitlines()), 5)
+
+    def test_export_csv(self):
+        """ test recipes of the user are exported as CSV """
+        res, content = self._get({'file_format': 'csv', 'tags': f'{self.tag.id}'})
+
+        self.assertEqual(res['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['id'], str(self.recipes[4].id))
+        self.assertEqual(rows[0]['price'], '300.20')
+        self.assertEqual(rows[0]['tags'], 'Dinner')
+        self.assertEqual(rows[0]['ingredients'], 'Ing 4')
+        self.assertEqual(list(rows[0]), bulk.CSV_FIELDS)
+        self.assertNotIn('renditions', rows[0])
+
+    def test_export_prefetches_per_chunk(self):
+        """ test tags and ingredients are prefetched once per chunk """
+        with patch('recipe.bulk.EXPORT_CHUNK_SIZE', 2):
+            # cursor query + tags and ingredients for each of the 3 chunks
+            with self.assertNumQueries(7):
+                self._get()
+
+    def test_export_invalid_format(self):
+        """ test an unknown export format is rejected """
+        res = self.client.get(EXPORT_URL, {'file_format': 'xml'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
+class JSONArrayStreamTests(TestCase):
+    """ Tests for the incremental JSON array reader """
+
+    def _read(self, text, read_size=3):
+        """ helper to read a JSON array in tiny chunks """
+        return list(bulk.iter_json_array(io.BytesIO(text.encode()), read_size=read_size))
+
+    def test_read_items_across_chunks(self):
+        """ test items split across reads are decoded """
+        items = self._read(' [ {"a": 1}, {"b": "été ]"} , 12345 ] ')
+
+        self.assertEqual(items, [({'a': 1}, None), ({'b': 'été ]'}, None), (12345, None)])
+
+    def test_read_empty_array(self):
+        """ test an empty array yields nothing """
+        self.assertEqual(self._read('[]'), [])
+
+    def test_read_truncated_array(self):
+        """ test a truncated array yields an error """
+        items = self._read('[{"a": 1}, {"b"')
+
+        self.assertEqual(items[0], ({'a': 1}, None))
+        self.assertIsNone(items[1][0])
+        self.assertIn('Invalid JSON', items[1][1])
+
+    def test_read_malformed_item_mid_array(self):
+        """ test a malformed item stops the reading once max_size is buffered """
+        text = '[{"a": 1}, {not json}, ' + '{"b": 2}, ' * 1000 + '{"b": 2}]'
+        stream = io.BytesIO(text.encode())
+        items = bulk.iter_json_array(stream, read_size=16, max_size=64)
+
+        self.assertEqual(next(items), ({'a': 1}, None))
+        with self.assertRaises(ParseError):
+            next(items)
+        self.assertLess(stream.tell(), 128)
+
+    def test_read_ndjson_line_too_large(self):
+        """ test a NDJSON line longer than max_size is not buffered """
+        stream = io.BytesIO(b'{"a": 1}\n{"b": "' + b'x' * 1000 + b'"}\n')
+        items = bulk.iter_ndjson(stream, max_size=64)
+
+        self.assertEqual(next(items), ({'a': 1}, None))
+        with self.assertRaises(ParseError):
+            next(items)
+
+
+
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
+class SyncRecipeAPITests(TestCase):
+    """ Tests for the incremental sync of the recipes """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='testemail@abc.com',password='testpass123')
+        self.client.force_authenticate(self.user)
+
+    def _sync(self, since=None):
+        """ helper to sync from a token """
+        res = self.client.get(SYNC_URL, {} if since is None else {'since': since})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data
+
+    def test_full_sync(self):
+        """ test a sync without a token returns every row and link of the user """
+        recipe = create_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+        recipe.tags.add(tag)
+        recipe.ingredients.add(ingredient)
+        create_recipe(create_user(email='other@abc.com', password='testpass123'))
+
+        data = self._sync()
+
+        self.assertEqual([item['id'] for item in data['recipes']], [recipe.id])
+        self.assertEqual(data['recipes'][0]['title'], recipe.title)
+        self.assertEqual(data['tags'], [{'id': tag.id, 'name': 'Vegan'}])
+        self.assertEqual(data['ingredients'], [{'id': ingredient.id, 'name': 'Salt'}])
+        self.assertEqual(data['recipe_tags'], [[recipe.id, tag.id]])
+        self.assertEqual(data['recipe_ingredients'], [[recipe.id, ingredient.id]])
+        self.assertFalse(data['more'])
+        self.assertEqual(data['deleted'], {
+            'recipes': [], 'tags': [], 'ingredients': [], 'recipe_tags': [], 'recipe_ingredients': []})
+
+    def test_incremental_sync(self):
+        """ test a sync with a token returns only the later changes and tombstones """
+        recipe = create_recipe(self.user)
+        deleted = create_recipe(self.user, title='Deleted')
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        token = self._sync()['token']
+
+        self.client.patch(create_detial_url(recipe.id), {'title': 'Changed', 'tags': [{'name': 'Vegan'}]},
+                          format='json')
+        deleted_id = deleted.id
+        deleted.delete()
+        data = self._sync(token)
+
+        self.assertEqual([item['title'] for item in data['recipes']], ['Changed'])
+        self.assertEqual(data['tags'], [])
+        self.assertEqual(data['recipe_tags'], [[recipe.id, tag.id]])
+        self.assertEqual(data['deleted']['recipes'], [deleted_id])
+
+        self.assertEqual(self._sync(data['token'])['recipes'], [])
+
+    def test_sync_unchanged_is_small(self):
+        """ test a sync without changes returns the same token and no rows """
+        create_recipe(self.user)
+        token = self._sync()['token']
+
+        data = self._sync(token)
+
+        self.assertEqual(data['token'], token)
+        self.assertEqual(data['recipes'], [])
+
+    def test_sync_paging(self):
+        """ test a sync stops after PAGE_SIZE changes and tells to sync again """
+        recipes = [create_recipe(self.user) for _ in range(3)]
+
+        with patch.dict(sync.SYNC, {'PAGE_SIZE': 2}):
+            first = self._sync()
+            second = self._sync(first['token'])
+
+        self.assertTrue(first['more'])
+        self.assertFalse(second['more'])
+        self.assertEqual([item['id'] for item in first['recipes'] + second['recipes']],
+                         [recipe.id for recipe in recipes])
+
+    def test_bulk_import_is_synced(self):
+        """ test recipes created by the bulk import are synced with their links """
+        body = json.dumps([{'title': 'Imported', 'time_minutes': 10, 'price': '5.50',
+                            'calories_per_serving': 100, 'tags': [{'name': 'Imported'}]}])
+        res = self.client.post(BULK_IMPORT_URL, body, content_type='application/json')
+        b''.join(res.streaming_content)
+
+        data = self._sync()
+
+        recipe = Recipe.objects.get(user=self.user)
+        tag = Tag.objects.get(user=self.user)
+        self.assertEqual([item['id'] for item in data['recipes']], [recipe.id])
+        self.assertEqual(data['tags'], [{'id': tag.id, 'name': 'Imported'}])
+        self.assertEqual(data['recipe_tags'], [[recipe.id, tag.id]])
+
+    def test_invalid_token(self):
+        """ test a token not returned by a sync is rejected """
+        for since in ('abc', '-1', '5'):
+            res = self.client.get(SYNC_URL, {'since': since})
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('since', res.data)
+
+    def test_pruned_token(self):
+        """ test a token from before pruned tombstones asks for a full sync """
+        create_recipe(self.user).delete()
+        create_recipe(self.user)
+        ChangeCounter.objects.filter(user=self.user).update(pruned=2)
+
+        res = self.client.get(SYNC_URL, {'since': '1'})
 
+        self.assertEqual(res.status_code, status.HTTP_410_GONE)
+        self.assertEqual(len(self._sync()['recipes']), 1)
 
+
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
 class TestRecipeImageAPI(TestCase):
     """ Tests for recipe images """
     def setUp(self):
@@ -458,7 +1411,20 @@ class TestRecipeImageAPI(TestCase):
         self.url = create_image_detail_url(self.recipe.id)
 
     def tearDown(self):
-        self.recipe.image.delete()
+        self.recipe.refresh_from_db()
+        with execute_on_commit():
+            renditions.delete_files(self.recipe.renditions)
+            self.recipe.image.delete()
+
+    def _upload(self, size=(800, 600), orientation=1):
+        """ upload a jpeg carrying exif metadata """
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        exif[0x010F] = 'Camera maker'
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            Image.new('RGB', size).save(image_file, format='JPEG', exif=exif)
+            image_file.seek(0)
+            return self.client.post(self.url, {'image': image_file}, format='multipart')
 
     def test_add_image_to_recipe(self):
         """ test to add image to recipe """
@@ -480,4 +1446,400 @@ class TestRecipeImageAPI(TestCase):
         payload={'image':'nonimage'}
         res = self.client.post(self.url, payload, format='multipart')
 
-        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch.dict(renditions.RENDITIONS, {'ALWAYS_EAGER': True})
+    def test_upload_generates_renditions(self):
+        """ test resized webp/jpeg renditions are recorded without metadata """
+        with execute_on_commit():
+            res = self._upload(orientation=6)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        self.recipe.refresh_from_db()
+        thumb = self.recipe.renditions['thumb']
+        # rotated by the exif orientation before resizing
+        self.assertEqual((thumb['width'], thumb['height']), (240, 320))
+        self.assertEqual(self.recipe.renditions['medium']['height'], 800)
+
+        for image_format, pil_format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+            with default_storage.open(thumb[image_format]) as image_file:
+                image = Image.open(image_file)
+                self.assertEqual(image.format, pil_format)
+                self.assertEqual(len(image.getexif()), 0)
+
+        listed = self.client.get(RECIPES_URL).data['results'][0]
+        self.assertTrue(listed['image'].endswith(thumb['webp']))
+        detail = self.client.get(create_detial_url(self.recipe.id)).data
+        self.assertTrue(detail['renditions']['thumb']['jpeg'].endswith(thumb['jpeg']))
+        self.assertTrue(detail['image'].endswith(self.recipe.image.name))
+
+    @patch.dict(renditions.RENDITIONS, {'ALWAYS_EAGER': True})
+    def test_new_upload_replaces_renditions(self):
+        """ test the renditions of a replaced image are deleted """
+        with execute_on_commit():
+            self._upload()
+        self.recipe.refresh_from_db()
+        old_thumb = self.recipe.renditions['thumb']['webp']
+        old_image = self.recipe.image.name
+
+        with execute_on_commit():
+            self._upload(size=(600, 600))
+        self.recipe.refresh_from_db()
+
+        self.assertFalse(default_storage.exists(old_thumb))
+        self.assertFalse(default_storage.exists(old_image))
+        self.assertTrue(default_storage.exists(self.recipe.renditions['thumb']['webp']))
+
+    @patch.dict(renditions.RENDITIONS, {'ALWAYS_EAGER': True})
+    def test_update_keeps_image_and_renditions(self):
+        """ test the image is only changed by the upload actions, along with its renditions """
+        with execute_on_commit():
+            self._upload()
+        self.recipe.refresh_from_db()
+        image, stale = self.recipe.image.name, self.recipe.renditions
+
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            Image.new('RGB', (600, 600)).save(image_file, format='JPEG')
+            image_file.seek(0)
+            res = self.client.patch(create_detial_url(self.recipe.id), {'image': image_file},
+                                    format='multipart')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        res = self.client.patch(create_detial_url(self.recipe.id), {'image': None}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        self.recipe.refresh_from_db()
+        self.assertEqual((self.recipe.image.name, self.recipe.renditions), (image, stale))
+        self.assertTrue(res.data['image'].endswith(image))
+        self.assertTrue(res.data['renditions']['thumb']['webp'].endswith(stale['thumb']['webp']))
+
+    @patch('recipe.renditions._executor')
+    def test_update_replacing_image_stores_nothing(self, patched_executor):
+        """ test a PATCH with a new image neither stores it nor references it """
+        self._upload()
+        self.recipe.refresh_from_db()
+        references = list(StoredFile.objects.values_list('name', 'refcount'))
+        content = create_image_bytes(size=(600, 600))
+        image_file = io.BytesIO(content)
+        image_file.name = 'photo.jpg'
+
+        res = self.client.patch(create_detial_url(self.recipe.id), {'image': image_file},
+                                format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(StoredFile.objects.values_list('name', 'refcount')), references)
+        digest = hashlib.sha256(content).hexdigest()
+        self.assertFalse(default_storage.exists(f'uploads/recipe/{digest[:2]}/{digest}.jpg'))
+
+    @patch('recipe.renditions._executor')
+    def test_update_clearing_image_keeps_reference(self, patched_executor):
+        """ test a PATCH clearing the image leaves it referenced until the recipe is deleted """
+        self._upload()
+        self.recipe.refresh_from_db()
+        name = self.recipe.image.name
+
+        res = self.client.patch(create_detial_url(self.recipe.id), {'image': None}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(StoredFile.objects.get(name=name).refcount, 1)
+        with execute_on_commit():
+            self.client.delete(create_detial_url(self.recipe.id))
+        self.assertFalse(default_storage.exists(name))
+        self.recipe = create_recipe(user=self.user)
+
+    @patch('recipe.renditions._executor')
+    def test_rejected_upload_releases_image(self, patched_executor):
+        """ test an image streamed to the storage is released when the upload fails validation """
+        content = create_image_bytes()
+        image_file = io.BytesIO(content)
+        image_file.name = 'photo.jpg'
+        rejected = ValidationError('Rejected.')
+
+        with patch.object(RecipeImageSerializer, 'validate', side_effect=rejected), execute_on_commit():
+            res = self.client.post(self.url, {'image': image_file}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(StoredFile.objects.filter(refcount__gt=0).exists())
+        digest = hashlib.sha256(content).hexdigest()
+        self.assertFalse(default_storage.exists(f'uploads/recipe/{digest[:2]}/{digest}.jpg'))
+        patched_executor.submit.assert_not_called()
+
+    @patch.dict(renditions.RENDITIONS, {'ALWAYS_EAGER': True})
+    def test_failed_renditions_release_files(self):
+        """ test a failing generation is logged and releases the new and stale files """
+        with execute_on_commit():
+            self._upload()
+        self.recipe.refresh_from_db()
+        old_thumb = self.recipe.renditions['thumb']['webp']
+
+        encode = renditions._encode
+        calls = []
+
+        def failing_encode(*args):
+            calls.append(args)
+            if len(calls) > 2:
+                raise OSError('encoder failed')
+            return encode(*args)
+
+        with patch('recipe.renditions._encode', failing_encode), \
+                self.assertLogs('recipe.renditions', 'ERROR'), execute_on_commit():
+            res = self._upload(size=(600, 600))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.renditions, {})
+        self.assertFalse(default_storage.exists(old_thumb))
+        self.assertEqual(list(StoredFile.objects.filter(refcount__gt=0).values_list('name', flat=True)),
+                         [self.recipe.image.name])
+
+    @patch('recipe.renditions._executor')
+    def test_upload_returns_before_processing(self, patched_executor):
+        """ test the upload only schedules the renditions on the pool """
+        with execute_on_commit():
+            res = self._upload()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.renditions, {})
+        patched_executor.submit.assert_called_once_with(
+            renditions._run, self.recipe.id, self.user.id, self.recipe.image.name, {})
+
+    @patch('recipe.renditions._executor')
+    def test_identical_uploads_share_one_file(self, patched_executor):
+        """ test an image uploaded to two recipes is stored once until both are deleted """
+        other = create_recipe(user=self.user)
+        content = create_image_bytes()
+        for recipe in (self.recipe, other):
+            image_file = io.BytesIO(content)
+            image_file.name = 'photo.JPG'
+            res = self.client.post(create_image_detail_url(recipe.id), {'image': image_file},
+                                   format='multipart')
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        self.recipe.refresh_from_db()
+        other.refresh_from_db()
+        name = self.recipe.image.name
+        self.assertEqual(other.image.name, name)
+        self.assertTrue(name.endswith('.jpg'))
+        self.assertIn(hashlib.sha256(content).hexdigest(), name)
+
+        with execute_on_commit():
+            other.delete()
+        self.assertTrue(default_storage.exists(name))
+
+        with execute_on_commit():
+            self.client.delete(create_detial_url(self.recipe.id))
+        self.assertFalse(default_storage.exists(name))
+        self.recipe = create_recipe(user=self.user)
+
+    @patch.dict(uploads.IMAGE_UPLOAD, {'CHUNK_SIZE': 1024})
+    def test_upload_is_streamed_to_storage(self):
+        """ test the image is written by the streaming handler, not copied """
+        buffer = io.BytesIO()
+        # noise does not compress, the file spans many chunks
+        Image.frombytes('RGB', (100, 100), os.urandom(30000)).save(buffer, format='PNG')
+        content = buffer.getvalue()
+        image_file = io.BytesIO(content)
+        image_file.name = 'photo.png'
+        with patch('recipe.uploads.StorageWriter.write',
+                   autospec=True, side_effect=uploads.StorageWriter.write) as patched_write:
+            res = self.client.post(self.url, {'image': image_file}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertGreater(patched_write.call_count, 1)
+        self.recipe.refresh_from_db()
+        self.assertTrue(self.recipe.image.name.endswith('.png'))
+        with default_storage.open(self.recipe.image.name) as stored:
+            self.assertEqual(stored.read(), content)
+
+    def test_upload_non_image_file_fails(self):
+        """ test a file without a valid image header is rejected and not kept """
+        text_file = io.BytesIO(b'not an image' * 1000)
+        text_file.name = 'photo.jpg'
+        with patch('recipe.uploads.StorageWriter.discard', autospec=True,
+                   side_effect=uploads.StorageWriter.discard) as patched_discard:
+            res = self.client.post(self.url, {'image': text_file}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', res.data)
+        self.assertFalse(default_storage.exists(patched_discard.call_args[0][0].name))
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+    @patch.dict(uploads.IMAGE_UPLOAD, {'MAX_SIZE': 1000})
+    def test_upload_too_large_fails(self):
+        """ test an image over MAX_SIZE is rejected """
+        res = self._upload()
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('too large', str(res.data['image']))
+
+    @patch.dict(uploads.IMAGE_UPLOAD, {'MAX_PIXELS': 1000})
+    def test_upload_too_many_pixels_fails(self):
+        """ test the image dimensions are checked from the header """
+        res = self._upload()
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
+class TestResumableRecipeImageAPI(TestCase):
+    """ Tests for resumable recipe image uploads """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(email='test@abc.com',password='testpass123')
+        self.client.force_authenticate(self.user)
+        self.recipe = create_recipe(user=self.user)
+        self.content = create_image_bytes()
+
+    def tearDown(self):
+        self.recipe.refresh_from_db()
+        with execute_on_commit():
+            if self.recipe.image:
+                self.recipe.image.delete()
+            for upload in ImageUpload.objects.all():
+                uploads.discard_upload(upload)
+
+    def _start(self, length=None):
+        res = self.client.post(create_image_uploads_url(self.recipe.id),
+                               HTTP_UPLOAD_LENGTH=str(length or len(self.content)))
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return res['Location']
+
+    def _patch(self, url, offset, data):
+        return self.client.generic('PATCH', url, data,
+                                   content_type='application/offset+octet-stream',
+                                   HTTP_UPLOAD_OFFSET=str(offset))
+
+    @patch('recipe.renditions._executor')
+    def test_resumable_upload_in_chunks(self, patched_executor):
+        """ test the image is saved once all the chunks were appended """
+        url = self._start()
+        half = len(self.content) // 2
+
+        res = self._patch(url, 0, self.content[:half])
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(res['Upload-Offset'], str(half))
+
+        res = self.client.head(url)
+        self.assertEqual(res['Upload-Offset'], str(half))
+
+        with execute_on_commit():
+            res = self._patch(url, half, self.content[half:])
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        self.recipe.refresh_from_db()
+        self.assertTrue(self.recipe.image.name.endswith('.jpeg'))
+        with default_storage.open(self.recipe.image.name) as stored:
+            self.assertEqual(stored.read(), self.content)
+        self.assertFalse(ImageUpload.objects.exists())
+        patched_executor.submit.assert_called_once()
+
+    def test_offset_mismatch_conflicts(self):
+        """ test a chunk sent at the wrong offset is rejected with the current one """
+        url = self._start()
+        self._patch(url, 0, self.content[:100])
+
+        res = self._patch(url, 50, self.content[50:200])
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res['Upload-Offset'], '100')
+
+    def test_concurrent_append_conflicts(self):
+        """ test a chunk is rejected while another request appends to the upload """
+        url = self._start()
+        upload = ImageUpload.objects.get()
+        locked, release = threading.Event(), threading.Event()
+
+        def append():
+            # a request of another worker, on its own connection
+            try:
+                with uploads.appending(upload):
+                    locked.set()
+                    release.wait()
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=append)
+        thread.start()
+        try:
+            locked.wait()
+            res = self._patch(url, 0, self.content)
+        finally:
+            release.set()
+            thread.join()
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res['Upload-Offset'], '0')
+        self.assertEqual(self._patch(url, 0, self.content[:100]).status_code,
+                         status.HTTP_204_NO_CONTENT)
+
+    def test_chunk_streamed_outside_transaction(self):
+        """ test no transaction, and so no row lock, is held while the body is read """
+        url = self._start()
+        depth = len(connection.savepoint_ids)
+        append_chunk = uploads.append_chunk
+        depths = []
+
+        def appending(*args):
+            depths.append(len(connection.savepoint_ids))
+            return append_chunk(*args)
+
+        with patch('recipe.uploads.append_chunk', side_effect=appending):
+            res = self._patch(url, 0, self.content[:100])
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(depths, [depth])
+
+    @patch('recipe.renditions._executor')
+    def test_failed_save_releases_image(self, patched_executor):
+        """ test the image of a complete upload is released when the recipe is not saved """
+        url = self._start()
+
+        with patch.object(Recipe, 'save', side_effect=DatabaseError('failed')), \
+                execute_on_commit(), self.assertRaises(DatabaseError):
+            self._patch(url, 0, self.content)
+
+        self.assertFalse(StoredFile.objects.filter(refcount__gt=0).exists())
+        digest = hashlib.sha256(self.content).hexdigest()
+        self.assertFalse(default_storage.exists(f'uploads/recipe/{digest[:2]}/{digest}.jpeg'))
+        patched_executor.submit.assert_not_called()
+
+    def test_invalid_image_discards_upload(self):
+        """ test the upload is discarded as soon as the header is rejected """
+        content = b'not an image' * 30000
+        url = self._start(length=len(content))
+
+        res = self._patch(url, 0, content)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ImageUpload.objects.exists())
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+    def test_upload_too_large_rejected(self):
+        """ test an upload longer than MAX_SIZE cannot be started """
+        res = self.client.post(create_image_uploads_url(self.recipe.id),
+                               HTTP_UPLOAD_LENGTH=str(uploads.IMAGE_UPLOAD['MAX_SIZE'] + 1))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch.dict(uploads.IMAGE_UPLOAD, {'SESSION_TTL': -1})
+    def test_expired_upload_gone(self):
+        """ test an expired upload session is discarded """
+        url = self._start()
+
+        res = self._patch(url, 0, self.content)
+
+        self.assertEqual(res.status_code, status.HTTP_410_GONE)
+        self.assertFalse(ImageUpload.objects.exists())
+
+    def test_other_users_recipe_upload_not_found(self):
+        """ test uploads cannot be started on another user's recipe """
+        other = get_user_model().objects.create_user(email='other@abc.com', password='testpass123')
+        recipe = create_recipe(user=other)
+
+        res = self.client.post(create_image_uploads_url(recipe.id),
+                               HTTP_UPLOAD_LENGTH=str(len(self.content)))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
@@ -1,5 +1,9 @@
 """ Test for Tags API """
 
+from unittest.mock import patch
+
+import msgpack
+
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.test import TestCase
@@ -7,6 +11,7 @@ from django.test import TestCase
 from rest_framework import status
 from rest_framework.test import APIClient
 
+from core import queries
 from core.models import Tag
 from recipe.serializers import TagSerializer
 
@@ -20,6 +25,7 @@ def create_user(email='test@abc.com', password='testpass123'):
     """ create user function """
     return get_user_model().objects.create_user(email=email,password=password)
 
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
 class PublicTagsAPITest(TestCase):
     """ Test for unauthenticated Tags API request"""
 
@@ -32,6 +38,7 @@ class PublicTagsAPITest(TestCase):
         
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
+@patch.dict(queries.QUERY_INSPECTION, {'STRICT': True})
 class PrivateTagsAPITest(TestCase):
     """ Tests for authenticated Tags API request """
 
@@ -53,7 +60,27 @@ class PrivateTagsAPITest(TestCase):
         tags = Tag.objects.all().order_by('-name')
         serializer = TagSerializer(tags, many=True)
 
-        self.assertEqual(res.data,serializer.data)
+        self.assertEqual(res.data['results'],serializer.data)
+
+    def test_tag_list_msgpack(self):
+        """ test tags are listed in MessagePack when accepted """
+        tag = Tag.objects.create(user=self.user, name='Tag1')
+
+        res = self.client.get(TAGS_URL, HTTP_ACCEPT='application/msgpack')
+
+        self.assertEqual(res['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(res.content)['results'], [{'id': tag.id, 'name': 'Tag1'}])
+
+    def test_update_tag_msgpack(self):
+        """ test a tag is updated from a MessagePack body """
+        tag = Tag.objects.create(user=self.user, name='Tag1')
+
+        res = self.client.patch(get_detail_url(tag.id), msgpack.packb({'name': 'Tag2'}),
+                                content_type='application/msgpack')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        tag.refresh_from_db()
+        self.assertEqual(tag.name, 'Tag2')
 
     def test_tag_list_for_authorized_user_only(self):
         """ test to list tags of authenticated user only """
@@ -65,9 +92,9 @@ class PrivateTagsAPITest(TestCase):
         res = self.client.get(TAGS_URL)
         self.assertEqual(res.status_code,status.HTTP_200_OK)
 
-        self.assertEqual(len(res.data),1)
-        self.assertEqual(res.data[0]['name'],t1.name)
-        self.assertEqual(res.data[0]['id'],t1.id)
+        self.assertEqual(len(res.data['results']),1)
+        self.assertEqual(res.data['results'][0]['name'],t1.name)
+        self.assertEqual(res.data['results'][0]['id'],t1.id)
 
     def test_update_tag(self):
         """ test for update the Tag api"""
@@ -83,6 +110,17 @@ class PrivateTagsAPITest(TestCase):
         self.assertEqual(tag.name, payload['name'])
 
 
+    def test_update_tag_to_existing_name(self):
+        """ test renaming a tag to a name the user already has is rejected """
+        Tag.objects.create(user=self.user, name='Dinner')
+        tag = Tag.objects.create(user=self.user, name='Supper')
+
+        res = self.client.patch(get_detail_url(tag.id), {'name': 'Dinner'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        tag.refresh_from_db()
+        self.assertEqual(tag.name, 'Supper')
+
     def test_delete_tag(self):
         """ test to delete Tag api """
         tag = Tag.objects.create(user=self.user,name='To be Deleted')
@@ -93,8 +131,37 @@ class PrivateTagsAPITest(TestCase):
 
         self.assertFalse(Tag.objects.filter(id=tag.id).exists())
 
+    def test_tag_list_cursor_pagination(self):
+        """ test tag list is paginated with a cursor seeking on -name """
+        for name in ['a', 'b', 'c']:
+            Tag.objects.create(user=self.user, name=name)
 
+        res = self.client.get(TAGS_URL, {'page_size': 2})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([t['name'] for t in res.data['results']], ['c', 'b'])
 
+        res = self.client.get(res.data['next'])
+        self.assertEqual([t['name'] for t in res.data['results']], ['a'])
+        self.assertIsNone(res.data['next'])
 
-    
+    def test_tag_list_if_none_match(self):
+        """ test an unchanged tag list is answered with 304 until a rename """
+        tag = Tag.objects.create(user=self.user, name='Dinner')
+        etag = self.client.get(TAGS_URL)['ETag']
+
+        res = self.client.get(TAGS_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.patch(get_detail_url(tag.id), {'name': 'Supper'})
+        res = self.client.get(TAGS_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_tag_search(self):
+        """ test ?search= returns the matching tag names only """
+        for name in ['Dinner', 'Dessert', 'Breakfast']:
+            Tag.objects.create(user=self.user, name=name)
+
+        res = self.client.get(TAGS_URL, {'search': 'des'})
 
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([t['name'] for t in res.data], ['Dessert'])
@@ -0,0 +1,326 @@
+""" Streaming and resumable recipe image uploads
+
+Uploaded images are written to the storage chunk by chunk as they arrive,
+so a worker only holds one chunk plus the image header in memory however
+large the file is. The header is parsed with Pillow as soon as enough of
+it arrived, which rejects non images, unsupported formats and
+decompression bombs without ever decoding the pixels.
+
+Resumable uploads keep the bytes received so far in a partial file and
+their count in a core.models.ImageUpload session: clients append chunks
+with PATCH at the offset they were told and ask for it again with HEAD
+after a dropped connection.
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from PIL import Image
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.db import connection
+
+from core.models import recipe_image_file_path
+from core.storage import TEMP_DIR, temp_name
+
+IMAGE_UPLOAD = {
+    'MAX_SIZE': 10 * 1024 * 1024,
+    'MAX_PIXELS': 40 * 1000 * 1000,
+    'FORMATS': ['JPEG', 'PNG', 'WEBP', 'GIF'],
+    # images whose header does not fit in this many bytes are rejected
+    'MAX_HEADER_SIZE': 256 * 1024,
+    'CHUNK_SIZE': 64 * 1024,
+    # resumable upload sessions expire this many seconds after creation
+    'SESSION_TTL': 24 * 60 * 60,
+}
+IMAGE_UPLOAD.update(getattr(settings, 'IMAGE_UPLOAD', {}))
+
+FIELD_NAME = 'image'
+
+
+class InvalidImage(ValueError):
+    """ Raised when the bytes received so far cannot be an accepted image """
+
+
+class HeaderSniffer:
+    """ Identify an image from its first bytes, fed as they arrive """
+
+    def __init__(self):
+        self.image_format = None
+        self._header = bytearray()
+
+    def feed(self, data):
+        """ Feed the next bytes, raises InvalidImage as soon as they cannot be one """
+        if self.image_format is not None:
+            return
+
+        self._header += data[:IMAGE_UPLOAD['MAX_HEADER_SIZE'] - len(self._header)]
+        try:
+            # only parses the header, the pixels are never decoded
+            image = Image.open(io.BytesIO(self._header))
+        except Image.DecompressionBombError:
+            raise InvalidImage('Image dimensions are too large.')
+        except (OSError, SyntaxError):
+            # unidentified or truncated, wait for more bytes
+            if len(self._header) >= IMAGE_UPLOAD['MAX_HEADER_SIZE']:
+                raise InvalidImage('Upload a valid image.')
+            return
+
+        if image.format not in IMAGE_UPLOAD['FORMATS']:
+            raise InvalidImage(f'Unsupported image format {image.format}.')
+        if image.width * image.height > IMAGE_UPLOAD['MAX_PIXELS']:
+            raise InvalidImage('Image dimensions are too large.')
+
+        self.image_format = image.format
+        self._header = None
+
+    def close(self):
+        """ Raises InvalidImage if all the bytes were fed without a valid header """
+        if self.image_format is None:
+            raise InvalidImage('Upload a valid image.')
+
+
+class StorageWriter:
+    """ Write a file to the default storage a chunk at a time
+
+    Filesystem storages are written in place. Other backends are spooled to
+    a temporary file on disk, never in memory, and saved on close. The
+    sha256 of what is written is computed along the way.
+    """
+
+    def __init__(self, name, offset=0):
+        """ offset is the number of bytes of an existing file to append to """
+        self.name = name
+        self.sha256 = hashlib.sha256() if not offset else None
+        try:
+            path = default_storage.path(name)
+        except NotImplementedError:
+            self._path = None
+            self._file = tempfile.TemporaryFile()
+            if offset:
+                with default_storage.open(name) as existing:
+                    shutil.copyfileobj(existing, self._file, IMAGE_UPLOAD['CHUNK_SIZE'])
+        else:
+            self._path = path
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._file = open(path, 'ab' if offset else 'wb')
+        # drop the bytes of an append that failed after they were written
+        self._file.truncate(offset)
+        self._file.seek(offset)
+
+    def write(self, data):
+        self._file.write(data)
+        if self.sha256 is not None:
+            self.sha256.update(data)
+
+    def close(self):
+        if self._path is None and not self._file.closed:
+            self._file.seek(0)
+            default_storage.delete(self.name)
+            default_storage.save(self.name, File(self._file))
+        self._file.close()
+
+    def discard(self):
+        """ Stop writing and delete what was written """
+        if self._path is not None:
+            self._file.close()
+            default_storage.delete(self.name)
+        else:
+            self._file.close()
+
+
+def store(written, file_name, digest=None):
+    """ Save a file written to the storage at written as a recipe image
+
+    Content addressed storages move it in place, others get a copy.
+    Returns the image name.
+    """
+    name = recipe_image_file_path(None, file_name)
+    if hasattr(default_storage, 'adopt'):
+        return default_storage.adopt(written, name, digest)
+
+    with default_storage.open(written) as received:
+        name = default_storage.save(name, File(received))
+    default_storage.delete(written)
+    return name
+
+
+class StoredUploadedFile(UploadedFile):
+    """ An uploaded image already written to the storage under storage_name
+
+    error is set instead when the image was rejected while streaming.
+    """
+
+    def __init__(self, storage_name=None, error=None, **kwargs):
+        super().__init__(**kwargs)
+        self.storage_name = storage_name
+        self.error = error
+
+
+class StreamingImageUploadHandler(FileUploadHandler):
+    """ Upload handler streaming the image field of a multipart body to the storage
+
+    Other fields are left to the next handlers. The stored images are added
+    to claimed, a core.storage.Claim, and released unless the view keeps
+    the one it saves.
+    """
+
+    def __init__(self, request=None, claimed=None):
+        super().__init__(request)
+        self.claimed = claimed
+        self.chunk_size = IMAGE_UPLOAD['CHUNK_SIZE']
+        self.writer = None
+        self.error = None
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.writer = None
+        if field_name != FIELD_NAME:
+            return
+
+        self.error = None
+        self.sniffer = HeaderSniffer()
+        self.writer = StorageWriter(temp_name('uploads'))
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.writer is None:
+            return raw_data
+        if self.error is not None:
+            # rejected, the rest of the file is read but not stored
+            return None
+
+        try:
+            if start + len(raw_data) > IMAGE_UPLOAD['MAX_SIZE']:
+                raise InvalidImage('Image file is too large.')
+            self.sniffer.feed(raw_data)
+        except InvalidImage as exc:
+            self.error = str(exc)
+            self.writer.discard()
+            return None
+
+        self.writer.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.writer is None:
+            return None
+
+        if self.error is None:
+            try:
+                self.sniffer.close()
+            except InvalidImage as exc:
+                self.error = str(exc)
+                self.writer.discard()
+            else:
+                self.writer.close()
+
+        storage_name = None
+        if self.error is None:
+            storage_name = store(self.writer.name, self.file_name, self.writer.sha256.hexdigest())
+            if self.claimed is not None:
+                self.claimed.add(storage_name)
+
+        uploaded = StoredUploadedFile(
+            storage_name=storage_name,
+            error=self.error,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra,
+        )
+        self.writer = None
+        return uploaded
+
+    def upload_interrupted(self):
+        if self.writer is not None and self.error is None:
+            self.writer.discard()
+
+
+def partial_name(upload):
+    """ Storage name of the bytes received so far for a resumable upload """
+    return os.path.join(TEMP_DIR, 'partial', str(upload.id))
+
+
+@contextmanager
+def appending(upload):
+    """ Hold the lock of a resumable upload while a chunk is appended
+
+    Yields whether it was acquired, it is not when another request appends
+    to the same upload. The lock is a postgres session advisory lock rather
+    than a row lock, so no transaction stays open while a slow client sends
+    its chunk, and it is released if the connection drops.
+    """
+    # advisory lock keys are signed bigints
+    key = upload.id.int % (1 << 63)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [key])
+        locked, = cursor.fetchone()
+    try:
+        yield locked
+    finally:
+        if locked:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [key])
+
+
+def append_chunk(upload, stream, length):
+    """ Append up to length bytes read from stream to a resumable upload
+
+    stream is None for an empty body. Returns the number of bytes stored,
+    which the caller adds to the session offset. Raises InvalidImage when
+    the header is rejected.
+    """
+    sniffer = None
+    if upload.offset < IMAGE_UPLOAD['MAX_HEADER_SIZE']:
+        # the header may still be incomplete, sniff it again from the start
+        sniffer = HeaderSniffer()
+        if upload.offset:
+            with default_storage.open(partial_name(upload)) as received:
+                sniffer.feed(received.read(upload.offset))
+
+    writer = StorageWriter(partial_name(upload), offset=upload.offset)
+    written = 0
+    try:
+        while stream is not None and written < length:
+            try:
+                data = stream.read(min(IMAGE_UPLOAD['CHUNK_SIZE'], length - written))
+            except OSError:
+                # the connection dropped, keep what was received so the
+                # client resumes from there
+                break
+            if not data:
+                break
+            if sniffer is not None:
+                sniffer.feed(data)
+            writer.write(data)
+            written += len(data)
+    finally:
+        writer.close()
+
+    return written
+
+
+def finish_upload(upload):
+    """ Validate a complete resumable upload and move it to a recipe image name """
+    sniffer = HeaderSniffer()
+    with default_storage.open(partial_name(upload)) as received:
+        sniffer.feed(received.read(IMAGE_UPLOAD['MAX_HEADER_SIZE']))
+    sniffer.close()
+
+    return store(partial_name(upload), f'image.{sniffer.image_format.lower()}')
+
+
+def discard_upload(upload):
+    """ Delete a resumable upload session and its partial file """
+    default_storage.delete(partial_name(upload))
+    upload.delete()
@@ -16,4 +16,6 @@ app_name ='recipe'
 
 urlpatterns =[
     path('', include(router.urls)),
+    path('media/<path:name>', views.RecipeMediaView.as_view(), name='media'),
+    path('sync/', views.RecipeSyncView.as_view(), name='sync'),
 ]
\ No newline at end of file
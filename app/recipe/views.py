@@ -7,97 +7,370 @@ from drf_spectacular.utils import (
     OpenApiTypes,
 )
 
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+
 from rest_framework.decorators import action
+from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework import viewsets, mixins, status
-from rest_framework.authentication import TokenAuthentication
+from rest_framework import viewsets, mixins, status, exceptions
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.settings import api_settings
 
-from recipe import serializers
-from core.models import Recipe, Tag, Ingredient
+from core import changes, messagepack, search, storage
+from core.authentication import CachedTokenAuthentication
+from recipe import serializers, bulk, filters, media, renditions, sync, uploads
+from recipe.autocomplete import AutocompleteMixin
+from recipe.cache import VersionedCacheMixin
+from recipe.conditional import ConditionalListMixin, ConditionalRetrieveMixin
+from recipe.fastpath import FastReadMixin
+from recipe.pagination import RecipeCursorPagination, RecipeAttrCursorPagination
+from core.models import Recipe, Tag, Ingredient, ImageUpload
 
 @extend_schema_view(
     list=extend_schema(
         parameters=[
+            OpenApiParameter(
+                'q',
+                OpenApiTypes.STR,
+                description='Full text search of title, description, tag and '
+                            'ingredient names, results are ordered by rank',
+            ),
             OpenApiParameter(
                 'tags',
                 OpenApiTypes.STR,
                 description='Comma separated list of tag IDs to filter',
             ),
+            OpenApiParameter(
+                'tags_mode',
+                OpenApiTypes.STR,
+                enum=list(filters.MATCH_MODES),
+                description='Match recipes with any (default) or all of the tags',
+            ),
             OpenApiParameter(
                 'ingredients',
                 OpenApiTypes.STR,
                 description='Comma separated list of ingredient IDs to filter',
             ),
+            OpenApiParameter(
+                'ingredients_mode',
+                OpenApiTypes.STR,
+                enum=list(filters.MATCH_MODES),
+                description='Match recipes with any (default) or all of the ingredients',
+            ),
         ]
-    )
+    ),
+    export=extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'file_format',
+                OpenApiTypes.STR,
+                enum=['ndjson', 'csv'],
+                description='Export file format, ndjson by default',
+            ),
+            OpenApiParameter(
+                'tags',
+                OpenApiTypes.STR,
+                description='Comma separated list of tag IDs to filter',
+            ),
+            OpenApiParameter(
+                'tags_mode',
+                OpenApiTypes.STR,
+                enum=list(filters.MATCH_MODES),
+                description='Match recipes with any (default) or all of the tags',
+            ),
+            OpenApiParameter(
+                'ingredients',
+                OpenApiTypes.STR,
+                description='Comma separated list of ingredient IDs to filter',
+            ),
+            OpenApiParameter(
+                'ingredients_mode',
+                OpenApiTypes.STR,
+                enum=list(filters.MATCH_MODES),
+                description='Match recipes with any (default) or all of the ingredients',
+            ),
+        ]
+    ),
 )
 
 
-class RecipeAPIViewSet(viewsets.ModelViewSet):
+class RecipeAPIViewSet(ConditionalListMixin,
+                       ConditionalRetrieveMixin,
+                       VersionedCacheMixin,
+                       FastReadMixin,
+                       viewsets.ModelViewSet):
     """ View to manage Recipe APIs """
 
     serializer_class = serializers.RecipeDetailSerializer
     queryset = Recipe.objects.all()
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = RecipeCursorPagination
+    # Accept: application/msgpack, with the price in cents
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + messagepack.RENDERER_CLASSES
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES + messagepack.PARSER_CLASSES
+    fixed_point_fields = {'price': 2}
 
     def _get_int_list_from_str(self,qs):
         """ Returns the int list of the , separated string values passed"""
         return [int(str_id) for str_id in qs.split(',')]
 
+    def _get_match_mode(self, field):
+        """ Returns the any/all match mode requested for a filter """
+        mode = self.request.query_params.get(f'{field}_mode', filters.MATCH_ANY)
+        if mode not in filters.MATCH_MODES:
+            raise exceptions.ValidationError({f'{field}_mode': 'Must be any or all.'})
+        return mode
+
     def get_queryset(self):
         """Retrieve recipes for authenticated user."""
         # return super().get_queryset().filter(user=self.request.user).order_by('-id')
         queryset = super().get_queryset()
-        tags = self.request.query_params.get('tags')
-        ingredients = self.request.query_params.get('ingredients')
-
-        if tags:
-            tag_ids = self._get_int_list_from_str(tags)
-            queryset = queryset.filter(tags__id__in = tag_ids)
-        if ingredients:
-            ingredient_ids = self._get_int_list_from_str(ingredients)
-            queryset = queryset.filter(ingredients__id__in = ingredient_ids)
-        
-        return queryset.filter(user=self.request.user).order_by('-id').distinct()
+
+        # EXISTS / IN subqueries instead of joins, see recipe.filters
+        for field in ('tags', 'ingredients'):
+            ids = self.request.query_params.get(field)
+            if ids:
+                queryset = filters.filter_by_links(
+                    queryset, field, self._get_int_list_from_str(ids), self._get_match_mode(field))
+
+        queryset = queryset.filter(user=self.request.user)
+        text = self.request.query_params.get('q')
+        if text:
+            queryset = search.search(queryset, text).order_by('-rank', '-id')
+        else:
+            queryset = queryset.order_by('-id')
+
+        # nested tags/ingredients are loaded with one query each instead of
+        # two extra queries per recipe in the serializer, in the id order of
+        # recipe.fastpath. The search vector is never serialized.
+        return queryset.defer('search_vector').prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.order_by('id')),
+            Prefetch('ingredients', queryset=Ingredient.objects.order_by('id')),
+        )
 
 
     def get_serializer_class(self):
         """ method that returns which serializer class is used """
-        if self.action == 'list':
+        if self.action in ('list', 'bulk_import'):
             return serializers.RecipeSerializer
-        elif self.action == 'upload_image':
+        elif self.action in ('upload_image', 'image_upload'):
             return serializers.RecipeImageSerializer
         
         return super().get_serializer_class()
 
     def perform_create(self, serializer):
         """ Create new recipe """
-        serializer.save(user=self.request.user)
+        # the recipe, its new tags/ingredients and links are one change log write
+        with changes.batch():
+            serializer.save(user=self.request.user)
+
+    def perform_update(self, serializer):
+        """ Update a recipe and its links """
+        with changes.batch():
+            serializer.save()
 
     @action(methods=['POST'],detail=True,url_path='upload-image')
     def upload_image(self,request,pk=None):
         """ Uplaod image to recipe """
         recipe = self.get_object()
-        serializer = self.get_serializer(recipe,data=request.data)
+        # the image is written to the storage while the body is parsed
+        # instead of being buffered by the default handlers, the claim
+        # drops it again unless the recipe is saved with it
+        with storage.claim(default_storage) as claimed:
+            request.upload_handlers.insert(0, uploads.StreamingImageUploadHandler(request, claimed))
+            serializer = self.get_serializer(recipe,data=request.data)
 
-        
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status = status.HTTP_200_OK)
+            if serializer.is_valid():
+                # only the original is written here, lists fall back to it
+                # until the renditions are generated in the background
+                stale, replaced = recipe.renditions, recipe.image.name
+                serializer.save(renditions={})
+                claimed.keep(recipe.image.name)
+                renditions.schedule(recipe, stale=stale)
+                if replaced:
+                    default_storage.delete(replaced)
+                return Response(serializer.data, status = status.HTTP_200_OK)
         
         return Response(serializer.errors,status= status.HTTP_400_BAD_REQUEST)
 
+    def _get_upload_header(self, request, header):
+        """ Returns the non negative integer value of a resumable upload header """
+        try:
+            value = int(request.headers[header])
+        except (KeyError, ValueError):
+            raise exceptions.ValidationError({header: 'Must be a non negative integer.'})
+        if value < 0:
+            raise exceptions.ValidationError({header: 'Must be a non negative integer.'})
+
+        return value
+
+    @extend_schema(request=None, responses={201: None})
+    @action(methods=['POST'], detail=True, url_path='image-uploads')
+    def image_uploads(self, request, pk=None):
+        """ Start a resumable upload of the recipe image
+
+        The total size is sent in the Upload-Length header, the chunks are
+        then sent with PATCH to the returned Location.
+        """
+        recipe = self.get_object()
+        length = self._get_upload_header(request, 'Upload-Length')
+        if not 0 < length <= uploads.IMAGE_UPLOAD['MAX_SIZE']:
+            raise exceptions.ValidationError({'Upload-Length': 'Image file is too large.'})
 
-class BaseRecipeAttrViewSet(mixins.UpdateModelMixin,
+        upload = ImageUpload.objects.create(recipe=recipe, length=length)
+        response = Response(status=status.HTTP_201_CREATED)
+        response['Location'] = request.build_absolute_uri(
+            reverse('recipe:recipe-image-upload', args=[recipe.id, upload.id]))
+        response['Upload-Offset'] = 0
+        response['Upload-Length'] = length
+        return response
+
+    @extend_schema(request=None, responses={200: serializers.RecipeImageSerializer, 204: None})
+    @action(methods=['HEAD', 'PATCH'], detail=True,
+            url_path=r'image-uploads/(?P<upload_id>[0-9a-f-]+)')
+    def image_upload(self, request, pk=None, upload_id=None):
+        """ Resume a recipe image upload
+
+        HEAD returns the number of bytes received in Upload-Offset. PATCH
+        appends the body at Upload-Offset, the image is saved once all the
+        bytes are received.
+        """
+        recipe = self.get_object()
+        upload = ImageUpload.objects.filter(recipe=recipe, id=upload_id).first()
+        if upload is None:
+            raise exceptions.NotFound()
+        age = timezone.now() - upload.created_at
+        if age.total_seconds() > uploads.IMAGE_UPLOAD['SESSION_TTL']:
+            uploads.discard_upload(upload)
+            return Response(status=status.HTTP_410_GONE)
+
+        if request.method == 'PATCH':
+            # one append at a time per upload, the body is streamed outside
+            # of any transaction
+            with uploads.appending(upload) as locked:
+                if locked:
+                    # re-read once locked, a previous append may have moved it
+                    upload = ImageUpload.objects.filter(pk=upload.pk).first()
+                    if upload is None:
+                        raise exceptions.NotFound()
+                offset = self._get_upload_header(request, 'Upload-Offset')
+                if not locked or offset != upload.offset:
+                    response = Response(status=status.HTTP_409_CONFLICT)
+                    response['Upload-Offset'] = upload.offset
+                    return response
+
+                # request.data is never touched, the body is streamed to the
+                # partial file
+                try:
+                    upload.offset += uploads.append_chunk(
+                        upload, request.stream, upload.length - upload.offset)
+                    if upload.offset == upload.length:
+                        return self._finish_image_upload(recipe, upload)
+                except uploads.InvalidImage as exc:
+                    uploads.discard_upload(upload)
+                    return Response({'image': [str(exc)]}, status=status.HTTP_400_BAD_REQUEST)
+                upload.save(update_fields=['offset'])
+
+        response = Response(status=status.HTTP_204_NO_CONTENT)
+        response['Upload-Offset'] = upload.offset
+        response['Upload-Length'] = upload.length
+        return response
+
+    def _finish_image_upload(self, recipe, upload):
+        """ Save the image of a complete resumable upload """
+        with storage.claim(default_storage) as claimed:
+            name = claimed.add(uploads.finish_upload(upload))
+            stale, replaced = recipe.renditions, recipe.image.name
+            with transaction.atomic():
+                upload.delete()
+                recipe.image, recipe.renditions = name, {}
+                recipe.save(update_fields=['image', 'renditions', 'updated_at'])
+            claimed.keep(name)
+
+        renditions.schedule(recipe, stale=stale)
+        if replaced:
+            default_storage.delete(replaced)
+        return Response(self.get_serializer(recipe).data, status=status.HTTP_200_OK)
+
+    @action(methods=['POST'], detail=False, url_path='bulk-import')
+    def bulk_import(self, request):
+        """ Bulk create recipes from a streamed NDJSON or JSON array body """
+        media_type = request.content_type.split(';')[0].strip()
+        if media_type not in bulk.NDJSON_MEDIA_TYPES + bulk.JSON_MEDIA_TYPES:
+            raise exceptions.UnsupportedMediaType(media_type)
+
+        # request.data is never touched, the body is read lazily while the
+        # per row results are streamed back.
+        records = bulk.iter_records(request.stream, media_type)
+        results = bulk.import_recipes(
+            records,
+            serializer_class=self.get_serializer_class(),
+            context=self.get_serializer_context(),
+            user=request.user,
+        )
+
+        return StreamingHttpResponse(
+            bulk.iter_ndjson_results(results),
+            content_type='application/x-ndjson',
+        )
+
+    @action(methods=['GET'], detail=False, url_path='export')
+    def export(self, request):
+        """ Stream all the recipes of the user as NDJSON or CSV """
+        file_format = request.query_params.get('file_format', 'ndjson')
+        if file_format not in ('ndjson', 'csv'):
+            raise exceptions.ValidationError({'file_format': 'Must be ndjson or csv.'})
+
+        chunks = bulk.iter_recipe_chunks(self.get_queryset())
+        if file_format == 'csv':
+            content, content_type = bulk.iter_csv_export, 'text/csv'
+        else:
+            content, content_type = bulk.iter_ndjson_export, 'application/x-ndjson'
+
+        response = StreamingHttpResponse(
+            content(chunks, self.get_serializer_class(), self.get_serializer_context()),
+            content_type=content_type,
+        )
+        response['Content-Disposition'] = f'attachment; filename="recipes.{file_format}"'
+        return response
+
+
+@extend_schema_view(
+    list=extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'search',
+                OpenApiTypes.STR,
+                description='Autocomplete, returns the top matching names '
+                            'instead of a page',
+            ),
+            OpenApiParameter(
+                'limit',
+                OpenApiTypes.INT,
+                description='Number of autocomplete matches, 10 by default',
+            ),
+        ]
+    ),
+)
+class BaseRecipeAttrViewSet(AutocompleteMixin,
+                            ConditionalListMixin,
+                            mixins.UpdateModelMixin,
                             mixins.DestroyModelMixin,
                             mixins.ListModelMixin,
                             viewsets.GenericViewSet):
     """ Base class for Recipe Attributes """
 
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = RecipeAttrCursorPagination
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + messagepack.RENDERER_CLASSES
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES + messagepack.PARSER_CLASSES
 
     def get_queryset(self):
         """Retrieve Tags for authenticated user."""
@@ -115,4 +388,52 @@ class IngredientAPIViewSet(BaseRecipeAttrViewSet):
 
     queryset = Ingredient.objects.all()
     serializer_class = serializers.IngredientSerializer
-    
\ No newline at end of file
+    
+
+
+class RecipeMediaView(APIView):
+    """ Download an image file of one of the user's recipes, see recipe.media """
+
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(responses={200: OpenApiTypes.BINARY})
+    def get(self, request, name):
+        """ Hand the transfer of an owned file to the proxy """
+        # other users' files are indistinguishable from missing ones
+        if not media.is_owner(request.user, name):
+            raise exceptions.NotFound()
+
+        return media.media_response(name)
+
+
+class RecipeSyncView(APIView):
+    """ Incremental sync of the user's recipes, tags and ingredients, see recipe.sync """
+
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'since',
+                OpenApiTypes.STR,
+                description='Token returned by the previous sync, all the rows '
+                            'are returned without it',
+            ),
+        ],
+        responses={200: OpenApiTypes.OBJECT, 410: None},
+    )
+    def get(self, request):
+        """ Return the changes since the token and the next token """
+        try:
+            since = changes.parse_token(request.query_params.get('since', '0'))
+            data = sync.sync_data(request.user, since, request)
+        except changes.InvalidToken:
+            raise exceptions.ValidationError({'since': 'Must be a token returned by a previous sync.'})
+        except changes.ChangesPruned:
+            # deletions since the token are lost, the client starts over
+            return Response({'detail': 'Changes since the token were pruned, sync without since.'},
+                            status=status.HTTP_410_GONE)
+
+        return Response(data)
@@ -5,7 +5,9 @@ from rest_framework import serializers
 
 from django.utils.translation import gettext as _
 
-class UserSerializer(serializers.ModelSerializer):
+from core.metrics import TimedSerializerMixin
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """ Serializer for User model """
 
     class Meta:
@@ -1,10 +1,13 @@
 """ Views for User APIs """
 
-from rest_framework import generics, permissions, authentication
+from django.contrib.auth import get_user_model
+
+from rest_framework import generics, permissions
 from rest_framework.settings import api_settings
 
 from rest_framework.authtoken.views import ObtainAuthToken
 
+from core.authentication import CachedTokenAuthentication
 from user.serializers import UserSerializer,TokenSerializer
 
 class UserCreateAPIView(generics.CreateAPIView):
@@ -20,9 +23,15 @@ class UserManageAPIView(generics.RetrieveUpdateAPIView):
     """ View to retrieve and update an user """
 
     serializer_class = UserSerializer
-    authentication_classes =[authentication.TokenAuthentication]
+    authentication_classes =[CachedTokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        """ Retrieve and return authenticated user """
-        return self.request.user
\ No newline at end of file
+        """ Retrieve and return authenticated user
+
+        The user authenticated from the token cache may be stale, updates
+        reload it so they do not save over changes made since.
+        """
+        if self.request.method in permissions.SAFE_METHODS:
+            return self.request.user
+        return get_user_model().objects.get(pk=self.request.user.pk)
\ No newline at end of file
@@ -1,13 +1,48 @@
 server{
     listen ${LISTEN_PORT};
 
+    # the app compresses its responses and caches the compressed bodies,
+    # see core.compression
+    gzip off;
+
     location /static {
         alias /vol/static;
     }
 
+    # media is only served through the app, which checks recipe ownership
+    location /static/media/ {
+        return 404;
+    }
+
+    # target of the X-Accel-Redirect of authorized media downloads, the
+    # Content-Type and Cache-Control set by the app are kept
+    location /protected-media/ {
+        internal;
+        alias /vol/static/media/;
+    }
+
+    # bulk imports stream their body to the app instead of being buffered
+    location /api/recipe/recipes/bulk-import/ {
+        uwsgi_pass              ${APP_HOST}:${APP_PORT};
+        include                 /etc/nginx/uwsgi_params;
+        client_max_body_size    0;
+        uwsgi_request_buffering off;
+        uwsgi_buffering         off;
+        uwsgi_read_timeout      600s;
+    }
+
+    # images are streamed to the storage as they arrive, and a resumable
+    # chunk cut off by the client keeps the bytes received until then
+    location ~ ^/api/recipe/recipes/\d+/(upload-image|image-uploads)/ {
+        uwsgi_pass              ${APP_HOST}:${APP_PORT};
+        include                 /etc/nginx/uwsgi_params;
+        client_max_body_size    11M;
+        uwsgi_request_buffering off;
+    }
+
     location / {
         uwsgi_pass              ${APP_HOST}:${APP_PORT};
         include                 /etc/nginx/uwsgi_params;
         client_max_body_size    10M;
     }
-}
\ No newline at end of file
+}
@@ -6,4 +6,9 @@ python manage.py wait_for_db
 python manage.py collectstatic --noinput
 python manage.py migrate
 
-uwsgi --socket :9000 --workers 4 --master --enable-threads --module app.wsgi
\ No newline at end of file
+# the request metrics of the previous run's workers, see core.metrics
+rm -rf "${METRICS_DIR:-/vol/metrics}"
+
+# several threads per worker, so the requests of a worker keep being served
+# while some of its threads wait on the password hashing pool, see core.hashing
+uwsgi --socket :9000 --workers 4 --threads "${UWSGI_THREADS:-4}" --master --enable-threads --module app.wsgi
\ No newline at end of file